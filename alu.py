@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  alu.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" ALU de las instrucciones de doble operando.
+
+    Cada operacion recibe (src, dst, sr, byte) y retorna (resultado, sr),
+    donde sr es el registro de status completo con los flags N, Z, C y V
+    ya actualizados. Los flags N y Z (y el C de BIT/AND/XOR) se obtienen
+    de tablas precalculadas, indexadas por el resultado.
+"""
+
+from decode import MOV, ADD, ADDC, SUBC, SUB, CMP, DADD, BIT, BIC, BIS, XOR, AND
+from registers import FLAG_C, FLAG_Z, FLAG_N, FLAG_V, FLAGS, NOT_FLAGS
+
+
+def build_nz_table(bits):
+    """ Tabla de flags N y Z para resultados de <bits> bits """
+    msb = 1 << (bits - 1)
+    table = bytearray(1 << bits)
+    for r in range(1 << bits):
+        table[r] = (FLAG_N if r & msb else 0) | (FLAG_Z if r == 0 else 0)
+    return bytes(table)
+
+
+def build_nzc_table(bits):
+    """ Tabla de flags N, Z y C (C = resultado distinto de 0), usada por
+        BIT, AND y XOR
+    """
+    return bytes(f | (0 if f & FLAG_Z else FLAG_C) for f in build_nz_table(bits))
+
+
+NZ_WORD  = build_nz_table(16)
+NZ_BYTE  = build_nz_table(8)
+NZC_WORD = build_nzc_table(16)
+NZC_BYTE = build_nzc_table(8)
+
+
+def build_dadd_table():
+    """ Suma decimal de un digito BCD: indice (a << 5) | (b << 1) | cy,
+        resultado (cy << 4) | digito. Mismo algoritmo que DADD_faster en
+        test_dadd.py, pero calculado una sola vez.
+    """
+    table = bytearray(512)
+    for a in range(16):
+        for b in range(16):
+            for cy in range(2):
+                dig = a + b + cy
+                if dig > 9:
+                    table[(a << 5) | (b << 1) | cy] = 0x10 | ((dig - 10) & 0x0f)
+                else:
+                    table[(a << 5) | (b << 1) | cy] = dig
+    return bytes(table)
+
+
+DADD_TABLE = build_dadd_table()
+
+
+def alu_mov(src, dst, sr, byte):
+    return src, sr
+
+
+def alu_add(src, dst, sr, byte, cy = 0):
+    if byte:
+        r = src + dst + cy
+        res = r & 0xff
+        flags = NZ_BYTE[res]
+        if r > 0xff:
+            flags |= FLAG_C
+        if (~(src ^ dst) & (src ^ res)) & 0x80:
+            flags |= FLAG_V
+    else:
+        r = src + dst + cy
+        res = r & 0xffff
+        flags = NZ_WORD[res]
+        if r > 0xffff:
+            flags |= FLAG_C
+        if (~(src ^ dst) & (src ^ res)) & 0x8000:
+            flags |= FLAG_V
+    return res, (sr & NOT_FLAGS) | flags
+
+
+def alu_addc(src, dst, sr, byte):
+    return alu_add(src, dst, sr, byte, sr & FLAG_C)
+
+
+def alu_sub(src, dst, sr, byte):
+    # dst - src = dst + ~src + 1
+    return alu_add(~src & (0xff if byte else 0xffff), dst, sr, byte, 1)
+
+
+def alu_subc(src, dst, sr, byte):
+    return alu_add(~src & (0xff if byte else 0xffff), dst, sr, byte, sr & FLAG_C)
+
+
+def alu_dadd(src, dst, sr, byte):
+    cy = sr & FLAG_C
+    res = 0
+    for shift in (0, 4) if byte else (0, 4, 8, 12):
+        d = DADD_TABLE[(((src >> shift) & 0x0f) << 5) |
+                       (((dst >> shift) & 0x0f) << 1) | cy]
+        res |= (d & 0x0f) << shift
+        cy = d >> 4
+
+    flags = (NZ_BYTE if byte else NZ_WORD)[res]
+    if cy:
+        flags |= FLAG_C
+    return res, (sr & NOT_FLAGS) | flags
+
+
+def alu_bit(src, dst, sr, byte):
+    res = src & dst
+    return res, (sr & NOT_FLAGS) | (NZC_BYTE if byte else NZC_WORD)[res]
+
+
+def alu_bic(src, dst, sr, byte):
+    return dst & ~src & (0xff if byte else 0xffff), sr
+
+
+def alu_bis(src, dst, sr, byte):
+    return dst | src, sr
+
+
+def alu_xor(src, dst, sr, byte):
+    res = src ^ dst
+    flags = (NZC_BYTE if byte else NZC_WORD)[res]
+    if src & dst & (0x80 if byte else 0x8000):         # Ambos negativos
+        flags |= FLAG_V
+    return res, (sr & NOT_FLAGS) | flags
+
+
+# Operaciones indexadas por el tipo de instruccion (decode.MOV ... AND)
+ALU_OPS = (alu_mov,         # MOV
+           alu_add,         # ADD
+           alu_addc,        # ADDC
+           alu_subc,        # SUBC
+           alu_sub,         # SUB
+           alu_sub,         # CMP
+           alu_dadd,        # DADD
+           alu_bit,         # BIT
+           alu_bic,         # BIC
+           alu_bis,         # BIS
+           alu_xor,         # XOR
+           alu_bit)         # AND
+
+# Instrucciones que solo actualizan los flags (no escriben el destino)
+NO_WRITEBACK = (False, False, False, False, False, True,
+                False, True, False, False, False, False)
+
+
+def main():
+    for name, op, src, dst, sr in (
+                ("add",  ADD,  0x0001, 0xffff, 0),
+                ("add",  ADD,  0x7fff, 0x0001, 0),
+                ("sub",  SUB,  0x0001, 0x0001, 0),
+                ("cmp",  CMP,  0x0002, 0x0001, 0),
+                ("dadd", DADD, 0x0001, 0x9999, 0),
+                ("dadd", DADD, 0x1443, 0x3299, 0),
+                ("xor",  XOR,  0x8000, 0x8001, 0),
+                ("and",  AND,  0x00f0, 0x0f0f, 0)):
+        res, sr = ALU_OPS[op](src, dst, sr, False)
+        print("{:5s} 0x{:04x}, 0x{:04x} = 0x{:04x}  SR = 0x{:04x}".format(
+                    name, src, dst, res, sr))
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  block_cache.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Cache de bloques basicos traducidos a funciones de Python.
+
+    Un bloque basico empieza en un PC y termina en un salto, un CALL, un
+    RETI o una instruccion que escribe el PC (o al alcanzar MAX_BLOCK
+    instrucciones). Cada bloque se traduce una sola vez a una funcion
+    generada con compile/exec, que ejecuta todo el bloque con los
+    registros en variables locales y retorna el PC siguiente.
+
+    Los ciclos del bloque (timing.CYCLE_TABLE) se suman al traducirlo.
+
+    Las instrucciones de doble operando y los saltos se generan en linea;
+    las de simple operando (y RETI) llaman a la rutina del Simulator.
+
+    El cache vigila (Memory.add_watcher) las paginas que contienen
+    bloques: una escritura en ellas descarta los bloques de esa pagina.
+
+    Los ciclos se suman al terminar el bloque. Para que los perifericos
+    vean el ciclo correcto, una instruccion con un operando absoluto en
+    su espacio (&X < 0x0200) siempre empieza un bloque. Los accesos
+    indirectos (por registro) a perifericos ven el ciclo del comienzo
+    del bloque.
+
+    Una instruccion que escribe el SR como destino (EINT, DINT, entrar
+    en bajo consumo) tambien termina el bloque: CPU.run tiene que ver
+    el cambio de GIE o de CPUOFF antes de la instruccion siguiente.
+
+    Luego de cada escritura en memoria el bloque prueba Block_cache.stop:
+    si la escritura provoco un PUC (RESET, por ejemplo una clave erronea
+    en WDTCTL) o descarto bloques (STALE, codigo que se modifica a si
+    mismo: el bloque en ejecucion puede ser uno de ellos) el bloque sale
+    enseguida, y anota en Block_cache.done las instrucciones y ciclos que
+    ejecuto. Con RESET no se devuelve el SR a los registros (el PUC lo
+    borro) y CPU.run toma el PC de los registros.
+"""
+
+from memory import MemoryException
+from alu import ALU_OPS, NO_WRITEBACK
+from timing import CYCLE_TABLE
+from decode import (DECODE_TABLE, SINGLE1, SINGLE2, RETI, JUMP, DOUBLE,
+                    JNZ, JZ, JNC, JC, JGE, JN, JL, JMP,
+                    MOV, CMP, BIT, BIC, BIS, PUSH, CALL)
+
+MAX_BLOCK = 64
+PERIPHERALS_END = 0x0200
+
+# Motivos para salir de un bloque antes del final (Block_cache.stop)
+STALE = 1
+RESET = 2
+
+# Condicion (sobre la variable local sr) de cada salto
+JUMP_CONDITIONS = {
+    JNZ: "not sr & 2",
+    JZ:  "sr & 2",
+    JNC: "not sr & 1",
+    JC:  "sr & 1",
+    JN:  "sr & 4",
+    JGE: "not ((sr >> 2) ^ (sr >> 8)) & 1",
+    JL:  "((sr >> 2) ^ (sr >> 8)) & 1",
+}
+
+
+def regname(reg):
+    """ Nombre de la variable local que contiene al registro <reg> """
+    return "sr" if reg == 2 else "r%d" % reg
+
+
+def instruction_length(dec):
+    """ Cantidad de palabras (opcode + extensiones) de la instruccion """
+    group, As, Ad, rs, rd = dec[0], dec[3], dec[4], dec[6], dec[7]
+    if group in (SINGLE1, SINGLE2, DOUBLE):
+        words = 1
+        if (As == 1 and rs != 3) or (As == 3 and rs == 0):
+            words += 1
+        if group == DOUBLE and Ad == 1:
+            words += 1
+        return words
+    return 1
+
+
+def peripheral_operand(mem, addr, dec):
+    """ True si la instruccion en <addr> tiene un operando absoluto
+        (&X) en el espacio de perifericos
+    """
+    group, As, Ad, rs, rd = dec[0], dec[3], dec[4], dec[6], dec[7]
+    if group not in (SINGLE1, SINGLE2, DOUBLE):
+        return False
+    ext = addr + 2
+    if As == 1 and rs != 3:
+        if rs == 2 and mem.read_word(ext) < PERIPHERALS_END:
+            return True
+        ext += 2
+    elif As == 3 and rs == 0:
+        ext += 2
+    return group == DOUBLE and Ad == 1 and rd == 2 and mem.read_word(ext) < PERIPHERALS_END
+
+
+def writes_pc(dec):
+    """ True si la instruccion termina el bloque """
+    group, optype, As, Ad, rd = dec[0], dec[1], dec[3], dec[4], dec[7]
+    if group in (JUMP, RETI):
+        return True
+    if group == SINGLE2 and optype == CALL:
+        return True
+    if group in (SINGLE1, SINGLE2):
+        return As == 0 and rd == 0
+    if group == DOUBLE:
+        return Ad == 0 and rd == 0 and not NO_WRITEBACK[optype]
+    return False
+
+
+def writes_sr(dec):
+    """ True si el destino de la instruccion es el SR (no solo las
+        banderas)
+    """
+    group, optype, As, Ad, rd = dec[0], dec[1], dec[3], dec[4], dec[7]
+    if group == DOUBLE:
+        return Ad == 0 and rd == 2 and not NO_WRITEBACK[optype]
+    if group in (SINGLE1, SINGLE2):
+        return As == 0 and rd == 2 and optype not in (PUSH, CALL)
+    return False
+
+
+class Block_translator():
+    """ Genera el codigo fuente de un bloque. Con un <cache>, el bloque
+        puede salir antes de terminar (ver Block_cache.stop).
+    """
+    def __init__(self, sim, cache = None):
+        self.sim = sim
+        self.mem = sim.mem
+        self.cache = cache
+        self.lines = []
+        self.used = set()           # Registros leidos/escritos en linea
+        self.env = {}               # Objetos para el codigo generado
+        self.stored = False         # La instruccion escribe en memoria
+
+
+    def emit(self, line, indent = 1):
+        self.lines.append("    " * indent + line)
+
+
+    def const(self, name, value):
+        self.env[name] = value
+        return name
+
+
+    def reg(self, reg):
+        self.used.add(reg)
+        return regname(reg)
+
+
+    def src(self, As, rs, byte, addr):
+        """ Genera el operando fuente en la variable 's'. Retorna addr """
+        mask = 0xff if byte else 0xffff
+        read = "rb" if byte else "rw"
+
+        if As == 0:
+            if rs == 3:
+                self.emit("s = 0")
+            elif rs == 0:
+                self.emit("s = 0x%04x" % (addr & mask))
+            else:
+                self.emit("s = %s%s" % (self.reg(rs), " & 0xff" if byte else ""))
+            return addr
+
+        if As == 1:
+            if rs == 3:
+                self.emit("s = 1")
+                return addr
+            x = self.mem.read_word(addr)
+            if rs == 2:
+                self.emit("s = %s(0x%04x)" % (read, x))
+            elif rs == 0:
+                self.emit("s = %s(0x%04x)" % (read, (addr + x) & 0xffff))
+            else:
+                self.emit("s = %s((%s + 0x%04x) & 0xffff)" % (read, self.reg(rs), x))
+            return addr + 2
+
+        if As == 2:
+            if rs == 2:
+                self.emit("s = 4")
+            elif rs == 3:
+                self.emit("s = 2")
+            elif rs == 0:
+                self.emit("s = %s(0x%04x)" % (read, addr))
+            else:
+                self.emit("s = %s(%s)" % (read, self.reg(rs)))
+            return addr
+
+        if rs == 2:
+            self.emit("s = 8")
+        elif rs == 3:
+            self.emit("s = 0x%04x" % mask)
+        elif rs == 0:
+            self.emit("s = 0x%04x" % (self.mem.read_word(addr) & mask))
+            return addr + 2
+        else:
+            r = self.reg(rs)
+            self.emit("s = %s(%s)" % (read, r))
+            self.emit("%s = (%s + %d) & 0xffff" % (r, r, 1 if byte and rs != 1 else 2))
+        return addr
+
+
+    def dst(self, Ad, rd, byte, addr, need_value):
+        """ Genera la direccion destino en 'ea' y (si <need_value>) el
+            valor en 'd'. Retorna (ea o None, addr)
+        """
+        if Ad == 0:
+            if need_value:
+                if rd == 0:
+                    self.emit("d = 0x%04x" % (addr & (0xff if byte else 0xffff)))
+                elif rd == 3:
+                    self.emit("d = 0")
+                else:
+                    self.emit("d = %s%s" % (self.reg(rd), " & 0xff" if byte else ""))
+            return None, addr
+
+        x = self.mem.read_word(addr)
+        if rd == 2 or rd == 3:
+            self.emit("ea = 0x%04x" % x)
+        elif rd == 0:
+            self.emit("ea = 0x%04x" % ((addr + x) & 0xffff))
+        else:
+            self.emit("ea = (%s + 0x%04x) & 0xffff" % (self.reg(rd), x))
+        if need_value:
+            self.emit("d = %s(ea)" % ("rb" if byte else "rw"))
+        return "ea", addr + 2
+
+
+    def double(self, nr, addr, dec):
+        """ Genera una instruccion de doble operando. Retorna addr, o None
+            si la instruccion escribe el PC (el codigo ya hace el return)
+        """
+        optype, As, Ad, byte, rs, rd = dec[1], dec[3], dec[4], dec[5], dec[6], dec[7]
+
+        addr = self.src(As, rs, byte, addr)
+        ea, addr = self.dst(Ad, rd, byte, addr, optype != MOV)
+
+        if optype == MOV:
+            self.emit("res = s")
+        elif optype == BIC:
+            self.emit("res = d & ~s & 0x%04x" % (0xff if byte else 0xffff))
+        elif optype == BIS:
+            self.emit("res = d | s")
+        else:
+            op = self.const("op%d" % nr, ALU_OPS[optype])
+            self.emit("res, sr = %s(s, d, sr, %s)" % (op, byte))
+            self.used.add(2)
+
+        if NO_WRITEBACK[optype]:
+            return addr
+
+        if ea != None:
+            self.emit("%s(ea, res)" % ("wb" if byte else "ww"))
+            self.stored = True
+        elif rd == 0:
+            self.spill()
+            self.emit("return res & 0x%04x" % (0xff if byte else 0xffff))
+            return None
+        elif rd != 3:
+            self.emit("%s = res%s" % (self.reg(rd), " & 0xff" if byte else ""))
+        return addr
+
+
+    def jump(self, addr, dec):
+        """ Genera el salto final del bloque """
+        target = (addr + 2*dec[8]) & 0xffff
+        self.spill()
+        if dec[1] == JMP:
+            self.emit("return 0x%04x" % target)
+        else:
+            self.used.add(2)
+            self.emit("return 0x%04x if %s else 0x%04x" % (
+                        target, JUMP_CONDITIONS[dec[1]], addr))
+
+
+    def call(self, nr, addr, opcode, dec):
+        """ Genera la llamada a la rutina del Simulator """
+        h = self.const("h%d" % nr, self.sim.handlers[dec[0]])
+        d = self.const("d%d" % nr, dec)
+        self.spill()
+        if writes_pc(dec):
+            self.emit("return %s(0x%04x, 0x%04x, %s)" % (h, addr, opcode, d))
+        else:
+            self.emit("%s(0x%04x, 0x%04x, %s)" % (h, addr, opcode, d))
+            self.leave_check(self.next_addr, False)
+            self.emit("#RELOAD")
+
+
+    def spill(self):
+        self.emit("#SPILL")
+
+
+    def leave_check(self, next_addr, spill):
+        """ Genera la salida anticipada luego de una escritura (ver
+            Block_cache.stop). Con <spill> los registros estan en las
+            variables locales y hay que devolverlos.
+        """
+        if self.cache == None:
+            return
+        self.emit("if S.stop:")
+        if spill:
+            self.emit("#LEAVE", 2)
+        self.emit("S.done = (%d, %d)" % (self.count, self.cycles), 2)
+        self.emit("return 0x%04x" % next_addr, 2)
+
+
+    def translate(self, start, stops = None):
+        """ Traduce el bloque que empieza en <start>. Retorna
+            (funcion, direccion final, cantidad de instrucciones, ciclos),
+            o None si no hay una instruccion valida en <start>.
+            <stops> es un mapa de 64K (ver breakpoints.py): el bloque
+            termina antes de cualquier direccion marcada en el.
+        """
+        addr = start
+        count = 0
+        cycles = 0
+        ended = False
+        if self.cache != None:
+            self.const("S", self.cache)
+
+        while count < MAX_BLOCK and addr < 0xffc0:
+            if stops != None and count and stops[addr]:
+                break
+            try:
+                opcode = self.mem.load_word_at(addr)
+            except MemoryException:
+                break
+            if opcode == None:
+                break
+
+            dec = DECODE_TABLE[opcode]
+            if count and peripheral_operand(self.mem, addr, dec):
+                break
+            size = instruction_length(dec) * 2
+            count += 1
+            cycles += CYCLE_TABLE[opcode]
+            self.emit("# %04x: %04x" % (addr, opcode))
+            next_addr = addr + 2
+
+            # Para leave_check: instrucciones y ciclos hasta esta inclusive
+            self.count, self.cycles = count, cycles
+            self.next_addr = addr + size
+            self.stored = False
+
+            if dec[0] == DOUBLE:
+                if self.double(count, next_addr, dec) == None:
+                    ended = True
+                elif self.stored:
+                    self.leave_check(addr + size, True)
+            elif dec[0] == JUMP:
+                self.jump(next_addr, dec)
+                ended = True
+            else:
+                self.call(count, next_addr, opcode, dec)
+                ended = writes_pc(dec)
+
+            addr += size
+            if ended or writes_sr(dec):
+                break
+
+        if count == 0:
+            return None
+
+        if not ended:
+            self.spill()
+            self.emit("return 0x%04x" % addr)
+
+        return self.build(start, addr), addr, count, cycles
+
+
+    def build(self, start, end):
+        """ Arma el codigo fuente completo y lo compila """
+        regs = sorted(self.used)
+        load = "; ".join("%s = R[%d]" % (regname(r), r) for r in regs)
+        store = "; ".join("R[%d] = %s" % (r, regname(r)) for r in regs)
+
+        # Salida anticipada: sin el SR si hubo un PUC
+        leave = ["R[%d] = %s" % (r, regname(r)) for r in regs if r != 2]
+        if 2 in regs:
+            leave.append("if S.stop != %d: R[2] = sr" % RESET)
+
+        src = ["def block_%04x(R):" % start]
+        if load:
+            src.append("    " + load)
+        for line in self.lines:
+            stripped = line.strip()
+            indent = line[:len(line) - len(line.lstrip())]
+            if stripped == "#SPILL":
+                if store:
+                    src.append(indent + store)
+            elif stripped == "#RELOAD":
+                if load:
+                    src.append(indent + load)
+            elif stripped == "#LEAVE":
+                src.extend(indent + line for line in leave)
+            else:
+                src.append(line)
+
+        mem = self.mem
+        self.env.update(rw = mem.read_word, rb = mem.read_byte,
+                        ww = mem.write_word, wb = mem.write_byte)
+        self.source = "\n".join(src) + "\n"
+        code = compile(self.source, "<block 0x%04x>" % start, "exec")
+        exec(code, self.env)
+        return self.env["block_%04x" % start]
+
+
+
+class Block_cache():
+    """ Cache de bloques traducidos, indexado por PC de inicio.
+        get(pc) retorna (funcion, direccion final, instrucciones, ciclos)
+        o None.
+        La funcion se llama con la lista de registros y retorna el PC
+        siguiente.
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.bus = sim.mem
+        self.blocks = {}
+        self.page_blocks = {}           # pagina -> PCs de bloques en ella
+        self.watch_bits = {}            # region -> bit de observador
+        self.stops = None               # Direcciones donde cortar bloques
+        self.stop = 0                   # Motivo para salir del bloque (STALE, RESET)
+        self.done = None                # (instrucciones, ciclos) si salio antes
+
+
+    def leave(self, reason):
+        """ Pide al bloque en ejecucion que salga luego de la escritura
+            actual (ver el comienzo del modulo)
+        """
+        if reason > self.stop:
+            self.stop = reason
+
+
+    def clear(self):
+        for page in list(self.page_blocks):
+            self.drop_page(page)
+        self.blocks.clear()
+
+
+    def get(self, pc):
+        block = self.blocks.get(pc)
+        if block == None:
+            block = self.translate(pc)
+        return block
+
+
+    def translate(self, pc):
+        block = Block_translator(self.sim, self).translate(pc, self.stops)
+        if block == None:
+            return None
+
+        self.blocks[pc] = block
+        end = block[1]
+        for page in range(pc >> 8, ((end - 1) >> 8) + 1):
+            self.page_blocks.setdefault(page, set()).add(pc)
+            self.watch_page(page, True)
+        return block
+
+
+    def watch_page(self, page, enable):
+        region = self.bus.region_at(page << 8)
+        if not hasattr(region, "add_watcher"):
+            return
+        if region not in self.watch_bits:
+            self.watch_bits[region] = region.add_watcher(self.invalidate)
+        region.watch(page << 8, 0x100, self.watch_bits[region], enable)
+
+
+    def drop_page(self, page):
+        for pc in self.page_blocks.pop(page, ()):
+            self.blocks.pop(pc, None)
+        self.watch_page(page, False)
+
+
+    def invalidate(self, addr, size):
+        """ Llamado por Memory al escribir en una pagina con bloques. El
+            bloque en ejecucion (si lo hay) sale luego de la escritura.
+        """
+        for page in range(addr >> 8, ((addr + size - 1) >> 8) + 1):
+            if page in self.page_blocks:
+                self.drop_page(page)
+                self.leave(STALE)
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,         # mov   #0x400, SP
+                0x403f, 0x000a,         # mov   #10, R15
+                0x430e,                 # clr   R14
+                0x5f0e,                 # add   R15, R14
+                0x831f,                 # dec   R15
+                0x23fd,                 # jnz   $-4
+                0x3fff])                # jmp   $
+
+    cache = Block_cache(c.sim)
+    for pc in (0xc200, 0xc20a):
+        fn, end, count, cycles = cache.get(pc)
+        print("Bloque 0x{:04x}..0x{:04x}, {:d} instrucciones, {:d} ciclos".format(
+                    pc, end, count, cycles))
+
+    t = Block_translator(c.sim)
+    t.translate(0xc200)
+    print(t.source)
+
+    c.ROM.store_word_at(0xc20a, 0x3fff)
+    print("Bloques luego de escribir en 0xc20a:", sorted(cache.blocks))
+
+    return 0
+
+if __name__ == '__main__':
+    main()
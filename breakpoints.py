@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  breakpoints.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Puntos de parada (breakpoints) y de vigilancia (watchpoints).
+
+    Breakpoints: un mapa de 64K bytes, uno por direccion. CPU.run lo
+    consulta con un solo indice antes de cada instruccion (o bloque: el
+    cache de bloques corta los bloques antes de cada breakpoint). Una
+    condicion opcional (una expresion de Python sobre R0..R15, PC, SP,
+    SR, mem(dir) y byte(dir)) se compila una sola vez y se evalua solo al
+    llegar a su direccion.
+
+    Watchpoints: se marcan las paginas de 256 bytes que los contienen.
+        - Escrituras: con los observadores de Memory y de
+          Peripheral_space (add_watcher), que avisan antes de escribir.
+        - Lecturas: se interpone un Read_hook en el bus (Memory_bus.hook)
+          solo para las paginas vigiladas.
+    Los accesos a las demas paginas no pagan nada. La ejecucion se
+    detiene al terminar la instruccion que hizo el acceso.
+
+    Uso:
+        bp = Breakpoints()
+        bp.attach(cpu)
+        bp.add(0xc20c, "R15 == 3")
+        bp.watch(0x0200, 2, Breakpoints.WRITE)
+        print(cpu.run())
+"""
+
+import sys
+
+from registers import Registers
+
+
+class BreakpointException(Exception): pass
+
+
+# Nombres de los registros en las condiciones
+REGISTER_NAMES = {"PC": Registers.PC, "SP": Registers.SP, "SR": Registers.SR}
+REGISTER_NAMES.update(("R%d" % r, r) for r in range(16))
+
+
+class Register_view():
+    """ Variables locales de las condiciones: los registros, leidos
+        recien al evaluar
+    """
+    def __init__(self, regs):
+        self.regs = regs
+
+    def __getitem__(self, name):
+        return self.regs[REGISTER_NAMES[name]]
+
+
+class Read_hook():
+    """ Se interpone en el bus en una pagina con watchpoints de lectura.
+        Los accesos rapidos de lectura se avisan a Breakpoints.accessed;
+        todo lo demas pasa directo a la region.
+    """
+    def __init__(self, region, breakpoints):
+        self.region = region
+        self.breakpoints = breakpoints
+
+    def __getattr__(self, name):
+        return getattr(self.region, name)
+
+    def read_word(self, addr):
+        self.breakpoints.accessed(addr & ~1, 2, Breakpoints.READ)
+        return self.region.read_word(addr)
+
+    def read_byte(self, addr):
+        self.breakpoints.accessed(addr, 1, Breakpoints.READ)
+        return self.region.read_byte(addr)
+
+
+class Breakpoints():
+    """ Breakpoints y watchpoints de un CPU:
+            stops       Mapa de 64K (1 en las direcciones con breakpoint)
+            conditions  Direccion -> (texto, codigo compilado)
+            watches     Direccion -> (tamaño, tipo)
+            hit         Ultimo watchpoint alcanzado: (direccion, tamaño,
+                        tipo), o None
+    """
+    READ, WRITE = 1, 2
+    ACCESS = READ | WRITE
+    KINDS = {READ: "read", WRITE: "write", ACCESS: "access"}
+
+    def __init__(self):
+        self.stops = bytearray(0x10000)
+        self.conditions = {}
+        self.watches = {}
+        self.hit = None
+        self.cpu = None
+        self.watch_bits = {}            # region -> bit de observador
+
+
+    def attach(self, cpu):
+        """ Empieza a controlar la ejecucion de <cpu> """
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.env = Register_view(cpu.reg.get_registers())
+        self.globals = {"__builtins__": {},
+                        "mem": cpu.bus.read_word,
+                        "byte": cpu.bus.read_byte}
+        cpu.breakpoints = self
+        cpu.cache.stops = self.stops
+        cpu.cache.clear()
+        self.update_watches()
+
+
+    def detach(self):
+        cpu, watches = self.cpu, self.watches
+        self.watches = {}
+        self.update_watches()
+        self.watches = watches
+        cpu.breakpoints = None
+        cpu.cache.stops = None
+        cpu.cache.clear()
+        self.cpu = None
+
+    #
+    #   Breakpoints
+    #
+
+    def add(self, addr, condition = None):
+        """ Breakpoint en <addr>, con una <condition> opcional (texto) """
+        addr &= 0xfffe
+        if condition:
+            try:
+                code = compile(condition, "<breakpoint 0x{:04x}>".format(addr), "eval")
+            except SyntaxError as ex:
+                raise BreakpointException("Condicion invalida: {:s} ({:s})".format(condition, ex.msg))
+            self.conditions[addr] = (condition, code)
+        else:
+            self.conditions.pop(addr, None)
+        self.stops[addr] = 1
+
+        # Los bloques ya traducidos pueden pasar por encima de <addr>
+        if self.cpu != None:
+            self.cpu.cache.invalidate(addr, 2)
+
+
+    def remove(self, addr):
+        addr &= 0xfffe
+        self.stops[addr] = 0
+        self.conditions.pop(addr, None)
+
+
+    def clear(self):
+        """ Borra todos los breakpoints y watchpoints """
+        self.stops[:] = bytes(0x10000)
+        self.conditions.clear()
+        self.watches.clear()
+        self.update_watches()
+
+
+    def addresses(self):
+        return [addr for addr in range(0, 0x10000, 2) if self.stops[addr]]
+
+
+    def check(self, pc):
+        """ True si hay que detenerse en <pc> (que tiene un breakpoint):
+            no tiene condicion, o la condicion es verdadera
+        """
+        cond = self.conditions.get(pc)
+        if cond == None:
+            return True
+        try:
+            return bool(eval(cond[1], self.globals, self.env))
+        except Exception as ex:
+            raise BreakpointException("Error en la condicion de 0x{:04x}: {:s}".format(pc, str(ex)))
+
+
+    def __contains__(self, pc):
+        """ Permite usar 'pc in breakpoints' (ver History.reverse_continue) """
+        return self.stops[pc] != 0 and self.check(pc)
+
+    #
+    #   Watchpoints
+    #
+
+    def watch(self, addr, size = 2, kind = WRITE):
+        """ Vigila <size> bytes desde <addr>: lecturas, escrituras o ambas """
+        self.watches[addr] = (size, kind)
+        self.update_watches()
+
+
+    def unwatch(self, addr):
+        self.watches.pop(addr, None)
+        self.update_watches()
+
+
+    def update_watches(self):
+        """ Marca en las regiones (escrituras) y en el bus (lecturas) las
+            paginas que tienen watchpoints
+        """
+        if self.cpu == None:
+            return
+        bus = self.bus
+
+        write_pages, read_pages = set(), set()
+        for addr, (size, kind) in self.watches.items():
+            pages = range(addr >> 8, ((addr + size - 1) >> 8) + 1)
+            if kind & self.WRITE:
+                write_pages.update(pages)
+            if kind & self.READ:
+                read_pages.update(pages)
+
+        for region in bus.regions:
+            if not hasattr(region, "add_watcher"):
+                continue
+            if region not in self.watch_bits:
+                self.watch_bits[region] = region.add_watcher(self.written)
+            bit = self.watch_bits[region]
+            region.watch(region.mem_start, region.mem_size, bit, False)
+            for page in write_pages:
+                region.watch(page << 8, 0x100, bit)
+
+        for page in range(bus.NR_PAGES):
+            hooked = isinstance(bus.pages[page], Read_hook)
+            if page in read_pages and not hooked:
+                bus.hook(page, Read_hook(bus.region_at(page << 8), self))
+            elif page not in read_pages and hooked:
+                bus.unhook(page)
+
+
+    def written(self, addr, size):
+        """ Observador de la memoria (antes de cada escritura) """
+        self.accessed(addr, size, self.WRITE)
+
+
+    def accessed(self, addr, size, kind):
+        for start, (wsize, wkind) in self.watches.items():
+            if wkind & kind and addr < start + wsize and start < addr + size:
+                self.hit = (start, wsize, kind)
+
+
+    def __str__(self):
+        s = ""
+        for addr in self.addresses():
+            cond = self.conditions.get(addr)
+            s += "break 0x{:04x}{:s}\n".format(addr, " if " + cond[0] if cond else "")
+        for addr, (size, kind) in sorted(self.watches.items()):
+            s += "watch 0x{:04x} ({:d} bytes, {:s})\n".format(addr, size, self.KINDS[kind])
+        return s
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0x403f, 0x000a,             # mov   #10, R15
+                0x4f82, 0x0200,             # mov   R15, &0x0200
+                0x831f,                     # dec   R15
+                0x23fc,                     # jnz   $-6
+                0x421e, 0x0200,             # mov   &0x0200, R14
+                0x3fff])                    # jmp   $
+    c.reset()
+
+    bp = Breakpoints()
+    bp.attach(c)
+    bp.add(0xc20c, "R15 == 3")
+    print(bp)
+    print(c.run(), c.reg.get(15))
+    bp.remove(0xc20c)
+
+    bp.watch(0x0200, 2, Breakpoints.WRITE)
+    print(c.run(), bp.hit, hex(c.bus.read_word(0x0200)))
+    bp.unwatch(0x0200)
+    print(c.run(100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  bus.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from memory import Memory, MemoryException
+
+
+class Vacant_memory():
+    """ Region para las paginas no mapeadas. Los accesos controlados
+        (load_*/store_*) lanzan MemoryException. Los accesos rapidos del
+        simulador (read_*/write_*) no fallan: la lectura devuelve 0x3fff
+        (como la memoria vacante del MSP430, que equivale a 'jmp $') y la
+        escritura se ignora.
+    """
+    mem_start = 0
+    mem_size  = 0x10000
+
+    def load_word_at(self, addr):
+        raise MemoryException("Dirección fuera de rango (0x{:04x})".format(addr))
+
+    load_byte_at = load_word_at
+
+    def store_word_at(self, addr, value):
+        raise MemoryException("Dirección fuera de rango (0x{:04x})".format(addr))
+
+    store_byte_at = store_word_at
+
+    def read_word(self, addr):      return 0x3fff
+    def read_byte(self, addr):      return 0x3f if addr & 1 else 0xff
+    def write_word(self, addr, value): pass
+    def write_byte(self, addr, value): pass
+
+
+VACANT = Vacant_memory()
+
+
+class Memory_bus():
+    """ Espacio de direcciones completo del MSP430 (0x0000..0xffff).
+
+        El espacio se divide en 256 paginas de 256 bytes. self.pages tiene
+        una entrada por pagina con la region (ROM, RAM, periferico) que la
+        atiende, o VACANT si la pagina no esta mapeada. Cada acceso resuelve
+        su region con un solo indice, sin recorrer la lista de regiones.
+
+        Una region es cualquier objeto con los metodos load_word_at,
+        store_word_at, load_byte_at y store_byte_at (accesos controlados)
+        y read_word, write_word, read_byte y write_byte (accesos rapidos,
+        sin excepciones), con direcciones absolutas, como Memory.
+    """
+    PAGE_SHIFT = 8
+    PAGE_SIZE  = 1 << PAGE_SHIFT
+    NR_PAGES   = 0x10000 >> PAGE_SHIFT
+
+    def __init__(self):
+        # Mismos atributos que Memory, para poder usar el bus en su lugar
+        self.mem_start = 0
+        self.mem_size  = 0x10000
+
+        self.pages = [VACANT] * self.NR_PAGES
+        self.regions = []
+        self.hooked = {}                # pagina -> region original (ver hook)
+
+
+    def __str__(self):
+        s = ""
+        for region in self.regions:
+            s += "0x{:04x}..0x{:04x}  {:s}\n".format(
+                        region.mem_start,
+                        region.mem_start + region.mem_size - 1,
+                        type(region).__name__)
+        return s
+
+
+    def map(self, region, start = None, size = None):
+        """ Mapea <region> en el bus, desde <start> (por defecto
+            region.mem_start) y de <size> bytes (por defecto
+            region.mem_size). El rango debe estar alineado a paginas.
+        """
+        if start == None:
+            start = region.mem_start
+        if size == None:
+            size = region.mem_size
+
+        if start % self.PAGE_SIZE != 0 or size % self.PAGE_SIZE != 0:
+            raise MemoryException("Region no alineada a paginas (0x{:04x}, {:d})".format(start, size))
+
+        first = start >> self.PAGE_SHIFT
+        last = (start + size) >> self.PAGE_SHIFT
+        if last > self.NR_PAGES:
+            raise MemoryException("Region fuera del espacio de direcciones (0x{:04x})".format(start))
+
+        for page in range(first, last):
+            if self.pages[page] is not VACANT:
+                raise MemoryException("Region superpuesta en 0x{:04x}".format(page << self.PAGE_SHIFT))
+
+        for page in range(first, last):
+            self.pages[page] = region
+        self.regions.append(region)
+
+
+    def unmap(self, region):
+        """ Quita a <region> del bus """
+        for page in range(self.NR_PAGES):
+            if self.hooked.get(page) is region:
+                del self.hooked[page]
+                self.pages[page] = VACANT
+            if self.pages[page] is region:
+                self.pages[page] = VACANT
+        self.regions.remove(region)
+
+
+    def hook(self, page, hook):
+        """ Interpone <hook> en los accesos a la pagina <page>: hook
+            tiene los mismos metodos que una region, y atiende los accesos
+            en su lugar (por ejemplo, para vigilar lecturas). Las demas
+            paginas no pagan nada.
+        """
+        if page not in self.hooked:
+            self.hooked[page] = self.pages[page]
+        self.pages[page] = hook
+
+
+    def unhook(self, page):
+        """ Vuelve a conectar la pagina <page> a su region """
+        region = self.hooked.pop(page, None)
+        if region != None:
+            self.pages[page] = region
+
+
+    def region_at(self, addr):
+        """ Retorna la region que atiende a <addr> (VACANT si no hay),
+            sin tener en cuenta los hooks
+        """
+        page = (addr & 0xffff) >> self.PAGE_SHIFT
+        return self.hooked.get(page, self.pages[page])
+
+    #
+    #   Accesos controlados (lanzan MemoryException)
+    #
+
+    def load_word_at(self, addr):
+        addr &= 0xffff
+        return self.pages[addr >> 8].load_word_at(addr)
+
+    def store_word_at(self, addr, value):
+        addr &= 0xffff
+        self.pages[addr >> 8].store_word_at(addr, value)
+
+    def load_byte_at(self, addr):
+        addr &= 0xffff
+        return self.pages[addr >> 8].load_byte_at(addr)
+
+    def store_byte_at(self, addr, value):
+        addr &= 0xffff
+        self.pages[addr >> 8].store_byte_at(addr, value)
+
+    #
+    #   Accesos rapidos del simulador (<addr> ya es de 16 bits)
+    #
+
+    def read_word(self, addr):
+        return self.pages[addr >> 8].read_word(addr)
+
+    def read_byte(self, addr):
+        return self.pages[addr >> 8].read_byte(addr)
+
+    def write_word(self, addr, value):
+        self.pages[addr >> 8].write_word(addr, value)
+
+    def write_byte(self, addr, value):
+        self.pages[addr >> 8].write_byte(addr, value)
+
+
+    def store_words_at(self, addr, words):
+        """ Almacena multiple words en el bus, desde la direccion <addr> """
+        for i, word in enumerate(words):
+            self.store_word_at(addr + i*2, word)
+
+
+    def store_bytes_at(self, addr, data):
+        """ Copia <data> al bus desde <addr>, con una copia por region
+            (ver Memory.store_bytes_at)
+        """
+        pos = 0
+        while pos < len(data):
+            region = self.region_at(addr + pos)
+            if region is VACANT or not hasattr(region, "store_bytes_at"):
+                raise MemoryException("Dirección fuera de rango (0x{:04x})".format(addr + pos))
+            size = min(len(data) - pos, region.mem_start + region.mem_size - (addr + pos))
+            region.store_bytes_at(addr + pos, data[pos : pos + size])
+            pos += size
+
+
+    def load_bytes_at(self, addr, size):
+        """ Retorna <size> bytes desde <addr>, leidos de a una region (ver
+            Memory.load_bytes_at). Las paginas vacantes, o las regiones sin
+            load_bytes_at, se leen de a byte con read_byte.
+        """
+        data = bytearray()
+        end = min(addr + size, 0x10000)
+        while addr < end:
+            region = self.pages[addr >> 8]
+            if hasattr(region, "load_bytes_at"):
+                n = min(end, region.mem_start + region.mem_size) - addr
+                data += region.load_bytes_at(addr, n)
+            else:
+                n = min(end, (addr | 0xff) + 1) - addr
+                data += bytes(region.read_byte(a) for a in range(addr, addr + n))
+            addr += n
+        return data
+
+
+    def dump(self, addr = None, nr_words = None):
+        """ Imprime el contenido del bus, igual que Memory.dump() """
+        words_per_line = 16
+
+        if addr == None:
+            addr = 0
+        if nr_words == None:
+            nr_words = 0x10000 - addr
+
+        s = ""
+        end_addr = min(addr + nr_words, 0x10000)
+        while addr < end_addr:
+            s += "%04x " % addr
+            for offs in range(words_per_line):
+                try:
+                    w = self.load_word_at(addr + offs*2)
+                except MemoryException:
+                    w = None
+                s += " ...." if w == None else " {:04x}".format(w)
+            s += "\n"
+            addr += words_per_line * 2
+        return s
+
+
+
+def main():
+    rom = Memory(1024, mem_start = 0xfc00)
+    ram = Memory(512, mem_start = 0x0200)
+
+    bus = Memory_bus()
+    bus.map(rom)
+    bus.map(ram)
+    print(str(bus))
+
+    bus.store_word_at(0xfd00, 0x1234)
+    bus.store_word_at(0x0300, 0xcafe)
+    print(bus.dump(0xfd00, 16))
+    print(bus.dump(0x0300, 16))
+
+    try:
+        bus.load_word_at(0x1000)
+    except MemoryException as ex:
+        print(ex)
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -22,13 +22,86 @@
 #
 #
 
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+import time
 
-from registers import Registers
+from registers import Registers, CPUOFF
 from memory import Memory, MemoryException
+from bus import Memory_bus
 from simulator import Simulator
+from block_cache import Block_cache, RESET
+from peripherals import Peripheral_space, Scheduler
+from interrupts import Interrupt_controller, RESET_VECTOR
+from image import load_image
+from elf import load_elf
+
+
+class CPUException(Exception): pass
+
+
+class Run_result():
+    """ Resultado de una ejecucion con CPU.run() o CPU.run_until():
+            reason          Motivo de la detencion (LIMIT, UNTIL, END,
+                            BREAK o WATCH, ver breakpoints.py, o SLEEP:
+                            CPU apagado sin eventos que lo despierten)
+            instructions    Cantidad de instrucciones ejecutadas
+            pc              Valor del PC al detenerse
+            error           Mensaje si reason es END (si no, None)
+            cycles          Ciclos de MCLK ejecutados
+            seconds         Tiempo real (de reloj) que llevo la ejecucion
+            effective_mhz   Velocidad del simulador: ciclos simulados por
+                            segundo real, en MHz
+    """
+    LIMIT, UNTIL, END, BREAK, WATCH, SLEEP = range(6)
+    REASONS = ("limit", "until", "end", "break", "watch", "sleep")
+
+    def __init__(self, reason, instructions, pc, error = None,
+                       cycles = 0, seconds = 0.0):
+        self.reason = reason
+        self.instructions = instructions
+        self.pc = pc
+        self.error = error
+        self.cycles = cycles
+        self.seconds = seconds
+        self.effective_mhz = cycles / seconds / 1e6 if seconds > 0 else 0.0
+
+    def __str__(self):
+        s = "{:s}: {:d} instrucciones, {:d} ciclos, PC = 0x{:04x}".format(
+                    self.REASONS[self.reason], self.instructions,
+                    self.cycles, self.pc)
+        if self.error != None:
+            s += " ({:s})".format(self.error)
+        s += " [{:.3f} MHz efectivos]".format(self.effective_mhz)
+        return s
+
+    def as_dict(self):
+        return {"reason": self.REASONS[self.reason],
+                "instructions": self.instructions,
+                "pc": self.pc,
+                "error": self.error,
+                "cycles": self.cycles,
+                "seconds": self.seconds,
+                "effective_mhz": self.effective_mhz}
+
+
+class CPU_snapshot():
+    """ Estado completo de la maquina (ver CPU.snapshot):
+            registers       Copia de los registros
+            cycles          Ciclos de MCLK ejecutados
+            instructions    Instrucciones ejecutadas
+            regions         Lista de (region, estado) de las regiones del
+                            bus que tienen snapshot()/restore() (ROM, RAM
+                            y perifericos)
+            events          Estado del Scheduler
+            interrupts      Estado del controlador de interrupciones
+    """
+    def __init__(self, registers, cycles, instructions, regions, events, interrupts):
+        self.registers = registers
+        self.cycles = cycles
+        self.instructions = instructions
+        self.regions = regions
+        self.events = events
+        self.interrupts = interrupts
+
 
 class CPU():                    #   ROM    RAM
     CPU_TABLE = {"MSP430FR2000": (  512,   512),
@@ -37,8 +110,13 @@ class CPU():                    #   ROM    RAM
                  "MSP430FR2111": ( 4096,  1024),
                  "MSP430iua"   : (15872,  1024)}
 
-    def __init__(self, part = "MSP430iua"):
+    def __init__(self, part = "MSP430iua", mclk = 1000000):
+        """ <mclk> es la frecuencia del reloj MCLK en Hz, usada para
+            convertir los ciclos ejecutados en tiempo simulado.
+        """
         assert part in CPU.CPU_TABLE
+        self.part = part
+        self.mclk = mclk
 
         # Memoria de programa: Termina en el final del espacio de 65kB,
         # y se reserva hacia abajo.
@@ -51,8 +129,34 @@ class CPU():                    #   ROM    RAM
         self.RAM = Memory(mem_size  = self.CPU_TABLE[part][1],
                           mem_start = 0x0200,
                           readonly  = False)
+
+        # Bus con todo el espacio de direcciones: el simulador accede a
+        # ROM y RAM (y perifericos) a traves de el
+        self.bus = Memory_bus()
+        self.bus.map(self.RAM)
+        self.bus.map(self.ROM)
+
         self.reg = Registers()
-        self.sim = Simulator(self.ROM, self.reg)
+        self.sim = Simulator(self.bus, self.reg)
+        self.cache = Block_cache(self.sim)
+
+        # Perifericos (0x0000..0x01ff, ver peripherals.py y devices.py) y
+        # la cola de sus eventos futuros
+        self.scheduler = Scheduler(self.sim)
+        self.interrupts = Interrupt_controller(self)
+        self.peripherals = Peripheral_space(self)
+        self.bus.map(self.peripherals)
+
+        # Profiler y registro de traza activos (ver profiler.py y
+        # tracer.py), o None
+        self.profiler = None
+        self.tracer = None
+
+        # Breakpoints y watchpoints (ver breakpoints.py), o None
+        self.breakpoints = None
+
+        # Arranca como luego de un reset: PC en el vector de reset
+        self.reset()
 
 
     def __str__(self):
@@ -62,53 +166,439 @@ class CPU():                    #   ROM    RAM
 
 
     def reset(self):
-        self.reg.set_PC(0xfffe)
+        self.sim.cycles = 0
+        self.sim.instructions = 0
+        self.puc()
+
+
+    def puc(self):
+        """ Power-up clear: PC toma el contenido del vector de reset, SR
+            en 0 y perifericos reiniciados. No borra los contadores (ver
+            reset), de modo que se puede usar durante la ejecucion
+            (watchdog, o una escritura de la instruccion en curso: ver
+            Block_cache.leave).
+            Sin vector de reset (no hay programa cargado) el PC queda en
+            el vector mismo, y el primer paso falla.
+        """
+        self.cache.leave(RESET)
+        try:
+            pc = self.bus.load_word_at(RESET_VECTOR)
+        except MemoryException:
+            pc = RESET_VECTOR
+        self.reg.set_PC(pc)
         self.reg.set_SR(0)
+        self.scheduler.clear()
+        self.interrupts.clear()
+        self.peripherals.reset()
+
+
+    def add_peripheral(self, device):
+        """ Agrega un dispositivo (ver peripherals.Peripheral) """
+        return self.peripherals.add(device)
+
+
+    def clear(self):
+        """ Deja al CPU como recien creado: ROM y RAM sin inicializar,
+            registros en 0. Permite reusar el mismo CPU para otro programa.
+        """
+        self.RAM.initialize()
+        self.ROM.initialize()
+        self.ROM.store_word_at(65534, self.ROM.mem_start)
+        self.reg.load([0] * 16)
+        self.reset()
+
+
+    def load_image(self, fname):
+        """ Carga una imagen binaria (ver image.py): la ROM y la RAM pasan a
+            usar el archivo mapeado en memoria, sin copiarlo ni
+            interpretarlo. Retorna la tabla de simbolos de la imagen.
+        """
+        img = load_image(fname)
+        if img.part != self.part:
+            raise CPUException("La imagen es para {:s}, no {:s}".format(img.part, self.part))
+
+        for region in (self.RAM, self.ROM):
+            img.map_into(region)
+        return img.symtab
+
+
+    def load_elf(self, fname):
+        """ Carga los segmentos de un archivo ELF (ver elf.py) en la ROM y
+            la RAM. Retorna la tabla de simbolos del archivo (se arma
+            recien al usarla).
+        """
+        elf = load_elf(fname)
+        elf.load(self.bus)
+        return elf.symtab
+
+
+    def load_program(self, fname):
+        """ Carga un programa segun la extension del archivo: .elf/.out
+            (load_elf), .img (load_image) o Intel HEX (en la ROM), y hace
+            un reset para que el PC tome el vector de reset del programa.
+            Retorna la tabla de simbolos, o None si el formato no la tiene.
+        """
+        ext = fname.lower().rsplit(".", 1)[-1]
+        if ext in ("elf", "out"):
+            symtab = self.load_elf(fname)
+        elif ext == "img":
+            symtab = self.load_image(fname)
+        else:
+            self.ROM.load_from_intel(fname)
+            symtab = None
+        self.reset()
+        return symtab
+
+
+    def snapshot(self):
+        """ Retorna un CPU_snapshot con el estado actual. La memoria se
+            guarda por paginas copy-on-write (ver Memory.snapshot): las
+            paginas no modificadas se comparten entre instantaneas. Se
+            guardan tambien los registros de los perifericos, sus eventos
+            agendados y las interrupciones pendientes.
+        """
+        return CPU_snapshot(list(self.reg.get_registers()),
+                            self.sim.cycles,
+                            self.sim.instructions,
+                            [(region, region.snapshot()) for region in self.bus.regions
+                                                         if hasattr(region, "snapshot")],
+                            self.scheduler.snapshot(),
+                            self.interrupts.snapshot())
+
+
+    def restore(self, snap):
+        """ Vuelve al estado guardado en <snap> (un CPU_snapshot) """
+        self.reg.load(snap.registers)
+        self.sim.cycles = snap.cycles
+        self.sim.instructions = snap.instructions
+        for region, state in snap.regions:
+            region.restore(state)
+        self.scheduler.restore(snap.events)
+        self.interrupts.restore(snap.interrupts)
+
+
+    def cycles(self):
+        """ Ciclos de MCLK ejecutados desde el ultimo reset """
+        return self.sim.cycles
+
+
+    def instructions(self):
+        """ Instrucciones ejecutadas desde el ultimo reset """
+        return self.sim.instructions
 
 
-    def step(self, toplevel):
-        """ Ejecutar un paso desde el PC actual, luego actualizar el PC """
-        
+    def simulated_time(self):
+        """ Tiempo simulado (en segundos) desde el ultimo reset, segun mclk """
+        return self.sim.cycles / self.mclk
+
+
+    def stats(self):
+        """ Contadores de ejecucion, en un diccionario """
+        cycles, instructions = self.sim.cycles, self.sim.instructions
+        return {"cycles": cycles,
+                "instructions": instructions,
+                "cpi": cycles / instructions if instructions else 0.0,
+                "mclk": self.mclk,
+                "simulated_time": cycles / self.mclk}
+
+
+    def interrupt(self):
+        """ Atiende la interrupcion pendiente de mayor prioridad, si se
+            puede (ver interrupts.py). Retorna True si la atendio.
+        """
+        vector = self.interrupts.highest()
+        if vector == None:
+            return False
+
+        pc = self.reg.get_PC()
+        if self.tracer != None:
+            self.tracer.begin(pc)
+        self.interrupts.enter(vector)
+        if self.profiler != None:
+            self.profiler.interrupt(pc, self.reg.get_PC())
+        if self.tracer != None:
+            self.tracer.end(pc, self.reg.get_PC(), vector)
+        return True
+
+
+    def idle(self):
+        """ Con el CPU apagado (CPUOFF, modos de bajo consumo) no se
+            ejecuta nada: los ciclos saltan directamente al proximo evento
+            de los perifericos, que se ejecuta (y puede pedir una
+            interrupcion que despierte al CPU). Retorna False si no hay
+            eventos: el CPU no despertaria nunca.
+        """
+        sim, scheduler = self.sim, self.scheduler
+        if scheduler.next_cycle == float("inf"):
+            return False
+
+        if sim.cycles < scheduler.next_cycle:
+            if self.tracer != None:
+                self.tracer.idle(self.reg.get_PC(), scheduler.next_cycle - sim.cycles)
+            sim.cycles = scheduler.next_cycle
+        scheduler.run(sim.cycles)
+        return True
+
+
+    def step(self):
+        """ Ejecutar un paso desde el PC actual, luego actualizar el PC.
+            Si hay una interrupcion que atender, el paso es la entrada a
+            la rutina de interrupcion; si el CPU esta apagado, el paso es
+            la espera hasta el proximo evento (ver idle).
+            Lanza CPUException si no hay proxima instruccion (se termino
+            el programa, o el CPU esta apagado y no hay eventos).
+        """
+        if self.interrupts.pending:
+            try:
+                if self.interrupt():
+                    return
+            except MemoryException as ex:
+                raise CPUException(str(ex))
+
+        if self.reg.get_SR() & CPUOFF:
+            if not self.idle():
+                raise CPUException("CPU apagado, sin eventos pendientes")
+            return
+
+        old_pc = self.reg.get_PC()
+        if self.tracer != None:
+            self.tracer.begin(old_pc)
+        self.cache.stop = 0
         try:
-            self.reg.set_PC(self.sim.one_step(self.reg.get_PC()))
-            # Si PC == None => Lanzo excepcion, ya que no hay proxima instruccion (Se termino el programa)
-            if self.reg.get_PC() == None:
-                raise MemoryException()
-                                
+            pc = self.sim.one_step(old_pc)
+        except MemoryException as ex:
+            raise CPUException(str(ex))
 
-        except MemoryException:
-            dlg = Gtk.Dialog(
-                    parent = toplevel,
-                    title = "Fin del programa",
-                    buttons = ("Cancelar", Gtk.ResponseType.CANCEL,
-                                "Aceptar",  Gtk.ResponseType.ACCEPT))
+        if pc == None:
+            raise CPUException("Fin del programa")
+        if self.cache.stop == RESET:        # La instruccion provoco un PUC
+            pc = self.reg.get_PC()
+
+        self.reg.set_PC(pc)
+        if self.profiler != None:
+            self.profiler.record(old_pc, pc)
+        if self.tracer != None:
+            self.tracer.end(old_pc, pc)
+        if self.sim.cycles >= self.scheduler.next_cycle:
+            self.scheduler.run(self.sim.cycles)
+
+
+    def run(self, max_instructions = None, until = None, use_cache = True,
+                  max_cycles = None):
+        """ Ejecutar sin interfaz grafica, desde el PC actual:
+                max_instructions    Maximo de instrucciones (None: sin limite)
+                until               Direccion (int) en la que detenerse, o
+                                    una funcion until(cpu) que devuelve True
+                                    para detenerse
+                use_cache           Ejecutar bloques traducidos (ver
+                                    block_cache.py). No se usa si <until>
+                                    es una funcion, ya que hay que
+                                    evaluarla luego de cada instruccion,
+                                    ni con un profiler o una traza
+                                    activos, ni con watchpoints.
+                max_cycles          Maximo de ciclos (None: sin limite).
+                                    Se controla como un evento mas, al
+                                    terminar una instruccion o bloque: se
+                                    puede pasar por unos pocos ciclos.
+            Se detiene en los breakpoints de self.breakpoints (salvo en
+            el de la primera instruccion, para poder continuar desde el).
+            Las interrupciones pendientes (ver interrupts.py) se atienden
+            antes de cada instruccion o bloque. Con el CPU apagado, el
+            tiempo salta de un evento al siguiente (ver idle); si no hay
+            eventos, se detiene (SLEEP).
+            Retorna un Run_result con el motivo de la detencion.
+        """
+        sim = self.sim
+        one_step = sim.one_step
+        regs = self.reg.get_registers()
+        PC = Registers.PC
+
+        if max_instructions == None:
+            max_instructions = float("inf")
+
+        stop_pc = until if isinstance(until, int) else -1
+        predicate = until if callable(until) else None
+
+        profiler = self.profiler
+        tracer = self.tracer
+        if profiler != None or tracer != None or predicate != None:
+            use_cache = False
+
+        breakpoints = self.breakpoints
+        stops = breakpoints.stops if breakpoints != None else None
+        watching = breakpoints != None and len(breakpoints.watches) > 0
+        if watching:
+            breakpoints.hit = None
+            use_cache = False
 
-            dlg.set_size_request(250, 50)
+        cache = self.cache
+        blocks = cache.blocks if use_cache else None
+        translate = cache.translate
+        scheduler = self.scheduler
+        interrupts = self.interrupts
+        SR = Registers.SR
 
-            hbox = Gtk.HBox(
-                    margin = 10,
-                    spacing = 6)
-        
-            hbox.pack_start(Gtk.Label(
-                        "¿Desea reiniciar el programa?"),
-                        True,
-                        False,
-                        0)
+        # El limite de ciclos es un evento que marca el fin (y que no
+        # borra un PUC)
+        expired = []
+        limit = None
+        if max_cycles != None:
+            limit = scheduler.schedule(sim.cycles + max_cycles, lambda: expired.append(True),
+                                       keep = True)
 
-            hbox.show_all()
+        pc = regs[PC]
+        count = 0
+        start_cycles = sim.cycles
+        start_time = time.perf_counter()
+        reason = Run_result.LIMIT
+        error = None
 
-            dlg.get_content_area().add(hbox)                            
+        while count < max_instructions:
+            # Interrupciones: una sola prueba si no hay ninguna pendiente
+            if interrupts.pending:
+                try:
+                    if self.interrupt():
+                        pc = regs[PC]
+                except MemoryException as ex:
+                    reason, error = Run_result.END, str(ex)
+                    break
 
-            if dlg.run() == Gtk.ResponseType.ACCEPT:
-                toplevel.source.reset()
+            if regs[SR] & CPUOFF:
+                if not self.idle():
+                    reason = Run_result.SLEEP
+                    break
+                pc = regs[PC]
+                if expired:
+                    break
+                continue
 
-            dlg.destroy()
+            if stops != None and stops[pc] and count and breakpoints.check(pc):
+                reason = Run_result.BREAK
+                break
+
+            if blocks != None:
+                block = blocks.get(pc)
+                if block == None:
+                    block = translate(pc)
+
+                # El bloque se ejecuta entero: no usarlo si el limite o
+                # la direccion <until> caen dentro de el
+                if (block != None and count + block[2] <= max_instructions
+                                  and not pc < stop_pc < block[1]):
+                    cache.stop = 0
+                    new_pc = block[0](regs)
+                    n, cycles = block[2], block[3]
+                    if cache.stop:
+                        # Salio antes del final (ver Block_cache.leave)
+                        if cache.done != None:
+                            n, cycles = cache.done
+                            cache.done = None
+                        if cache.stop == RESET:
+                            new_pc = regs[PC]
+                    pc = regs[PC] = new_pc
+                    count += n
+                    sim.cycles += cycles
+                    sim.instructions += n
+                    if sim.cycles >= scheduler.next_cycle:
+                        scheduler.run(sim.cycles)
+                        pc = regs[PC]
+                        if expired:
+                            break
+                    if pc == stop_pc:
+                        reason = Run_result.UNTIL
+                        break
+                    continue
+
+            if tracer != None:
+                tracer.begin(pc)
+
+            cache.stop = 0
+            try:
+                new_pc = one_step(pc)
+            except MemoryException as ex:
+                reason, error = Run_result.END, str(ex)
+                break
+
+            if new_pc == None:
+                reason, error = Run_result.END, "Fin del programa"
+                break
+            if cache.stop == RESET:             # La instruccion provoco un PUC
+                new_pc = regs[PC]
+
+            if profiler != None:
+                profiler.record(pc, new_pc)
+            if tracer != None:
+                tracer.end(pc, new_pc)
+
+            pc = regs[PC] = new_pc
+            count += 1
+
+            # Eventos de los perifericos (pueden cambiar el PC: un PUC)
+            if sim.cycles >= scheduler.next_cycle:
+                scheduler.run(sim.cycles)
+                pc = regs[PC]
+                if expired:
+                    break
+
+            if watching and breakpoints.hit != None:
+                reason = Run_result.WATCH
+                break
+
+            if pc == stop_pc or (predicate != None and predicate(self)):
+                reason = Run_result.UNTIL
+                break
+
+        scheduler.cancel(limit)
+        return Run_result(reason, count, regs[PC], error,
+                          sim.cycles - start_cycles,
+                          time.perf_counter() - start_time)
+
+
+    def step_back(self, n = 1):
+        """ Volver <n> instrucciones atras. Necesita una historia activa
+            (ver history.py). Retorna la cantidad que se pudo volver.
+        """
+        return self.history().step_back(n)
+
+
+    def reverse_continue(self, breakpoints):
+        """ Volver hasta una direccion de <breakpoints> (ver
+            History.reverse_continue)
+        """
+        return self.history().reverse_continue(breakpoints)
+
+
+    def history(self):
+        if not hasattr(self.tracer, "undo"):
+            raise CPUException("No hay historia de ejecucion activa")
+        return self.tracer
+
+
+    def run_until(self, until, max_instructions = None):
+        """ Ejecutar hasta llegar a la direccion <until> (o hasta que la
+            funcion <until> devuelva True). Ver run().
+        """
+        return self.run(max_instructions, until)
 
 
 
 def main():
     c = CPU()
-    print(str(c))
+    c.ROM.store_words_at(0xc200, [
+                0x1085, 0x1085, 0x3c00, 0x3fff])    # swpb R5 (x2), jmp, jmp $
+    c.reg.set(5, 0x1234)
+    c.reset()
+    print(c.run_until(0xc206))
+    print(c.run(10))
+    print(str(c.reg))
+    print(c.stats())
+
+    snap = c.snapshot()
+    c.RAM.store_word_at(0x0200, 0xcafe)
+    c.run(10)
+    c.restore(snap)
+    print(c.RAM.dump(0x0200, 16))
+    print(c.stats())
     return 0
 
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  decode.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Tabla de decodificación de opcodes compartida por el simulador y el
+    desensamblador.
+
+    DECODE_TABLE tiene una entrada por cada palabra de 16 bits posible
+    (65536 entradas), construida una sola vez al importar el módulo.
+    Cada entrada es una tupla:
+
+        (group, optype, mnemonic, As, Ad, byte, rs, rd, offset)
+
+        group       Grupo de la instruccion (SINGLE1, SINGLE2, RETI, JUMP,
+                    DOUBLE o NOP). Indica qué rutina la ejecuta.
+        optype      Instruccion dentro del grupo (RRC, JNZ, MOV, ...)
+        mnemonic    Nombre de la instrucción ('rrc', 'jnz', 'mov', ...)
+        As          Modo de direccionamiento fuente (0..3)
+        Ad          Modo de direccionamiento destino (0..1)
+        byte        True si es una operación de byte (.b)
+        rs          Registro fuente (en simple operando: el registro)
+        rd          Registro destino (en simple operando: el registro)
+        offset      Desplazamiento del salto, en palabras y con signo
+"""
+
+# Grupos de instrucciones
+SINGLE1, SINGLE2, RETI, JUMP, DOUBLE, NOP = range(6)
+
+# Instrucciones dentro de cada grupo
+JNZ, JZ, JNC, JC, JGE, JN, JL, JMP = range(8)
+MOV, ADD, ADDC, SUBC, SUB, CMP, DADD, BIT, BIC, BIS, XOR, AND = range(12)
+RRC, SWPB, RRA, SXT, PUSH, CALL = range(6)
+
+# Indices de los campos en cada entrada de la tabla
+(F_GROUP, F_OPTYPE, F_MNEMONIC,
+ F_AS, F_AD, F_BYTE, F_RS, F_RD, F_OFFSET) = range(9)
+
+
+SINGLE_OPCODES = (
+    (0x1000, SINGLE1, RRC,  'rrc'),
+    (0x1080, SINGLE2, SWPB, 'swpb'),
+    (0x1100, SINGLE1, RRA,  'rra'),
+    (0x1180, SINGLE2, SXT,  'sxt'),
+    (0x1200, SINGLE1, PUSH, 'push'),
+    (0x1280, SINGLE2, CALL, 'call'))
+
+JUMP_OPCODES = (
+    (0x2000, JNZ, 'jnz'),
+    (0x2400, JZ,  'jz'),
+    (0x2800, JNC, 'jnc'),
+    (0x2c00, JC,  'jc'),
+    (0x3000, JN,  'jn'),
+    (0x3400, JGE, 'jge'),
+    (0x3800, JL,  'jl'),
+    (0x3c00, JMP, 'jmp'))
+
+DOUBLE_OPCODES = (
+    (0x4000, MOV,  'mov'),
+    (0x5000, ADD,  'add'),
+    (0x6000, ADDC, 'addc'),
+    (0x7000, SUBC, 'subc'),
+    (0x8000, SUB,  'sub'),
+    (0x9000, CMP,  'cmp'),
+    (0xa000, DADD, 'dadd'),
+    (0xb000, BIT,  'bit'),
+    (0xc000, BIC,  'bic'),
+    (0xd000, BIS,  'bis'),
+    (0xe000, XOR,  'xor'),
+    (0xf000, AND,  'and'))
+
+
+def build_decode_table():
+    """ Construye la tabla de 65536 entradas. Los opcodes que no
+        corresponden a ninguna instrucción se decodifican como NOP.
+    """
+    nop = (NOP, 0, 'nop', 0, 0, False, 0, 0, 0)
+    table = [nop] * 0x10000
+
+    # Instrucciones de simple operando: 0001 00oo oBAA rrrr
+    for base, group, optype, mnemonic in SINGLE_OPCODES:
+        for low in range(0x80):
+            opcode = base | low
+            reg = opcode & 0x000f
+            table[opcode] = (group, optype, mnemonic,
+                             (opcode >> 4) & 0x0003, 0,
+                             (opcode & 0x0040) != 0,
+                             reg, reg, 0)
+
+    table[0x1300] = (RETI, 0, 'reti', 0, 0, False, 0, 0, 0)
+
+    # Saltos: 001c ccoo oooo oooo (desplazamiento de 10 bits con signo)
+    for base, optype, mnemonic in JUMP_OPCODES:
+        for low in range(0x400):
+            offset = low - 0x400 if low & 0x0200 else low
+            table[base | low] = (JUMP, optype, mnemonic,
+                                 0, 0, False, 0, 0, offset)
+
+    # Doble operando: oooo ssss dBAA dddd
+    for base, optype, mnemonic in DOUBLE_OPCODES:
+        for low in range(0x1000):
+            opcode = base | low
+            table[opcode] = (DOUBLE, optype, mnemonic,
+                             (opcode >> 4) & 0x0003,
+                             (opcode >> 7) & 0x0001,
+                             (opcode & 0x0040) != 0,
+                             (opcode >> 8) & 0x000f,
+                             opcode & 0x000f, 0)
+
+    return tuple(table)
+
+
+DECODE_TABLE = build_decode_table()
+
+
+def main():
+    for opcode in (0x1005, 0x1015, 0x1300, 0x3c55, 0x3fff, 0x4031, 0xf0f5, 0x0000):
+        print("{:04x}  {}".format(opcode, DECODE_TABLE[opcode]))
+
+    return 0
+
+if __name__ == '__main__':
+    main()
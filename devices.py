@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  devices.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Modelos de perifericos (ver peripherals.py), con las direcciones de
+    la familia MSP430x2xx:
+
+        Special_function    IE1, IE2, IFG1, IFG2        0x0000..0x0003
+        Port                P1 y P2                     0x0020..0x002f
+        Uart                USCI_A0 en modo UART        0x0060..0x0067
+        Watchdog            WDTCTL                      0x0120
+        Timer_A             TACTL, TAR, TACCRx, TAIV    0x012e, 0x0160..0x0177
+
+    Los relojes: MCLK = SMCLK = cpu.mclk, ACLK = 32768 Hz.
+
+    Ningun dispositivo se actualiza en cada instruccion: el timer calcula
+    TAR a partir de los ciclos transcurridos y agenda solo su proxima
+    coincidencia o desborde; la UART agenda el fin de cada byte.
+
+    Vectores de interrupcion (los del MSP430G2x53):
+        0xfff4  Watchdog en modo intervalo (WDTIFG, se borra al atender)
+        0xfff2  Timer_A, TACCR0 (CCIFG, se borra al atender)
+        0xfff0  Timer_A, TACCR1, TACCR2 y TAIFG (ver TAIV)
+        0xffee  UART, recepcion (UCA0RXIFG)
+        0xffec  UART, transmision (UCA0TXIFG)
+        0xffe6  P2
+        0xffe4  P1
+"""
+
+import sys
+from math import ceil
+
+from peripherals import Peripheral
+
+ACLK = 32768
+
+
+class Special_function(Peripheral):
+    """ Registros de habilitacion y banderas de interrupcion. Los
+        dispositivos que tienen aqui su bandera la conectan a un vector
+        con route().
+    """
+    name = "sfr"
+    state = ("regs",)
+    IE1, IE2, IFG1, IFG2 = range(4)
+
+    def __init__(self):
+        self.sources = []               # (registro IEx, bit, vector)
+        super(Special_function, self).__init__([(0x0000, 4)])
+
+    def reset(self):
+        self.regs = bytearray(4)
+        self.update_irq()
+
+    def route(self, reg, bit, vector):
+        """ El <bit> de <reg> (IE1 o IE2, y la bandera en el mismo bit
+            de IFG1 o IFG2) pide la interrupcion <vector>
+        """
+        self.sources.append((reg, bit, vector))
+
+    def update_irq(self):
+        regs = self.regs
+        for reg, bit, vector in self.sources:
+            self.interrupts.set(vector, regs[reg] & regs[reg + 2] & bit)
+
+    def read_byte(self, addr):
+        return self.regs[addr]
+
+    def write_byte(self, addr, value):
+        self.regs[addr] = value
+        self.update_irq()
+
+    def set_flags(self, reg, bits, state = True):
+        if state:
+            self.regs[reg] |= bits
+        else:
+            self.regs[reg] &= ~bits
+        self.update_irq()
+
+
+class Port(Peripheral):
+    """ Puerto de E/S digital de 8 bits (P1 o P2):
+            PxIN, PxOUT, PxDIR, PxIFG, PxIES, PxIE, PxSEL, PxREN
+        Las entradas se cambian desde afuera con set_input(); cada cambio
+        de PxOUT se avisa a on_output(puerto, valor), si esta definido.
+        PxIFG y PxIE piden la interrupcion <vector>; las banderas las
+        borra el programa.
+    """
+    IN, OUT, DIR, IFG, IES, IE, SEL, REN = range(8)
+    state = ("regs", "inputs")
+
+    def __init__(self, nr = 1, base = None, vector = None):
+        self.nr = nr
+        self.name = "p%d" % nr
+        self.base = base if base != None else 0x0020 + 8 * (nr - 1)
+        self.vector = vector if vector != None else 0xffe4 + 2 * (nr - 1)
+        self.inputs = 0
+        self.on_output = None
+        super(Port, self).__init__([(self.base, 8)])
+
+    def reset(self):
+        self.regs = bytearray(8)
+        self.update_irq()
+
+    def update_irq(self):
+        self.interrupts.set(self.vector, self.regs[Port.IFG] & self.regs[Port.IE])
+
+    def pins(self):
+        """ Estado de los pines: las salidas donde PxDIR es 1 """
+        out, dir = self.regs[Port.OUT], self.regs[Port.DIR]
+        return (out & dir) | (self.inputs & ~dir & 0xff)
+
+    def read_byte(self, addr):
+        reg = addr - self.base
+        if reg == Port.IN:
+            return self.pins()
+        return self.regs[reg]
+
+    def write_byte(self, addr, value):
+        reg = addr - self.base
+        if reg == Port.IN:
+            return
+        self.regs[reg] = value
+        if reg in (Port.OUT, Port.DIR) and self.on_output != None:
+            self.on_output(self, self.pins())
+        elif reg in (Port.IFG, Port.IE):
+            self.update_irq()
+
+    def set_input(self, pin, level):
+        """ Cambia la entrada <pin> (0..7). Un flanco que coincide con
+            PxIES (0: ascendente, 1: descendente) marca PxIFG.
+        """
+        bit = 1 << pin
+        old = self.inputs & bit
+        self.inputs = (self.inputs | bit) if level else (self.inputs & ~bit)
+        if old != (self.inputs & bit):
+            falling = old != 0
+            if falling == ((self.regs[Port.IES] & bit) != 0):
+                self.regs[Port.IFG] |= bit
+                self.update_irq()
+
+
+class Watchdog(Peripheral):
+    """ Watchdog (WDT+). Al reset esta activo: si el programa no lo
+        detiene (WDTHOLD) ni lo borra (WDTCNTCL) antes del intervalo,
+        provoca un PUC. En modo intervalo (WDTTMSEL) marca WDTIFG.
+        Escribir sin la clave 0x5a en el byte alto tambien provoca un PUC.
+    """
+    name = "wdt"
+    state = ("ctl", "event")
+    WDTCTL   = 0x0120
+    WDTPW    = 0x5a00
+    WDTHOLD  = 0x80
+    WDTTMSEL = 0x10
+    WDTCNTCL = 0x08
+    WDTSSEL  = 0x04
+    WDTIS    = 0x03
+    INTERVALS = (32768, 8192, 512, 64)
+    WDTIFG = 0x01                       # En IFG1
+    WDTIE  = 0x01                       # En IE1
+    VECTOR = 0xfff4
+
+    def __init__(self, sfr):
+        self.sfr = sfr
+        sfr.route(Special_function.IE1, self.WDTIE, self.VECTOR)
+        super(Watchdog, self).__init__([(self.WDTCTL, 2)])
+
+    def attach(self, cpu):
+        super(Watchdog, self).attach(cpu)
+        self.interrupts.connect(self.VECTOR, self.acknowledge)
+
+    def acknowledge(self):
+        self.sfr.set_flags(Special_function.IFG1, self.WDTIFG, False)
+
+    def reset(self):
+        self.ctl = 0
+        self.event = None
+        self.restart()
+
+    def restart(self):
+        """ Vuelve a contar el intervalo desde cero """
+        self.scheduler.cancel(self.event)
+        self.event = None
+        if self.ctl & self.WDTHOLD:
+            return
+        interval = self.INTERVALS[self.ctl & self.WDTIS]
+        if self.ctl & self.WDTSSEL:
+            interval = ceil(interval * self.cpu.mclk / ACLK)
+        self.event = self.scheduler.schedule_in(interval, self.expired)
+
+    def expired(self):
+        self.event = None
+        if self.ctl & self.WDTTMSEL:
+            self.sfr.set_flags(Special_function.IFG1, self.WDTIFG)
+            self.restart()
+        else:
+            self.cpu.puc()
+
+    def read_word(self, addr):
+        return 0x6900 | self.ctl
+
+    def read_byte(self, addr):
+        return self.ctl if addr == self.WDTCTL else 0x69
+
+    def write_word(self, addr, value):
+        if value & 0xff00 != self.WDTPW:
+            self.cpu.puc()
+            return
+        self.ctl = value & 0xf7         # WDTCNTCL siempre se lee en 0
+        self.restart()
+
+    def write_byte(self, addr, value):
+        self.cpu.puc()                  # Sin clave
+
+
+class Timer_A(Peripheral):
+    """ Timer_A3: TAR de 16 bits y tres registros de comparacion.
+        TAR no se incrementa: se calcula con los ciclos transcurridos
+        desde el ultimo cambio de configuracion. Solo se agenda el proximo
+        evento (coincidencia con TACCRx o paso por cero).
+    """
+    name = "timer_a"
+    state = ("ctl", "cctl", "ccr", "event", "base_cycle", "base_phase", "event_tick")
+    VECTOR0 = 0xfff2                    # TACCR0
+    VECTOR1 = 0xfff0                    # TACCR1, TACCR2, TAIFG
+    TAIV   = 0x012e
+    TACTL  = 0x0160
+    TACCTL = 0x0162                     # TACCTL0..2
+    TAR    = 0x0170
+    TACCR  = 0x0172                     # TACCR0..2
+
+    TASSEL = 0x0300
+    ID     = 0x00c0
+    MC     = 0x0030
+    TACLR  = 0x0004
+    TAIE   = 0x0002
+    TAIFG  = 0x0001
+    CCIE   = 0x0010
+    CCIFG  = 0x0001
+
+    STOP, UP, CONTINUOUS, UPDOWN = range(4)
+
+    def __init__(self):
+        super(Timer_A, self).__init__([(self.TAIV, 2), (self.TACTL, 0x18)])
+
+    def attach(self, cpu):
+        super(Timer_A, self).attach(cpu)
+        self.interrupts.connect(self.VECTOR0, self.acknowledge)
+
+    def reset(self):
+        self.ctl = 0
+        self.cctl = [0, 0, 0]
+        self.ccr = [0, 0, 0]
+        self.event = None
+        self.base_cycle = self.cycles()     # Ciclo y fase en el ultimo cambio
+        self.base_phase = 0
+        self.event_tick = 0
+        self.update_irq()
+
+    #
+    #   Interrupciones
+    #
+
+    def update_irq(self):
+        cctl, ctl = self.cctl, self.ctl
+        pending = [c & self.CCIE and c & self.CCIFG for c in cctl]
+        self.interrupts.set(self.VECTOR0, pending[0])
+        self.interrupts.set(self.VECTOR1, pending[1] or pending[2] or
+                                          (ctl & self.TAIE and ctl & self.TAIFG))
+
+    def acknowledge(self):
+        """ Al atender TACCR0 se borra su bandera """
+        self.cctl[0] &= ~self.CCIFG
+        self.update_irq()
+
+    #
+    #   Cuenta
+    #
+
+    def tick_cycles(self):
+        """ Ciclos de MCLK por cuenta del timer, o None si no cuenta """
+        mode = (self.ctl & self.MC) >> 4
+        source = (self.ctl & self.TASSEL) >> 8
+        if mode == self.STOP or source in (0, 3):     # TACLK/INCLK: sin reloj
+            return None
+        if mode != self.CONTINUOUS and self.ccr[0] == 0:
+            return None
+        freq = ACLK if source == 1 else self.cpu.mclk
+        return self.cpu.mclk / freq * (1 << ((self.ctl & self.ID) >> 6))
+
+    def period(self):
+        mode = (self.ctl & self.MC) >> 4
+        if mode == self.CONTINUOUS:
+            return 0x10000
+        if mode == self.UP:
+            return self.ccr[0] + 1
+        return 2 * self.ccr[0]
+
+    def ticks(self):
+        """ Cuentas desde el ultimo cambio de configuracion """
+        tick = self.tick_cycles()
+        if tick == None:
+            return 0
+        return int((self.cycles() - self.base_cycle) / tick)
+
+    def phase_to_tar(self, phase):
+        if (self.ctl & self.MC) >> 4 == self.UPDOWN and phase > self.ccr[0]:
+            return 2 * self.ccr[0] - phase
+        return phase
+
+    def tar(self):
+        if self.tick_cycles() == None:
+            return self.base_phase & 0xffff
+        return self.phase_to_tar((self.base_phase + self.ticks()) % self.period())
+
+    def sync(self):
+        """ Fija la fase actual antes de un cambio de configuracion """
+        tick = self.tick_cycles()
+        if tick != None:
+            self.base_phase = (self.base_phase + self.ticks()) % self.period()
+        self.base_cycle = self.cycles()
+
+    #
+    #   Eventos
+    #
+
+    def targets(self):
+        """ Fases con evento: lista de (fase, TACCR o None para TAIFG) """
+        mode = (self.ctl & self.MC) >> 4
+        ccr0 = self.ccr[0]
+        result = [(0, None)]
+        for i in range(3):
+            if mode == self.CONTINUOUS or self.ccr[i] <= ccr0:
+                result.append((self.ccr[i], i))
+                if mode == self.UPDOWN and 0 < self.ccr[i] < ccr0:
+                    result.append((2 * ccr0 - self.ccr[i], i))
+        return result
+
+    def schedule_next(self, after):
+        """ Agenda el proximo evento despues de la cuenta <after> """
+        self.scheduler.cancel(self.event)
+        self.event = None
+        tick = self.tick_cycles()
+        if tick == None:
+            return
+
+        period = self.period()
+        phase = (self.base_phase + after) % period
+        delta = min((target - phase) % period or period for target, _ in self.targets())
+        self.event_tick = after + delta
+        self.event = self.scheduler.schedule(
+                    self.base_cycle + ceil(self.event_tick * tick), self.expired)
+
+    def expired(self):
+        self.event = None
+        phase = (self.base_phase + self.event_tick) % self.period()
+        for target, i in self.targets():
+            if target == phase:
+                if i == None:
+                    self.ctl |= self.TAIFG
+                else:
+                    self.cctl[i] |= self.CCIFG
+        self.update_irq()
+        self.schedule_next(self.event_tick)
+
+    def reconfigure(self):
+        self.schedule_next(self.ticks())
+
+    #
+    #   Registros
+    #
+
+    def read_word(self, addr):
+        if addr == self.TAIV:
+            return self.read_taiv()
+        if addr == self.TACTL:
+            return self.ctl
+        if addr == self.TAR:
+            return self.tar()
+        if self.TACCTL <= addr < self.TACCTL + 6:
+            return self.cctl[(addr - self.TACCTL) >> 1]
+        if self.TACCR <= addr < self.TACCR + 6:
+            return self.ccr[(addr - self.TACCR) >> 1]
+        return 0
+
+    def write_word(self, addr, value):
+        if addr == self.TACTL:
+            self.sync()
+            self.base_phase = self.phase_to_tar(self.base_phase)
+            if value & self.TACLR:
+                self.base_phase = 0
+            self.ctl = value & ~self.TACLR
+            self.reconfigure()
+        elif addr == self.TAR:
+            self.sync()
+            self.base_phase = value % self.period() if self.tick_cycles() != None else value
+            self.reconfigure()
+        elif self.TACCTL <= addr < self.TACCTL + 6:
+            self.cctl[(addr - self.TACCTL) >> 1] = value
+        elif self.TACCR <= addr < self.TACCR + 6:
+            self.sync()
+            self.ccr[(addr - self.TACCR) >> 1] = value
+            if self.tick_cycles() != None:
+                self.base_phase %= self.period()
+            self.reconfigure()
+        self.update_irq()
+
+    def read_byte(self, addr):
+        word = self.read_word(addr & ~1)
+        return (word >> 8) if addr & 1 else (word & 0xff)
+
+    def write_byte(self, addr, value):
+        word = self.read_word(addr & ~1)
+        if addr & 1:
+            word = (word & 0x00ff) | (value << 8)
+        else:
+            word = (word & 0xff00) | value
+        self.write_word(addr & ~1, word)
+
+    def read_taiv(self):
+        """ Fuente de mayor prioridad (TACCR1, TACCR2, TAIFG), que se borra """
+        for i, value in ((1, 0x02), (2, 0x04)):
+            if self.cctl[i] & self.CCIFG:
+                self.cctl[i] &= ~self.CCIFG
+                self.update_irq()
+                return value
+        if self.ctl & self.TAIFG:
+            self.ctl &= ~self.TAIFG
+            self.update_irq()
+            return 0x0a
+        return 0
+
+
+class Uart(Peripheral):
+    """ USCI_A0 en modo UART, simplificado: cada byte tarda 10 bits de
+        UCA0BR (ciclos de SMCLK). Lo transmitido se acumula en output (y
+        se avisa a on_transmit(byte), si esta definido); lo que se pasa a
+        receive() llega de a un byte por vez a UCA0RXBUF.
+    """
+    name = "uart"
+    state = ("regs", "shifting", "txbuf", "rxqueue", "rx_event", "output")
+    CTL0, CTL1, BR0, BR1, MCTL, STAT, RXBUF, TXBUF = range(0x60, 0x68)
+    UCSWRST = 0x01
+    UCBUSY  = 0x01
+    RXIFG, TXIFG = 0x01, 0x02           # En IFG2 (y RXIE, TXIE en IE2)
+    RX_VECTOR, TX_VECTOR = 0xffee, 0xffec
+
+    def __init__(self, sfr):
+        self.sfr = sfr
+        sfr.route(Special_function.IE2, self.RXIFG, self.RX_VECTOR)
+        sfr.route(Special_function.IE2, self.TXIFG, self.TX_VECTOR)
+        self.output = bytearray()
+        self.on_transmit = None
+        super(Uart, self).__init__([(0x0060, 8)])
+
+    def reset(self):
+        self.regs = bytearray(8)
+        self.regs[self.CTL1 - 0x60] = self.UCSWRST
+        self.shifting = None            # Byte en transmision
+        self.txbuf = None               # Byte esperando
+        self.rxqueue = bytearray()
+        self.rx_event = None
+        self.sfr.set_flags(Special_function.IFG2, self.TXIFG)
+
+    def byte_cycles(self):
+        return 10 * max(1, self.regs[self.BR0 - 0x60] | (self.regs[self.BR1 - 0x60] << 8))
+
+    def read_byte(self, addr):
+        if addr == self.RXBUF:
+            self.sfr.set_flags(Special_function.IFG2, self.RXIFG, False)
+        elif addr == self.STAT:
+            busy = self.shifting != None
+            return (self.regs[addr - 0x60] & ~self.UCBUSY) | busy
+        return self.regs[addr - 0x60]
+
+    def write_byte(self, addr, value):
+        if addr == self.TXBUF:
+            if self.regs[self.CTL1 - 0x60] & self.UCSWRST:
+                return
+            if self.shifting == None:
+                self.start_transmit(value)
+            else:
+                self.txbuf = value
+                self.sfr.set_flags(Special_function.IFG2, self.TXIFG, False)
+        elif addr != self.RXBUF:
+            self.regs[addr - 0x60] = value
+            if addr == self.CTL1 and not value & self.UCSWRST:
+                self.schedule_receive()
+
+    def start_transmit(self, value):
+        self.shifting = value
+        self.scheduler.schedule_in(self.byte_cycles(), self.transmitted)
+
+    def transmitted(self):
+        value, self.shifting = self.shifting, None
+        self.output.append(value)
+        if self.on_transmit != None:
+            self.on_transmit(value)
+        if self.txbuf != None:
+            self.start_transmit(self.txbuf)
+            self.txbuf = None
+        self.sfr.set_flags(Special_function.IFG2, self.TXIFG)
+
+    def receive(self, data):
+        """ Datos que llegan por la linea de recepcion """
+        self.rxqueue += data
+        self.schedule_receive()
+
+    def schedule_receive(self):
+        if (self.rx_event == None and self.rxqueue
+                    and not self.regs[self.CTL1 - 0x60] & self.UCSWRST):
+            self.rx_event = self.scheduler.schedule_in(self.byte_cycles(), self.received)
+
+    def received(self):
+        self.rx_event = None
+        self.regs[self.RXBUF - 0x60] = self.rxqueue.pop(0)
+        self.sfr.set_flags(Special_function.IFG2, self.RXIFG)
+        self.schedule_receive()
+
+
+def standard_devices():
+    """ Los dispositivos de devices.py, conectados entre si """
+    sfr = Special_function()
+    return [sfr, Port(1), Port(2), Uart(sfr), Watchdog(sfr), Timer_A()]
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    for dev in standard_devices():
+        c.add_peripheral(dev)
+    print(c.peripherals)
+
+    c.ROM.store_words_at(0xc200, [
+                0x40b2, 0x5a80, 0x0120,     # mov   #WDTPW+WDTHOLD, &WDTCTL
+                0x40b2, 0x03e7, 0x0172,     # mov   #999, &TACCR0
+                0x40b2, 0x0210, 0x0160,     # mov   #TASSEL_2+MC_1, &TACTL
+                0xb392, 0x0162,             # bit   #1, &TACCTL0
+                0x27fd,                     # jz    $-4
+                0xc392, 0x0162,             # bic   #1, &TACCTL0
+                0x53d2, 0x0021,             # inc.b &P1OUT
+                0x3ff8,                     # jmp   $-14
+                ])
+    c.reset()
+    print(c.run(2000))
+    print("P1OUT = {:d}, TAR = {:d}, ciclos = {:d}".format(
+                c.bus.read_byte(0x0021), c.bus.read_word(0x0170), c.cycles()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,67 +23,144 @@
 #
 
 
-import pdb
-from memory import Memory
+""" Desensamblador.
+
+    Disassembler(mem, symtab) desensambla la memoria <mem> (una Memory).
+    Si se da una Symbol_table, los destinos de los saltos, los operandos
+    absolutos (&dir) y los destinos de CALL #dir se muestran con el
+    nombre del simbolo.
+
+    disassemble_all() recorre solo los tramos inicializados de la memoria
+    (Memory.initialized_runs), sin probar cada direccion.
+
+    Las lineas ya desensambladas se guardan en un cache indexado por
+    (direccion, opcode). Como en block_cache.py, el desensamblador vigila
+    (Memory.add_watcher) las paginas con lineas guardadas: al escribir en
+    una de ellas se descartan sus lineas (tambien cubre las palabras de
+    extension). Volver a listar una imagen sin cambios no desensambla
+    nada.
+"""
+
+import sys
+import argparse
+
+from memory import Memory, MemoryException
+from decode import DECODE_TABLE, CALL, F_GROUP, F_OPTYPE, F_MNEMONIC, F_AS, F_AD, F_BYTE, F_RS, F_RD, F_OFFSET
+
+VECTORS = 0xffc0                # Inicio de la tabla de interrupciones
+
+# Formatos de las lineas (el mnemonico ocupa 8 columnas)
+FMT_NONE   = "{:<8s}"
+FMT_SINGLE = "{:<8s}{:s}"
+FMT_DOUBLE = "{:<8s}{:s}, {:s}"
+FMT_WORD   = ".word   0x{:04x}"
+
 
 class Disassembler():
-    def __init__(self, mem):
+    def __init__(self, mem, symtab = None):
         self.mem = mem
 
+        self.lines = {}             # (direccion, opcode) -> (proxima direccion, texto)
+        self.page_lines = {}        # pagina -> claves de las lineas en ella
+        self.watch_bit = None       # Bit de observador en <mem>
+        self.cacheable = hasattr(mem, "add_watcher")
+        self.labels = None          # Valor -> nombre del simbolo
+        self.set_symbols(symtab)
+
+        # Rutinas de desensamblado, indexadas por el grupo de la
+        # instruccion (ver decode.py)
+        self.handlers = (self.opd_single_type1,     # SINGLE1
+                         self.opd_single_type2,     # SINGLE2
+                         self.opd_single_reti,      # RETI
+                         self.opd_jump,             # JUMP
+                         self.opd_double,           # DOUBLE
+                         self.opd_single_reti)      # NOP
+
+
+    def set_symbols(self, symtab):
+        """ Usa los nombres de <symtab> (o ninguno, si es None). Si hay
+            varios nombres para un valor se usa el primero en orden
+            alfabetico. Si los nombres cambian se descarta el cache.
+        """
+        labels = {}
+        if symtab != None:
+            for name, value in sorted(symtab.symbols.items()):
+                if value != None:
+                    labels.setdefault(value, name)
+
+        if labels != self.labels:
+            self.labels = labels
+            self.clear()
+
+
+    def label(self, addr):
+        """ Nombre del simbolo con valor <addr>, o '' """
+        return self.labels.get(addr, "")
+
 
     def one_opcode(self, addr):
         """ Desensambla la instruccion ubicada en la memoria ROM en la
             direccion <addr>.
-            Retorna un string con el opcode y el operando, por ejemplo:
+            Retorna la direccion de la instruccion siguiente y un string
+            con el opcode y el operando, por ejemplo:
                 rrc     25(R5)
         """
-        self.addr = addr
-
-        opcode = self.mem.load_word_at(self.addr)
-
-        if self.addr >= 0xffc0:          # Estamos en la table de interrupciones?
-            s = ".word   0x{:04x}".format(opcode)
-            self.addr += 2
-            return self.addr, s
-
-        for mask, value, opc, opd in (
-                         (0xff80, 0x1000, 'rrc',     self.opd_single_type1),
-                         (0xff80, 0x1080, 'swpb',    self.opd_single_type2),
-                         (0xff80, 0x1100, 'rra',     self.opd_single_type1),
-                         (0xff80, 0x1180, 'sxt',     self.opd_single_type2),
-                         (0xff80, 0x1200, 'push',    self.opd_single_type1),
-                         (0xff80, 0x1280, 'call',    self.opd_single_type2),
-                         (0xffff, 0x1300, 'reti',    self.opd_single_reti),
-
-                         (0xfc00, 0x2000, 'jnz',     self.opd_jump),
-                         (0xfc00, 0x2400, 'jz',      self.opd_jump),
-                         (0xfc00, 0x2800, 'jnc',     self.opd_jump),
-                         (0xfc00, 0x2c00, 'jc',      self.opd_jump),
-                         (0xfc00, 0x3000, 'jn',      self.opd_jump),
-                         (0xfc00, 0x3400, 'jge',     self.opd_jump),
-                         (0xfc00, 0x3800, 'jl',      self.opd_jump),
-                         (0xfc00, 0x3c00, 'jmp',     self.opd_jump),
-
-                         (0xf000, 0x4000, 'mov',     self.opd_double),
-                         (0xf000, 0x5000, 'add',     self.opd_double),
-                         (0xf000, 0x6000, 'addc',    self.opd_double),
-                         (0xf000, 0x7000, 'subc',    self.opd_double),
-                         (0xf000, 0x8000, 'sub',     self.opd_double),
-                         (0xf000, 0x9000, 'cmp',     self.opd_double),
-                         (0xf000, 0xa000, 'dadd',    self.opd_double),
-                         (0xf000, 0xb000, 'bit',     self.opd_double),
-                         (0xf000, 0xc000, 'bic',     self.opd_double),
-                         (0xf000, 0xd000, 'bis',     self.opd_double),
-                         (0xf000, 0xe000, 'xor',     self.opd_double),
-                         (0xf000, 0xf000, 'and',     self.opd_double),
-
-                         (0x0000, 0x0000, 'nop',     self.opd_single_reti)):
-
-            if (opcode & mask) == value:
-                self.addr += 2
+        opcode = self.mem.load_word_at(addr)
+        key = (addr, opcode)
+        line = self.lines.get(key)
+        if line == None:
+            line = self.decode(addr, opcode)
+            if self.cacheable:
+                self.remember(key, line)
+        return line
+
+
+    def decode(self, addr, opcode):
+        """ Desensambla <opcode> (en <addr>), sin usar el cache """
+        self.addr = addr + 2
+
+        if addr >= VECTORS:             # Estamos en la table de interrupciones?
+            return self.addr, FMT_WORD.format(opcode)
+
+        dec = DECODE_TABLE[opcode]
+        s = self.handlers[dec[F_GROUP]](self.addr, opcode, dec)
+        return self.addr, s
+
+    #
+    #   Cache de lineas
+    #
+
+    def remember(self, key, line):
+        self.lines[key] = line
+        if self.watch_bit == None:
+            self.watch_bit = self.mem.add_watcher(self.invalidate)
+
+        for page in range(key[0] >> 8, ((line[0] - 1) >> 8) + 1):
+            keys = self.page_lines.get(page)
+            if keys == None:
+                keys = self.page_lines[page] = set()
+                self.mem.watch(page << 8, 0x100, self.watch_bit)
+            keys.add(key)
+
+
+    def drop_page(self, page):
+        for key in self.page_lines.pop(page, ()):
+            self.lines.pop(key, None)
+        self.mem.watch(page << 8, 0x100, self.watch_bit, False)
+
+
+    def invalidate(self, addr, size):
+        """ Llamado por Memory al escribir en una pagina con lineas """
+        for page in range(addr >> 8, ((addr + size - 1) >> 8) + 1):
+            if page in self.page_lines:
+                self.drop_page(page)
 
-                s = opd(self.addr, opcode, opc)
-                return self.addr, s
+
+    def clear(self):
+        """ Descarta todas las lineas guardadas """
+        for page in list(self.page_lines):
+            self.drop_page(page)
+        self.lines.clear()
 
 
     # Retorna el registro destino en single operando
@@ -107,27 +184,56 @@ class Disassembler():
     # retorna el sufijo '.b' si es una operacion de byte, sino retorna ''
     def opc_suffix(self, opc):      return '.b' if self.opc_Byte(opc) else ''
 
+    #
+    #   Operandos
+    #
+
+    def ext_word(self):
+        """ Lee la palabra de extension en self.addr y avanza. Retorna
+            None (el operando se muestra como '?') si la palabra no esta
+            inicializada o cae fuera de la memoria: un tramo puede
+            terminar en medio de una instruccion, o ser una tabla de datos.
+        """
+        addr = self.addr
+        self.addr += 2
+        mem = self.mem
+        if not mem.mem_start <= addr < mem.mem_start + mem.mem_size - 1:
+            return None
+        try:
+            return mem.load_word_at(addr)
+        except MemoryException:
+            return None
+
+
+    def number(self, value):
+        return "?" if value == None else str(value)
 
-    def opd_As_select(self, opcode, regnr):
-        As = self.opc_As(opcode)
-        Rs = self.opc_source(opcode)
+
+    def symbol(self, value):
+        """ Nombre de <value> si es un simbolo, o su valor """
+        name = self.labels.get(value)
+        return self.number(value) if name == None else name
+
+
+    def opd_As_select(self, As, regnr, target = False):
+        """ Operando fuente. Con <target>, un inmediato es una direccion
+            (CALL #dir) y se muestra con su nombre
+        """
+        Rs = regnr
 
         if As == 0:
             if Rs == 3:
                 s = "#0"
             else:
-                s = "R%d" % regnr
+                s = "R{:d}".format(regnr)
 
         elif As == 1:
             if Rs == 2:
-                s = "&%d" % self.mem.load_word_at(self.addr)
-                self.addr += 2
+                s = "&" + self.symbol(self.ext_word())
             elif Rs == 3:
                 s = "#1"
             else:
-                s = "%d(R%d)" % (self.mem.load_word_at(self.addr),
-                                 regnr)
-                self.addr += 2
+                s = "{:s}(R{:d})".format(self.number(self.ext_word()), regnr)
 
         elif As == 2:
             if Rs == 2:
@@ -135,37 +241,34 @@ class Disassembler():
             elif Rs == 3:
                 s = "#2"
             else:
-                s = "@R%d" % regnr
-
-        elif As == 3:
-            # if Rs == 0:
-            #     s = "#%d" % self.mem.load_word_at(self.addr)
-            #     self.addr += 2
-            # elif Rs == 2:
-            #     s = "#8"
-            # elif Rs == 3:
-            #     s = "#-1"
-            # else:
-            s = "@R%d+" % regnr
+                s = "@R{:d}".format(regnr)
+
+        else:
+            if Rs == 0:
+                w = self.ext_word()
+                s = "#" + (self.symbol(w) if target else self.number(w))
+            elif Rs == 2:
+                s = "#8"
+            elif Rs == 3:
+                s = "#-1"
+            else:
+                s = "@R{:d}+".format(regnr)
 
         return s
 
 
-    def opd_Ad_select(self,opcode, regnr):
-        Ad = self.opc_Ad(opcode)
-
+    def opd_Ad_select(self, Ad, regnr):
         if Ad == 0:
-            s = "R%d" % regnr
+            s = "R{:d}".format(regnr)
 
-        elif Ad == 1:
+        else:
             if regnr == 2:
-                s = "&%d" % self.mem.load_word_at(self.addr)
+                s = "&" + self.symbol(self.ext_word())
             elif regnr == 3:
-                s = "1(R%d)" % regnr
+                self.addr += 2
+                s = "1(R3)"
             else:
-                s = "%d(R%d)" % (self.mem.load_word_at(self.addr),
-                                 regnr)
-            self.addr += 2
+                s = "{:s}(R{:d})".format(self.number(self.ext_word()), regnr)
 
         return s
 
@@ -173,42 +276,42 @@ class Disassembler():
     #   Instrucciones de simple operando
     #
 
-    def opd_single_type1(self, addr, opcode, opcstr):
+    def opd_single_type1(self, addr, opcode, dec):
         """ Desensamblar instruccion RRC, RRA, PUSH """
-        return "%-8s%s" % (opcstr + self.opc_suffix(opcode),
-                           self.opd_As_select(opcode, self.opc_destination(opcode)))
+        return FMT_SINGLE.format(dec[F_MNEMONIC] + ('.b' if dec[F_BYTE] else ''),
+                                 self.opd_As_select(dec[F_AS], dec[F_RD]))
 
 
-    def opd_single_type2(self, addr, opcode, opcstr):
+    def opd_single_type2(self, addr, opcode, dec):
         """ Desensamblar instruccion SWPB, SXT, CALL """
-        return "%-8s%s" % (opcstr,
-                           self.opd_As_select(opcode, self.opc_destination(opcode)))
+        return FMT_SINGLE.format(dec[F_MNEMONIC],
+                                 self.opd_As_select(dec[F_AS], dec[F_RD],
+                                                    dec[F_OPTYPE] == CALL))
 
 
-    def opd_single_reti(self, addr, opcode, opcstr):
+    def opd_single_reti(self, addr, opcode, dec):
         """ Desensamblar instruccion RETI """
-        return "%-8s" % (opcstr)
+        return FMT_NONE.format(dec[F_MNEMONIC])
 
     #
     #   Instrucciones de doble operando
     #
 
-    def opd_double(self, addr, opcode, opcstr):
-        return "%-8s%s, %s" % (opcstr + self.opc_suffix(opcode),
-                               self.opd_As_select(opcode, self.opc_source(opcode)),
-                               self.opd_Ad_select(opcode, self.opc_destination(opcode)))
+    def opd_double(self, addr, opcode, dec):
+        src = self.opd_As_select(dec[F_AS], dec[F_RS])
+        return FMT_DOUBLE.format(dec[F_MNEMONIC] + ('.b' if dec[F_BYTE] else ''),
+                                 src,
+                                 self.opd_Ad_select(dec[F_AD], dec[F_RD]))
 
     #
     #   Instrucciones de salto (condicional)
     #
 
-    def opd_jump(self, addr, opcode, opcstr):
-        offset = (opcode & 0x03ff) - 1
-        if (offset & 0x0200) != 0:      # Positivo
-            offset |= 0xfe00
-        addr1 = (addr + 2*offset) & 0xffff
-
-        return "%-8s0x%04x" % (opcstr, addr1)
+    def opd_jump(self, addr, opcode, dec):
+        addr1 = (addr + 2*dec[F_OFFSET]) & 0xffff
+        name = self.labels.get(addr1)
+        return FMT_SINGLE.format(dec[F_MNEMONIC],
+                                 "0x{:04x}".format(addr1) if name == None else name)
 
 
     def disassemble(self, start, end):
@@ -220,21 +323,26 @@ class Disassembler():
 
 
     def disassemble_all(self):
-        pc = self.mem.mem_start
+        """ Generador de (pc, proximo pc, texto) de todas las instrucciones
+            en los tramos inicializados de la memoria
+        """
+        mem_start = self.mem.mem_start
+        for offs, size in self.mem.initialized_runs():
+            pc = (mem_start + offs + 1) & ~1
+            end = mem_start + offs + size
+            while pc + 2 <= end:
+                new_pc, s = self.one_opcode(pc)
+                yield pc, new_pc, s
+                pc = new_pc
 
-        while pc < (self.mem.mem_start + self.mem.mem_size):
-            try:
-                self.mem.load_word_at(pc)
-            except:
-                pc += 2
-                continue
 
-            new_pc, s = self.one_opcode(pc)
-            yield pc, new_pc, s
-            pc = new_pc
+def listing(dis):
+    """ Lineas del listado de todo el contenido de <dis> """
+    for pc, _, s in dis.disassemble_all():
+        yield "{:04x}  {:<16s}{:s}\n".format(pc, dis.label(pc), s)
 
 
-def main():
+def demo():
     m = Memory(1024, mem_start = 0xfc00)
     d = Disassembler(m)
 
@@ -262,7 +370,47 @@ def main():
     for pc, new_pc, s in dasm:
         print("{:04x}  {:s}".format(pc, s))
 
+    # Con simbolos: destinos de saltos, CALL #dir y &dir
+    from symbol_table import Symbol_table
+    st = Symbol_table()
+    st.define("inicio", 0xfe00)
+    st.define("rutina", 0xfe0c)
+    st.define("WDTCTL", 0x0120)
+    m.store_words_at(0xfe00, [
+                0x40b2, 0x5a80, 0x0120,     # mov   #0x5a80, &WDTCTL
+                0x12b0, 0xfe0c,             # call  #rutina
+                0x3ffa,                     # jmp   inicio
+                0x4130])                    # rutina: ret
+    d.set_symbols(st)
+    sys.stdout.writelines(listing(d))
+
+    # Las lineas quedan en el cache hasta que se escribe en su pagina
+    print(len(d.lines), "lineas en el cache")
+    m.store_word_at(0xfe0a, 0x4303)
+    print(len(d.lines), "lineas luego de escribir en 0xfe0a")
+    d.disassemble(0xfe00, 0xfe0c)
+    return 0
+
+
+def main():
+    argp = argparse.ArgumentParser(description = "Desensamblador del simulador MSP430")
+    argp.add_argument("program", nargs = "?",
+                      help = "Programa (Intel HEX, ELF o imagen). Sin el, una demostracion")
+    argp.add_argument("-a", "--asm", help = "Fuente, para los nombres de los simbolos")
+    args = argp.parse_args()
+
+    if args.program == None:
+        return demo()
+
+    from cpu import CPU
+    cpu = CPU()
+    symtab = cpu.load_program(args.program)
+    if args.asm:
+        from profiler import assemble_symbols
+        symtab = assemble_symbols(args.asm)
+
+    sys.stdout.writelines(listing(Disassembler(cpu.ROM, symtab)))
     return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
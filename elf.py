@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  elf.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Cargador de archivos ELF32 para MSP430 (EM_MSP430), como los que
+    generan msp430-elf-gcc y el compilador de TI.
+
+    El archivo se mapea con mmap (solo lectura) y se leen unicamente las
+    partes necesarias: los segmentos PT_LOAD se copian a la memoria desde
+    el mapeo, y la tabla de simbolos (.symtab + .strtab) se interpreta
+    recien la primera vez que se pide Elf_file.symtab.
+"""
+
+import sys
+import mmap
+import struct
+
+from memory import MemoryException
+from symbol_table import Symbol_table
+
+
+class ElfException(MemoryException): pass
+
+
+EM_MSP430 = 105
+PT_LOAD   = 1
+SHT_SYMTAB = 2
+SHN_UNDEF  = 0
+STT_NOTYPE, STT_OBJECT, STT_FUNC, STT_SECTION, STT_FILE = range(5)
+
+IDENT   = struct.Struct("<4sBBB9x")
+HEADER  = struct.Struct("<HHIIIIIHHHHHH")   # e_type ... e_shstrndx
+PROGRAM = struct.Struct("<IIIIIIII")        # p_type ... p_align
+SECTION = struct.Struct("<IIIIIIIIII")      # sh_name ... sh_entsize
+SYMBOL  = struct.Struct("<IIIBBH")          # st_name ... st_shndx
+
+
+class Elf_file():
+    """ Archivo ELF abierto con mmap:
+            entry       Punto de entrada (e_entry)
+            segments    Lista de (direccion de carga, memoryview) de los
+                        segmentos PT_LOAD con datos
+            symtab      Symbol_table con las funciones, objetos y
+                        etiquetas definidas (se arma al pedirla)
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as inf:
+            try:
+                self.mmap = mmap.mmap(inf.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError:
+                raise ElfException("Archivo ELF vacio ({:s})".format(fname))
+        self.view = memoryview(self.mmap)
+
+        if len(self.view) < IDENT.size + HEADER.size:
+            raise ElfException("Archivo ELF incompleto ({:s})".format(fname))
+        magic, ei_class, ei_data, _ = IDENT.unpack_from(self.view)
+        if magic != b"\x7fELF":
+            raise ElfException("No es un archivo ELF ({:s})".format(fname))
+        if ei_class != 1 or ei_data != 1:
+            raise ElfException("Solo se soporta ELF32 little endian ({:s})".format(fname))
+
+        (e_type, e_machine, e_version, self.entry, self.phoff, self.shoff,
+         e_flags, e_ehsize, self.phentsize, self.phnum,
+         self.shentsize, self.shnum, self.shstrndx) = HEADER.unpack_from(self.view, IDENT.size)
+        if e_machine != EM_MSP430:
+            raise ElfException("El archivo no es para MSP430 (e_machine = {:d})".format(e_machine))
+
+        self._symtab = None
+
+
+    def segments(self):
+        """ Segmentos PT_LOAD: lista de (direccion fisica, datos). Se usa
+            la direccion fisica (LMA), como en un archivo HEX: los datos
+            inicializados de la RAM quedan en la flash.
+        """
+        result = []
+        for nr in range(self.phnum):
+            (p_type, p_offset, p_vaddr, p_paddr,
+             p_filesz, p_memsz, p_flags, p_align) = PROGRAM.unpack_from(
+                        self.view, self.phoff + nr * self.phentsize)
+            if p_type == PT_LOAD and p_filesz > 0:
+                if p_offset + p_filesz > len(self.view):
+                    raise ElfException("Segmento fuera del archivo (0x{:04x})".format(p_paddr))
+                result.append((p_paddr, self.view[p_offset : p_offset + p_filesz]))
+        return result
+
+
+    def load(self, bus):
+        """ Copia los segmentos a <bus> (Memory_bus o Memory), una copia
+            por segmento
+        """
+        for addr, data in self.segments():
+            bus.store_bytes_at(addr, data)
+
+
+    def sections(self):
+        """ Encabezados de seccion, como tuplas de SECTION """
+        return [SECTION.unpack_from(self.view, self.shoff + nr * self.shentsize)
+                            for nr in range(self.shnum)]
+
+
+    def string_at(self, offs):
+        end = self.mmap.find(b"\0", offs)
+        return bytes(self.view[offs : end]).decode("utf-8", "replace")
+
+
+    @property
+    def symtab(self):
+        if self._symtab == None:
+            self._symtab = self.read_symtab()
+        return self._symtab
+
+
+    def read_symtab(self):
+        """ Arma la Symbol_table con los simbolos definidos de .symtab
+            (funciones, objetos y etiquetas). Si un nombre se repite
+            (simbolos locales de distintos archivos) queda el primero.
+        """
+        st = Symbol_table()
+        sections = self.sections()
+        for sh in sections:
+            sh_type, sh_offset, sh_size, sh_link, sh_entsize = sh[1], sh[4], sh[5], sh[6], sh[9]
+            if sh_type != SHT_SYMTAB:
+                continue
+            strtab = sections[sh_link][4]
+            for offs in range(sh_offset, sh_offset + sh_size, sh_entsize or SYMBOL.size):
+                st_name, st_value, st_size, st_info, st_other, st_shndx = SYMBOL.unpack_from(self.view, offs)
+                if st_shndx == SHN_UNDEF or st_name == 0:
+                    continue
+                if st_info & 0x0f not in (STT_NOTYPE, STT_OBJECT, STT_FUNC):
+                    continue
+                name = self.string_at(strtab + st_name)
+                if not st.defined(name):
+                    st.define(name, st_value & 0xffff)
+        return st
+
+
+def load_elf(fname):
+    return Elf_file(fname)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: elf.py archivo.elf")
+        return 1
+
+    elf = Elf_file(sys.argv[1])
+    print("Entrada: 0x{:04x}".format(elf.entry))
+    for addr, data in elf.segments():
+        print("Segmento 0x{:04x}, {:d} bytes".format(addr, len(data)))
+    elf.symtab.dump()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
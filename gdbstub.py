@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  gdbstub.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Servidor GDB (Remote Serial Protocol) para el simulador, sobre un
+    socket TCP local, con asyncio.
+
+    Paquetes soportados:
+        ?  g G p P  m M X       Estado, registros y memoria
+        s c                     Paso y continuar (Ctrl-C interrumpe)
+        bs bc                   Paso y continuar hacia atras (si el CPU
+                                tiene una historia, ver history.py)
+        Z0..Z4 z0..z4           Breakpoints y watchpoints (ver
+                                breakpoints.py)
+        qSupported QStartNoAckMode qAttached H k D
+
+    Las lecturas y escrituras de memoria se hacen de a bloques
+    (Memory_bus.load_bytes_at / store_bytes_at), no de a palabra.
+
+    Uso:
+        gdbstub.py programa [-p puerto] [-r bytes por registro]
+    y desde gdb:
+        (gdb) target remote localhost:2000
+"""
+
+import sys
+import asyncio
+import argparse
+
+from cpu import CPU, CPUException, Run_result
+from memory import MemoryException
+from breakpoints import Breakpoints, BreakpointException
+
+SIGINT, SIGTRAP, SIGSEGV = 2, 5, 11
+
+# Instrucciones (y ciclos, para cuando el CPU duerme) por tramo de
+# 'continue': entre tramos se atienden los paquetes entrantes (Ctrl-C)
+RUN_CHUNK = 20000
+RUN_CHUNK_CYCLES = 1 << 20
+
+WATCH_KINDS = {2: Breakpoints.WRITE, 3: Breakpoints.READ, 4: Breakpoints.ACCESS}
+WATCH_NAMES = {Breakpoints.WRITE: "watch", Breakpoints.READ: "rwatch",
+               Breakpoints.ACCESS: "awatch"}
+
+
+def checksum(data):
+    return sum(data) & 0xff
+
+
+def unescape(data):
+    """ Datos binarios de un paquete X: '}' indica que el byte siguiente
+        esta xor 0x20. Lanza ValueError si el paquete termina en '}'.
+    """
+    if b"}" not in data:
+        return data
+    out = bytearray()
+    it = iter(data)
+    for b in it:
+        if b == 0x7d:
+            b = next(it, None)
+            if b == None:
+                raise ValueError("Paquete terminado en '}'")
+            b ^= 0x20
+        out.append(b)
+    return bytes(out)
+
+
+class Gdb_session():
+    """ Una conexion de gdb. <reg_size> es la cantidad de bytes de cada
+        registro en los paquetes g/G/p/P (2 para MSP430, 4 si gdb usa
+        registros de 20 bits de MSP430X).
+    """
+    def __init__(self, cpu, reader, writer, reg_size = 2):
+        self.cpu = cpu
+        self.reader = reader
+        self.writer = writer
+        self.reg_size = reg_size
+        self.ack = True
+        self.interrupted = False
+        self.packets = asyncio.Queue()
+
+        if cpu.breakpoints == None:
+            Breakpoints().attach(cpu)
+        self.breakpoints = cpu.breakpoints
+
+        self.commands = {
+            "?": self.cmd_stop_reason,
+            "g": self.cmd_read_registers,
+            "G": self.cmd_write_registers,
+            "p": self.cmd_read_register,
+            "P": self.cmd_write_register,
+            "m": self.cmd_read_memory,
+            "M": self.cmd_write_memory,
+            "X": self.cmd_write_binary,
+            "Z": self.cmd_insert,
+            "z": self.cmd_remove,
+            "q": self.cmd_query,
+            "Q": self.cmd_set,
+            "H": lambda args: b"OK",
+        }
+        self.last_stop = b"S%02x" % SIGTRAP
+
+
+    async def serve(self):
+        """ Atiende la conexion hasta que gdb se desconecta """
+        reader_task = asyncio.ensure_future(self.read_packets())
+        try:
+            while True:
+                packet = await self.packets.get()
+                if packet == None:
+                    break
+                reply = await self.dispatch(packet)
+                if reply == None:
+                    break
+                await self.send(reply)
+        finally:
+            reader_task.cancel()
+            self.writer.close()
+
+
+    async def read_packets(self):
+        """ Separa los paquetes del flujo de entrada. Un 0x03 (Ctrl-C)
+            interrumpe la ejecucion en curso.
+        """
+        reader = self.reader
+        try:
+            while True:
+                c = await reader.read(1)
+                if not c:
+                    break
+                if c == b"\x03":
+                    self.interrupted = True
+                elif c == b"$":
+                    data = await reader.readuntil(b"#")
+                    cs = await reader.readexactly(2)
+                    data = data[:-1]
+                    if self.ack:
+                        ok = int(cs, 16) == checksum(data)
+                        self.writer.write(b"+" if ok else b"-")
+                        if not ok:
+                            continue
+                    await self.packets.put(data)
+                # '+' y '-' de gdb: no se retransmite
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        await self.packets.put(None)
+
+
+    async def send(self, data):
+        self.writer.write(b"$" + data + b"#%02x" % checksum(data))
+        await self.writer.drain()
+
+
+    async def dispatch(self, packet):
+        if packet[:1] in (b"s", b"c"):
+            return await self.resume(packet[:1] == b"s", packet[1:])
+        if packet[:2] in (b"bs", b"bc"):
+            return self.reverse(packet[:2] == b"bs")
+        if packet.startswith(b"vMustReplyEmpty") or packet.startswith(b"vCont"):
+            return b""
+        if packet[:1] in (b"D", b"k"):
+            await self.send(b"OK")
+            return None
+
+        handler = self.commands.get(chr(packet[0])) if packet else None
+        if handler == None:
+            return b""
+        try:
+            return handler(packet[1:].decode("latin-1"))
+        except (ValueError, IndexError, MemoryException, BreakpointException):
+            return b"E01"
+
+    #
+    #   Ejecucion
+    #
+
+    async def resume(self, step, args):
+        """ Paquetes s y c (con direccion opcional) """
+        cpu = self.cpu
+        if args:
+            cpu.reg.set_PC(int(args, 16))
+
+        if step:
+            try:
+                cpu.step()
+                self.last_stop = b"S%02x" % SIGTRAP
+            except CPUException:
+                self.last_stop = b"S%02x" % SIGSEGV
+            return self.last_stop
+
+        self.interrupted = False
+        while True:
+            result = cpu.run(RUN_CHUNK, max_cycles = RUN_CHUNK_CYCLES)
+            if result.reason != Run_result.LIMIT:
+                break
+            await asyncio.sleep(0)          # Atender Ctrl-C
+            if self.interrupted:
+                self.last_stop = b"S%02x" % SIGINT
+                return self.last_stop
+            # run() no se detiene en la primera instruccion: el tramo
+            # siguiente puede empezar justo en un breakpoint
+            if cpu.reg.get_PC() in self.breakpoints:
+                result.reason = Run_result.BREAK
+                break
+
+        self.last_stop = self.stop_reply(result)
+        return self.last_stop
+
+
+    def reverse(self, step):
+        """ Paquetes bs y bc """
+        try:
+            if step:
+                self.cpu.step_back(1)
+            elif not self.cpu.reverse_continue(self.breakpoints):
+                return b"T%02xreplaylog:begin;" % SIGTRAP
+        except CPUException:
+            return b"E01"
+        self.last_stop = b"S%02x" % SIGTRAP
+        return self.last_stop
+
+
+    def stop_reply(self, result):
+        if result.reason == Run_result.WATCH:
+            addr, size, kind = self.breakpoints.hit
+            wsize, wkind = self.breakpoints.watches[addr]
+            return b"T%02x%s:%x;" % (SIGTRAP, WATCH_NAMES[wkind].encode(), addr)
+        if result.reason == Run_result.BREAK:
+            return b"T%02xswbreak:;" % SIGTRAP
+        if result.reason == Run_result.END:
+            return b"S%02x" % SIGSEGV
+        return b"S%02x" % SIGTRAP
+
+
+    def cmd_stop_reason(self, args):
+        return self.last_stop
+
+    #
+    #   Registros
+    #
+
+    def encode_register(self, value):
+        return value.to_bytes(self.reg_size, "little").hex().encode()
+
+
+    def cmd_read_registers(self, args):
+        return b"".join(self.encode_register(r) for r in self.cpu.reg.get_registers())
+
+
+    def cmd_write_registers(self, args):
+        regs = self.cpu.reg.get_registers()
+        data = bytes.fromhex(args)
+        for r in range(16):
+            chunk = data[r * self.reg_size : (r + 1) * self.reg_size]
+            if len(chunk) == self.reg_size:
+                regs[r] = int.from_bytes(chunk, "little") & 0xffff
+        return b"OK"
+
+
+    def cmd_read_register(self, args):
+        r = int(args, 16)
+        if r >= 16:
+            return b"E01"
+        return self.encode_register(self.cpu.reg.get(r))
+
+
+    def cmd_write_register(self, args):
+        r, value = args.split("=")
+        r = int(r, 16)
+        if r >= 16:
+            return b"E01"
+        self.cpu.reg.set(r, int.from_bytes(bytes.fromhex(value), "little") & 0xffff)
+        return b"OK"
+
+    #
+    #   Memoria
+    #
+
+    def cmd_read_memory(self, args):
+        addr, size = (int(x, 16) for x in args.split(","))
+        return self.cpu.bus.load_bytes_at(addr, size).hex().encode()
+
+
+    def cmd_write_memory(self, args):
+        where, data = args.split(":")
+        addr, size = (int(x, 16) for x in where.split(","))
+        self.cpu.bus.store_bytes_at(addr, bytes.fromhex(data)[:size])
+        return b"OK"
+
+
+    def cmd_write_binary(self, args):
+        where, data = args.split(":", 1)
+        addr, size = (int(x, 16) for x in where.split(","))
+        if size:
+            self.cpu.bus.store_bytes_at(addr, unescape(data.encode("latin-1"))[:size])
+        return b"OK"
+
+    #
+    #   Breakpoints y watchpoints
+    #
+
+    def cmd_insert(self, args):
+        kind, addr, size = args.split(",")[:3]
+        kind, addr, size = int(kind), int(addr, 16), int(size, 16)
+        if kind in (0, 1):
+            self.breakpoints.add(addr)
+        elif kind in WATCH_KINDS:
+            self.breakpoints.watch(addr, size, WATCH_KINDS[kind])
+        else:
+            return b""
+        return b"OK"
+
+
+    def cmd_remove(self, args):
+        kind, addr, size = args.split(",")[:3]
+        kind, addr = int(kind), int(addr, 16)
+        if kind in (0, 1):
+            self.breakpoints.remove(addr)
+        elif kind in WATCH_KINDS:
+            self.breakpoints.unwatch(addr)
+        else:
+            return b""
+        return b"OK"
+
+    #
+    #   Consultas
+    #
+
+    def cmd_query(self, args):
+        if args.startswith("Supported"):
+            features = "PacketSize=4000;QStartNoAckMode+;swbreak+;hwbreak+"
+            if hasattr(self.cpu.tracer, "undo"):
+                features += ";ReverseStep+;ReverseContinue+"
+            return features.encode()
+        if args.startswith("Attached"):
+            return b"1"
+        if args == "C":
+            return b"QC1"
+        if args == "fThreadInfo":
+            return b"m1"
+        if args == "sThreadInfo":
+            return b"l"
+        return b""
+
+
+    def cmd_set(self, args):
+        if args == "StartNoAckMode":
+            self.ack = False
+            return b"OK"
+        return b""
+
+
+
+
+class Gdb_server():
+    """ Servidor de un solo CPU: atiende una conexion de gdb por vez """
+    def __init__(self, cpu, host = "localhost", port = 2000, reg_size = 2):
+        self.cpu = cpu
+        self.host = host
+        self.port = port
+        self.reg_size = reg_size
+        self.lock = asyncio.Lock()
+
+
+    async def handle(self, reader, writer):
+        async with self.lock:
+            session = Gdb_session(self.cpu, reader, writer, self.reg_size)
+            await session.serve()
+
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+
+
+def main():
+    argp = argparse.ArgumentParser(description = "Servidor GDB del simulador MSP430")
+    argp.add_argument("program", help = "Programa (Intel HEX, ELF o imagen)")
+    argp.add_argument("-p", "--port", type = int, default = 2000)
+    argp.add_argument("-r", "--reg-size", type = int, default = 2, choices = (2, 4),
+                      help = "Bytes por registro en los paquetes de gdb")
+    argp.add_argument("--part", default = "MSP430iua")
+    args = argp.parse_args()
+
+    cpu = CPU(args.part)
+    cpu.load_program(args.program)
+
+    print("Esperando a gdb en localhost:{:d}".format(args.port))
+    try:
+        asyncio.run(Gdb_server(cpu, port = args.port, reg_size = args.reg_size).serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
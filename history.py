@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  history.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Ejecucion reversible (paso atras).
+
+    History es un registro de traza (ver tracer.py) con buffer circular:
+    cada instruccion deja los valores anteriores de los registros y de
+    la memoria que modifico. Volver una instruccion es desandar sus
+    entradas, sin re-ejecutar nada.
+
+    Cada <interval> instrucciones se guarda ademas una instantanea
+    completa (CPU.snapshot, copy-on-write). Si se pide volver mas atras
+    de lo que queda en el buffer, se restaura la instantanea anterior y
+    se re-ejecuta hacia adelante solo el tramo que falta.
+
+    El buffer no registra el estado de los perifericos (registros,
+    eventos agendados, interrupciones pendientes), que si esta en las
+    instantaneas: con dispositivos conectados siempre se vuelve atras
+    restaurando una instantanea y re-ejecutando.
+
+    Uso:
+        hist = History()
+        hist.attach(cpu)
+        cpu.run(...)
+        cpu.step_back(10)
+        cpu.reverse_continue(breakpoints)
+"""
+
+from collections import deque
+
+from tracer import Trace_recorder, ENTRY, STEP, REG, INTERRUPT, IDLE
+from registers import Registers
+from timing import CYCLE_TABLE, INTERRUPT_CYCLES
+
+
+class History(Trace_recorder):
+    """ <capacity> es la cantidad de entradas del buffer circular (8
+        bytes cada una, entre una y unas pocas por instruccion);
+        <interval> la cantidad de instrucciones entre instantaneas, y
+        <max_checkpoints> cuantas instantaneas se conservan.
+    """
+    def __init__(self, capacity = 1 << 20, interval = 1 << 16, max_checkpoints = 64):
+        super(History, self).__init__(capacity)
+        self.interval = interval
+        self.checkpoints = deque(maxlen = max_checkpoints)
+
+
+    def attach(self, cpu):
+        super(History, self).attach(cpu)
+        self.sim = cpu.sim
+        self.clear()
+
+
+    def clear(self):
+        """ Olvida la historia: el estado actual pasa a ser el primero """
+        self.discard()
+        self.checkpoints.clear()
+        self.checkpoint()
+
+
+    def checkpoint(self, pc = None):
+        """ Guarda una instantanea. <pc> es el PC si el CPU aun no lo
+            actualizo (al terminar una instruccion).
+        """
+        snap = self.cpu.snapshot()
+        if pc != None:
+            snap.registers[Registers.PC] = pc
+        self.checkpoints.append((self.sim.instructions, snap))
+        self.next_checkpoint = self.sim.instructions + self.interval
+
+
+    def end(self, pc, new_pc, vector = None):
+        super(History, self).end(pc, new_pc, vector)
+        if self.sim.instructions >= self.next_checkpoint:
+            self.checkpoint(new_pc)
+
+
+    def undo(self):
+        """ Deshace la ultima instruccion del buffer. Retorna False si el
+            buffer esta vacio, o si hay perifericos (ver arriba).
+        """
+        if self.count == 0 or self.cpu.peripherals.devices:
+            return False
+
+        buf, pos, size = self.buf, self.pos, ENTRY.size
+        pos = (pos or self.capacity) - 1
+        kind, flags, pc, opcode, n = ENTRY.unpack_from(buf, pos * size)
+        if flags == IDLE:               # CPU apagado: son los ciclos
+            self.pos = pos
+            self.count -= 1
+            self.sim.cycles -= opcode | (n << 16)
+            return True
+
+        if n >= self.count:             # Instruccion cortada por el buffer
+            self.discard()
+            return False
+
+        regs, bus = self.regs, self.bus
+        for i in range(n):
+            pos = (pos or self.capacity) - 1
+            kind, a, addr, new, old = ENTRY.unpack_from(buf, pos * size)
+            if kind == REG:
+                regs[a] = old
+            elif a == 1:
+                bus.write_byte(addr, old)
+            else:
+                bus.write_word(addr, old)
+
+        self.pos = pos
+        self.count -= n + 1
+        regs[Registers.PC] = pc
+
+        if flags == INTERRUPT:          # Entrada a una interrupcion
+            self.sim.cycles -= INTERRUPT_CYCLES
+        else:
+            self.sim.cycles -= CYCLE_TABLE[opcode]
+            self.sim.instructions -= 1
+
+        # Las instantaneas posteriores ya no valen si se modifica el estado
+        if self.checkpoints[-1][0] > self.sim.instructions and len(self.checkpoints) > 1:
+            self.checkpoints.pop()
+            self.next_checkpoint = self.checkpoints[-1][0] + self.interval
+        return True
+
+
+    def goto(self, instructions):
+        """ Lleva al CPU al estado luego de <instructions> instrucciones
+            (contadas desde el reset), restaurando la instantanea anterior
+            y re-ejecutando. Retorna False si no hay instantanea tan vieja.
+        """
+        while len(self.checkpoints) > 1 and self.checkpoints[-1][0] > instructions:
+            self.checkpoints.pop()
+        start, snap = self.checkpoints[-1]
+        if start > instructions:
+            return False
+
+        self.cpu.restore(snap)
+        self.discard()
+        self.next_checkpoint = start + self.interval
+        if instructions > start:
+            sim = self.sim
+            self.cpu.run(None, lambda cpu: sim.instructions >= instructions)
+        return True
+
+
+    def step_back(self, n = 1):
+        """ Vuelve <n> instrucciones atras. Retorna la cantidad que se
+            pudo volver.
+        """
+        done = 0
+        while done < n and self.undo():
+            done += 1
+        if done == n:
+            return n
+
+        target = max(self.sim.instructions - (n - done), self.checkpoints[0][0])
+        current = self.sim.instructions
+        if target < current and self.goto(target):
+            done += current - target
+        return done
+
+
+    def reverse_continue(self, breakpoints):
+        """ Vuelve hacia atras hasta una instruccion cuya direccion este en
+            <breakpoints> (cualquier objeto que acepte 'pc in breakpoints').
+            Retorna True si la encontro, False si llego al principio de la
+            historia.
+        """
+        regs = self.regs
+        while self.undo():
+            if regs[Registers.PC] in breakpoints:
+                return True
+
+        # Fuera del buffer: re-ejecutar de a un tramo entre instantaneas,
+        # anotando por donde paso, y volver a la ultima coincidencia
+        end = self.sim.instructions
+        sim = self.sim
+        while True:
+            while len(self.checkpoints) > 1 and self.checkpoints[-1][0] >= end:
+                self.checkpoints.pop()
+            start, snap = self.checkpoints[-1]
+            if start >= end:
+                return False
+
+            self.cpu.restore(snap)
+            hits = [start] if regs[Registers.PC] in breakpoints else []
+
+            def passed(cpu):
+                if sim.instructions >= end:
+                    return True
+                if regs[Registers.PC] in breakpoints:
+                    hits.append(sim.instructions)
+                return False
+
+            self.cpu.run(None, passed)
+            if hits:
+                self.goto(hits[-1])
+                return True
+            self.goto(start)
+            end = start
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0x403f, 0x0064,             # mov   #100, R15
+                0x120f,                     # push  R15
+                0x531f,                     # inc   R15
+                0x413f,                     # pop   R15
+                0x831f,                     # dec   R15
+                0x23fb,                     # jnz   $-8
+                0x3fff])                    # jmp   $
+    c.reset()
+
+    hist = History(capacity = 64, interval = 50)
+    hist.attach(c)
+    print(c.run_until(0xc212))
+    print(c.reg.get(15), c.stats())
+
+    print(c.step_back(1), hex(c.reg.get_PC()), c.reg.get(15))
+    print(c.step_back(300), hex(c.reg.get_PC()), c.reg.get(15), c.stats())
+    print(c.reverse_continue({0xc208}), hex(c.reg.get_PC()), c.reg.get(15), c.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  image.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Formato binario de imagen de memoria, para cargar programas sin
+    interpretar Intel HEX.
+
+    Estructura del archivo (little endian):
+        Encabezado (HEADER)     magic, version, cantidad de regiones,
+                                nombre del micro, vector de entrada,
+                                offset y tamaño de la tabla de simbolos
+        Regiones (REGION)       inicio, tamaño, offset de los datos,
+                                offset del mapa de inicializacion, flags
+        Datos                   contenido de cada region, tal cual
+        Mapas                   un bit por byte de cada region (mismo
+                                formato que Memory.init_map)
+        Simbolos                (valor, largo, nombre) por simbolo
+
+    load_image mapea el archivo con mmap (ACCESS_COPY: las escrituras del
+    simulador no modifican el archivo) y entrega a cada Memory
+    memoryviews sobre el mapeo, sin copiar el contenido.
+
+    Uso:
+        image.py hex2img archivo.hex archivo.img [-p micro]
+        image.py img2hex archivo.img archivo.hex [-r largo de registro]
+"""
+
+import sys
+import mmap
+import struct
+import argparse
+
+from memory import Memory, MemoryException
+from symbol_table import Symbol_table
+
+
+class ImageException(MemoryException): pass
+
+
+MAGIC   = b"MSP430IM"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHH16sHHII")  # magic, version, regiones, micro,
+                                        # entrada, (reservado), simbolos, largo
+REGION = struct.Struct("<IIIII")        # inicio, tamaño, datos, mapa, flags
+SYMBOL = struct.Struct("<HB")           # valor, largo del nombre
+
+READONLY = 0x0001
+
+
+def store_image(fname, part, regions, symtab = None):
+    """ Graba las memorias <regions> (lista de Memory) en <fname>. El
+        vector de entrada se toma de la palabra en 0xfffe.
+    """
+    entry = 0
+    for region in regions:
+        offs = 0xfffe - region.mem_start
+        if 0 <= offs < region.mem_size - 1:
+            entry = region.read_word(0xfffe)
+
+    symbols = b""
+    if symtab != None:
+        for name, value in sorted(symtab.symbols.items()):
+            if value != None:
+                encoded = name.encode("utf-8")[:255]
+                symbols += SYMBOL.pack(value & 0xffff, len(encoded)) + encoded
+
+    # Offsets de los datos y los mapas
+    offs = HEADER.size + REGION.size * len(regions)
+    table = []
+    for region in regions:
+        table.append([region.mem_start, region.mem_size, offs, 0,
+                      READONLY if region.readonly else 0])
+        offs += region.mem_size
+    for row in table:
+        row[3] = offs
+        offs += (row[1] + 7) >> 3
+
+    with open(fname, "wb") as outf:
+        outf.write(HEADER.pack(MAGIC, VERSION, len(regions),
+                               part.encode("ascii")[:16], entry, 0,
+                               offs, len(symbols)))
+        for row in table:
+            outf.write(REGION.pack(*row))
+        for region in regions:
+            outf.write(region.view[: region.mem_size])
+        for region in regions:
+            outf.write(region.init_map[: (region.mem_size + 7) >> 3])
+        outf.write(symbols)
+
+
+class Image():
+    """ Imagen abierta con mmap:
+            part        Nombre del micro
+            entry       Vector de entrada (contenido de 0xfffe)
+            regions     Lista de (inicio, tamaño, datos, mapa, flags), con
+                        datos y mapa como memoryviews sobre el archivo
+            symtab      Symbol_table (vacia si el archivo no tiene simbolos)
+    """
+    def __init__(self, fname):
+        with open(fname, "rb") as inf:
+            try:
+                self.mmap = mmap.mmap(inf.fileno(), 0, access = mmap.ACCESS_COPY)
+            except ValueError:
+                raise ImageException("Archivo de imagen vacio ({:s})".format(fname))
+        view = memoryview(self.mmap)
+
+        if len(view) < HEADER.size:
+            raise ImageException("Archivo de imagen incompleto ({:s})".format(fname))
+        (magic, version, nr_regions, part, self.entry, _,
+                 symtab_offs, symtab_size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ImageException("No es un archivo de imagen ({:s})".format(fname))
+        if version != VERSION:
+            raise ImageException("Version de imagen no soportada ({:d})".format(version))
+        self.part = part.rstrip(b"\0").decode("ascii")
+
+        self.regions = []
+        for nr in range(nr_regions):
+            start, size, data, init, flags = REGION.unpack_from(view, HEADER.size + nr * REGION.size)
+            init_size = (size + 7) >> 3
+            if data + size > len(view) or init + init_size > len(view):
+                raise ImageException("Region fuera del archivo (0x{:04x})".format(start))
+            self.regions.append((start, size,
+                                 view[data : data + size],
+                                 view[init : init + init_size],
+                                 flags))
+
+        self.symtab = Symbol_table()
+        offs, end = symtab_offs, symtab_offs + symtab_size
+        while offs < end:
+            value, length = SYMBOL.unpack_from(view, offs)
+            offs += SYMBOL.size
+            self.symtab.define(bytes(view[offs : offs + length]).decode("utf-8"), value)
+            offs += length
+
+
+    def map_into(self, memory):
+        """ Mapea en <memory> la region que empieza en memory.mem_start
+            (sin copiar). Retorna False si la imagen no tiene esa region.
+        """
+        for start, size, data, init, flags in self.regions:
+            if start == memory.mem_start and size == memory.mem_size:
+                memory.map_buffer(data, init)
+                return True
+        return False
+
+
+    def memories(self):
+        """ Crea una Memory por region, mapeada sobre el archivo """
+        result = []
+        for start, size, data, init, flags in self.regions:
+            m = Memory(size, mem_start = start, readonly = flags & READONLY != 0)
+            m.map_buffer(data, init)
+            result.append(m)
+        return result
+
+
+def load_image(fname):
+    return Image(fname)
+
+
+def hex_to_image(hexname, imgname, part = "MSP430iua", symtab = None):
+    """ Convierte un archivo Intel HEX (cargado en la ROM de <part>) en
+        una imagen
+    """
+    from cpu import CPU
+
+    cpu = CPU(part)
+    cpu.ROM.load_from_intel(hexname)
+    store_image(imgname, part, [cpu.RAM, cpu.ROM], symtab)
+
+
+def image_to_hex(imgname, hexname, record_len = 16):
+    """ Graba las regiones de solo lectura (la ROM) de una imagen en
+        formato Intel HEX
+    """
+    img = Image(imgname)
+    for memory in img.memories():
+        if memory.readonly:
+            memory.store_to_intel(hexname, record_len)
+
+
+def main():
+    argp = argparse.ArgumentParser(description = "Imagenes binarias del simulador MSP430")
+    sub = argp.add_subparsers(dest = "command")
+
+    h2i = sub.add_parser("hex2img", help = "Intel HEX a imagen")
+    h2i.add_argument("hexfile")
+    h2i.add_argument("imgfile")
+    h2i.add_argument("-p", "--part", default = "MSP430iua")
+
+    i2h = sub.add_parser("img2hex", help = "Imagen a Intel HEX")
+    i2h.add_argument("imgfile")
+    i2h.add_argument("hexfile")
+    i2h.add_argument("-r", "--record-len", type = int, default = 16)
+
+    args = argp.parse_args()
+    if args.command == "hex2img":
+        hex_to_image(args.hexfile, args.imgfile, args.part)
+    elif args.command == "img2hex":
+        image_to_hex(args.imgfile, args.hexfile, args.record_len)
+    else:
+        argp.print_help()
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,97 +1,73 @@
-# RRC INSTRUCTION
-
-def simulate_rrc_instruction(toplevel, regnr, opcode):
+# Las rutinas reciben el valor del operando (ya resuelto por
+# Simulator.src_operand) y devuelven el resultado. La escritura del
+# resultado (en registro o memoria) la hace el simulador.
+# Los flags se actualizan con una sola escritura del SR
+# (Registers.update_nzcv).
 
-    # Hacer la operación de desplazamiento
-    toplevel.regs.set(regnr, toplevel.regs.get(regnr) >> 1)
+from registers import Registers, FLAG_C
 
-    # Mover el bit 0 del registro al CY
-    toplevel.regs.set_SR(toplevel.regs.get(regnr, 0), 'C')
+# RRC INSTRUCTION
 
-    # Acordarse del estado del CY en ST
-    cy = toplevel.regs.get_SR('C')
+def simulate_rrc_instruction(toplevel, value, byte):
+    msb = 0x80 if byte else 0x8000
 
-    # y setear el bit mas significativo con la memoria
-    if toplevel.opc_Byte(opcode):
-        toplevel.regs.set(regnr, cy, 7)
-        toplevel.regs.clear_upper(regnr)                    # Cada operacion de byte borra bits 8-15
-    else:
-        toplevel.regs.set(regnr, cy, 15)
+    # Hacer la operación de desplazamiento, y setear el bit mas
+    # significativo con el CY anterior
+    cy = toplevel.registers[Registers.SR] & FLAG_C
+    result = (value >> 1) | (msb if cy else 0)
 
-    # Ajustar los otros bits del status
-    toplevel.regs.set_SR('V', False)                        # Siempre a 0
-    toplevel.regs.set_SR('Z', toplevel.regs.get(regnr) == 0)    # Según valor registro
-    toplevel.regs.set_SR('N', cy)                           # Mismo estado que Carry
+    # El bit 0 del operando pasa al CY, V siempre a 0
+    return toplevel.regs.update_nzcv(result, 8 if byte else 16, value & 1)
 
 # RRA INSTRUCTION
 
-def simulate_rra_instruction(toplevel, regnr, opcode):
-    # Mover el bit 0 del registro al CY
-    self.regs.set_SR(self.regs.get(regnr, 0), 'C')
-
-    # Acordarse del estado del CY en ST
-    cy = self.regs.get_SR('C')
-
-    if self.opc_Byte(opcode):
-        self.regs.clear_upper(regnr)                    # Cada operacion de byte
-                                                            # borra bits 8-15
+def simulate_rra_instruction(toplevel, value, byte):
+    msb = 0x80 if byte else 0x8000
 
-    self.regs.set(regnr, self.regs.get(regnr) // 2)
+    # Desplazamiento aritmetico: el bit mas significativo se mantiene
+    result = (value >> 1) | (value & msb)
 
-    # Ajustar los otros bits del status
-    self.regs.set_SR('V', False)                        # Siempre a 0
-    self.regs.set_SR('Z', self.regs.get(regnr) == 0)    # Según valor registro
-    self.regs.set_SR('N', cy)                           # Mismo estado que Carry
+    # El bit 0 del operando pasa al CY, V siempre a 0
+    return toplevel.regs.update_nzcv(result, 8 if byte else 16, value & 1)
 
 # PUSH INSTRUCTION
 
-def simulate_push_instruction(toplevel, regnr, opcode):
-    sp = self.regs.get(1) - 0x0002
-    self.regs.set(1, sp)
+def simulate_push_instruction(toplevel, value, byte):
+    regs = toplevel.registers
+    sp = (regs[Registers.SP] - 0x0002) & 0xffff
+    regs[Registers.SP] = sp
 
-    if self.opc_Byte(opcode):
-        self.regs.clear_upper(regnr)                    # Cada operacion de byte borra bits 8-15
-
-    self.mem.store_word_at(sp, self.regs.get(regnr))
+    if byte:
+        toplevel.mem.write_byte(sp, value)
+    else:
+        toplevel.mem.write_word(sp, value)
 
 # SWPB INSTRUCTION
 
-def simulate_swpb_instruction(toplevel, regnr):
-    lb = toplevel.regs.get(regnr) & 0x00ff
-    hb = toplevel.regs.get(regnr) >> 8
-    updated_reg = "0x{:02x}{:02x}".format(lb, hb) # nuevo valor del regnr, con los bytes intercambiados
-    toplevel.regs.set(regnr, int(updated_reg, 16) & 0xffff)
+def simulate_swpb_instruction(toplevel, value):
+    # nuevo valor, con los bytes intercambiados
+    return ((value & 0x00ff) << 8) | (value >> 8)
 
 # SXT INSTRUCTION
 
-def simulate_sxt_instruction(toplevel, regnr, is_register_mode = False):
-    sb_lb = toplevel.regs.get(regnr) & 0x0080 # extraigo el sign bit del low byte
-
-    if is_register_mode:
-        for pos in range(8,20,1):
-            toplevel.regs.set(regnr, sb_lb, pos) # Seteo cada posicion desde bit 8.. 19 con el bit que estaba en sb_lb
+def simulate_sxt_instruction(toplevel, value):
+    # Extender el bit de signo del byte bajo a los bits 8..15
+    if value & 0x0080:
+        result = value | 0xff00
     else:
-        for pos in range(8,16,1):
-            self.regs.set(regnr, sb_lb, pos) # Seteo cada posicion desde bit 8.. 15 con el bit que estaba en sb_lb
-
-    # Ajustar los otros bits del status
-    toplevel.regs.set_SR('Z', toplevel.regs.get(regnr) == 0)    # Según valor registro
-    toplevel.regs.set_SR('C', toplevel.regs.get(regnr) != 0)
-    toplevel.regs.set_SR('V', False)                        # Siempre a 0
-
-    # Acordarse del estado del CY en ST
-    cy = toplevel.regs.get_SR('C')
+        result = value & 0x00ff
 
-    toplevel.regs.set_SR('N', cy)                           # Mismo estado que Carry
+    # C = resultado distinto de 0, V siempre a 0
+    return toplevel.regs.update_nzcv(result, 16, result != 0)
 
 # CALL INSTRUCTION
 
-def simulate_call_instruction(toplevel, regnr):
-    tmp = toplevel.regs.get(regnr) # guardo en tmp el contenido de regnr
+def simulate_call_instruction(toplevel, value, ret_addr):
+    regs = toplevel.registers
+    sp = (regs[Registers.SP] - 0x0002) & 0xffff # Decremento el registro SP en 2
+    regs[Registers.SP] = sp # Seteo el nuevo valor de SP
 
-    sp = toplevel.regs.get(1) - 0x0002 # Decremento el registro SP en 2
-    toplevel.regs.set(1, sp) # Seteo el nuevo valor de SP
+    toplevel.mem.write_word(sp, ret_addr) # Guardo la direccion de retorno en el stack
 
-    toplevel.mem.store_word_at(sp, toplevel.regs.get(0) + 0x0002) # Seteo en la direccion que apunta el registro SP el valor de PC + 2
-    
-    toplevel.regs.set(0, tmp) # Seteo el PC con el valor de tmp, obtenido anteriormente
\ No newline at end of file
+    regs[Registers.PC] = value # Seteo el PC con la direccion de la rutina
+    return value
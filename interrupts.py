@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  interrupts.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Controlador de interrupciones.
+
+    Las interrupciones pendientes son un entero: el bit n corresponde al
+    vector 0xffe0 + 2*n. La prioridad es la del vector (mayor direccion,
+    mayor prioridad), de modo que la interrupcion a atender es
+    simplemente el bit mas alto.
+
+    Los dispositivos mantienen su linea con set(vector, activa) cada vez
+    que cambian sus banderas o habilitaciones. CPU.run solo prueba
+    'pending' (un entero) antes de cada instruccion o bloque: sin
+    interrupciones pendientes no se paga nada mas. Si hay alguna, se
+    atiende cuando GIE (SR bit 3) esta activo, o siempre si es no
+    enmascarable (NMI).
+
+    Al aceptar una interrupcion (6 ciclos):
+        - Se apilan el PC y el SR.
+        - Si la fuente es unica, se borra su bandera (ack registrado
+          con connect).
+        - Se borra el SR, salvo SCG0 (despierta al CPU de un modo de
+          bajo consumo).
+        - Se carga el PC con el vector.
+    RETI (Simulator.opd_reti) desapila el SR y el PC.
+
+    Los modos de bajo consumo (LPM0..LPM4) activan CPUOFF: el CPU no
+    ejecuta nada y CPU.run salta los ciclos hasta el proximo evento de
+    los perifericos (ver CPU.idle). La interrupcion que despierta al CPU
+    borra CPUOFF; al volver con RETI se recupera el SR apilado, de modo
+    que el CPU vuelve a dormir salvo que la rutina haya borrado los bits
+    de bajo consumo en la pila (bic #LPMx, 0(SP)).
+"""
+
+import sys
+
+from registers import Registers, GIE, SCG0
+from memory import MemoryException
+from timing import INTERRUPT_CYCLES
+
+VECTOR_BASE = 0xffe0
+NMI_VECTOR  = 0xfffc
+RESET_VECTOR = 0xfffe
+NON_MASKABLE = 1 << ((NMI_VECTOR - VECTOR_BASE) >> 1)
+
+
+def vector_bit(vector):
+    """ Bit de <vector> en Interrupt_controller.pending """
+    return 1 << ((vector - VECTOR_BASE) >> 1)
+
+
+class Interrupt_controller():
+    """ Interrupciones de un CPU:
+            pending     Bits de las interrupciones pedidas (ver vector_bit)
+            acks        Vector -> funcion que borra la bandera de la
+                        fuente al aceptar la interrupcion (fuentes unicas)
+            accepted    Cantidad de interrupciones atendidas
+    """
+    def __init__(self, cpu):
+        self.bus = cpu.bus
+        self.sim = cpu.sim
+        self.regs = cpu.reg.get_registers()
+        self.acks = {}
+        self.clear()
+
+
+    def clear(self):
+        """ Sin interrupciones pendientes (PUC) """
+        self.pending = 0
+        self.accepted = 0
+
+
+    def connect(self, vector, ack):
+        """ Al aceptar <vector> se llamara a <ack>() """
+        self.acks[vector] = ack
+
+
+    def set(self, vector, active):
+        """ Activa o desactiva el pedido de <vector> """
+        if active:
+            self.pending |= vector_bit(vector)
+        else:
+            self.pending &= ~vector_bit(vector)
+
+
+    def highest(self):
+        """ Vector pendiente de mayor prioridad que se puede atender
+            ahora (segun GIE), o None
+        """
+        pending = self.pending
+        if not self.regs[Registers.SR] & GIE:
+            pending &= NON_MASKABLE
+        if not pending:
+            return None
+        return VECTOR_BASE + 2 * (pending.bit_length() - 1)
+
+
+    def enter(self, vector):
+        """ Acepta la interrupcion <vector>: apila PC y SR y salta a la
+            rutina. Lanza MemoryException si el vector no esta
+            inicializado.
+        """
+        bus, regs = self.bus, self.regs
+        isr = bus.load_word_at(vector)
+        if isr == None:
+            raise MemoryException("Vector de interrupcion 0x{:04x} no inicializado".format(vector))
+
+        ack = self.acks.get(vector)
+        if ack != None:
+            ack()
+
+        sp = (regs[Registers.SP] - 2) & 0xffff
+        bus.write_word(sp, regs[Registers.PC])
+        sp = (sp - 2) & 0xffff
+        bus.write_word(sp, regs[Registers.SR])
+        regs[Registers.SP] = sp
+        regs[Registers.SR] &= SCG0
+        regs[Registers.PC] = isr
+
+        self.sim.cycles += INTERRUPT_CYCLES
+        self.accepted += 1
+
+
+    def snapshot(self):
+        """ Estado del controlador (ver CPU.snapshot) """
+        return self.pending, self.accepted
+
+
+    def restore(self, state):
+        self.pending, self.accepted = state
+
+
+    def __str__(self):
+        return "pendientes: " + (", ".join(
+                    "0x{:04x}".format(VECTOR_BASE + 2 * n)
+                            for n in range(16) if self.pending & (1 << n)) or "-")
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0xd232,                     # eint
+                0x3fff,                     # jmp   $
+                0x531f,                     # isr:  inc   R15
+                0x1300])                    # reti
+    c.ROM.store_word_at(0xffe4, 0xc208)     # Vector de P1
+    c.reset()
+
+    print(c.run(10))
+    c.interrupts.set(0xffe4, True)
+    print(c.interrupts)
+    print(c.run(3), hex(c.reg.get_PC()), c.reg.get(15))
+    c.interrupts.set(0xffe4, False)
+    print(c.run(3), hex(c.reg.get_PC()), c.reg.get(15))
+
+    # Despertar una vez por segundo (Timer_A con ACLK) desde LPM3
+    from devices import standard_devices
+    for dev in standard_devices():
+        c.add_peripheral(dev)
+    c.ROM.store_words_at(0xc300, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0x40b2, 0x5a80, 0x0120,     # mov   #WDTPW+WDTHOLD, &WDTCTL
+                0x40b2, 0x7fff, 0x0172,     # mov   #32767, &TACCR0
+                0x40b2, 0x0010, 0x0162,     # mov   #CCIE, &TACCTL0
+                0x40b2, 0x0110, 0x0160,     # mov   #TASSEL_1+MC_1, &TACTL
+                0xd032, 0x00d8,             # bis   #LPM3+GIE, SR
+                0x3fff,                     # jmp   $
+                0x531f,                     # isr:  inc   R15
+                0x1300])                    # reti
+    c.ROM.store_word_at(0xfffe, 0xc300)
+    c.ROM.store_word_at(0xfff2, 0xc322)
+    c.reset()
+    c.reg.set(15, 0)
+    print(c.run(None, lambda cpu: cpu.reg.get(15) == 10),
+          "{:.3f} s simulados".format(c.simulated_time()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
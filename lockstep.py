@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  lockstep.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Simulacion en paralelo de N copias del mismo programa ("carriles"),
+    con NumPy.
+
+    Los registros de todos los carriles estan en un array (N, 16) de
+    uint16 (mismo orden que Registers) y la memoria en un array
+    (N, 65536) de uint8. En cada paso se agrupan los carriles activos
+    por (PC, opcode): cada grupo ejecuta la instruccion una sola vez, con
+    operaciones de NumPy sobre los indices de sus carriles. Mientras los
+    carriles no diverjan hay un unico grupo; despues de un salto que
+    algunos toman y otros no, cada camino es un grupo (ejecucion
+    enmascarada).
+
+    La semantica es la de Simulator y alu.py, con estas diferencias:
+        - La memoria es plana: no hay control de memoria no inicializada,
+          y las paginas vacantes se leen como 0x3fff pero se pueden
+          escribir.
+        - RETI saca SR y PC de la pila.
+        - Un carril se detiene al llegar a 'jmp $' (0x3fff), o a la
+          direccion <until> de run().
+
+    Requiere NumPy.
+"""
+
+import numpy as np
+
+from registers import Registers
+from timing import CYCLE_TABLE
+from alu import FLAG_C, FLAG_Z, FLAG_N, FLAG_V, NOT_FLAGS, DADD_TABLE
+from decode import (DECODE_TABLE, F_GROUP, F_OPTYPE, F_AS, F_AD, F_BYTE, F_RS, F_RD, F_OFFSET,
+                    SINGLE1, SINGLE2, RETI, JUMP, DOUBLE,
+                    JNZ, JZ, JNC, JC, JGE, JN, JL, JMP,
+                    MOV, ADD, ADDC, SUBC, SUB, CMP, DADD, BIT, BIC, BIS, XOR, AND,
+                    RRC, SWPB, RRA, SXT, PUSH, CALL)
+
+JMP_SELF = 0x3fff               # jmp $
+
+DADD_ARRAY = np.frombuffer(DADD_TABLE, dtype = np.uint8).astype(np.int64)
+CYCLE_ARRAY = np.frombuffer(CYCLE_TABLE, dtype = np.uint8)
+
+
+def nz_flags(res, msb):
+    """ Flags N y Z de <res> (escalar o array) """
+    return ((res & msb) != 0) * FLAG_N | (res == 0) * FLAG_Z
+
+
+class Lockstep_simulator():
+    """ N carriles que arrancan con el estado de <cpu> (memoria del bus
+        y registros):
+            regs            Registros, array (N, 16) uint16
+            mem             Memoria, array (N, 65536) uint8
+            halted          Carriles detenidos, array (N,) bool
+            cycles          Ciclos de cada carril
+            instructions    Instrucciones de cada carril
+    """
+    def __init__(self, cpu, n):
+        self.n = n
+
+        image = np.empty(0x10000, dtype = np.uint8)
+        image[0::2] = 0xff                          # Vacante: 0x3fff
+        image[1::2] = 0x3f
+        for region in cpu.bus.regions:
+            if hasattr(region, "view"):
+                image[region.mem_start : region.mem_start + region.mem_size] = \
+                            np.frombuffer(region.view, dtype = np.uint8)[: region.mem_size]
+        self.mem = np.tile(image, (n, 1))
+
+        self.regs = np.tile(np.array(cpu.reg.get_registers(), dtype = np.uint16), (n, 1))
+        self.halted = np.zeros(n, dtype = bool)
+        self.cycles = np.zeros(n, dtype = np.int64)
+        self.instructions = np.zeros(n, dtype = np.int64)
+
+        self.handlers = (self.single_type1,         # SINGLE1
+                         self.single_type2,         # SINGLE2
+                         self.reti,                 # RETI
+                         self.jump,                 # JUMP
+                         self.double,               # DOUBLE
+                         self.nop)                  # NOP
+
+    #
+    #   Acceso a memoria y registros (<idx>: indices de los carriles)
+    #
+
+    def reg(self, idx, reg):
+        return self.regs[idx, reg].astype(np.int64)
+
+    def read_word(self, idx, ea):
+        ea = ea & 0xfffe
+        return self.mem[idx, ea].astype(np.int64) | (self.mem[idx, ea + 1].astype(np.int64) << 8)
+
+    def read_byte(self, idx, ea):
+        return self.mem[idx, ea].astype(np.int64)
+
+    def write_word(self, idx, ea, value):
+        ea = ea & 0xfffe
+        self.mem[idx, ea] = value & 0xff
+        self.mem[idx, ea + 1] = (value >> 8) & 0xff
+
+    def write_byte(self, idx, ea, value):
+        self.mem[idx, ea] = value & 0xff
+
+
+    def set_register(self, reg, values):
+        """ Carga <values> (un valor por carril, o uno para todos) en <reg> """
+        self.regs[:, reg] = np.asarray(values, dtype = np.int64) & 0xffff
+
+
+    def store_words(self, addr, values):
+        """ Escribe en <addr> una palabra por carril (o una para todos) """
+        self.write_word(np.arange(self.n), addr, np.asarray(values, dtype = np.int64))
+
+    #
+    #   Operandos
+    #
+
+    def src_operand(self, idx, As, reg, byte, addr):
+        """ Igual que Simulator.src_operand, para los carriles <idx>. El
+            valor y la direccion efectiva son arrays (o escalares si son
+            iguales en todos los carriles).
+        """
+        if As == 0:
+            if reg == 3:
+                return 0, None, addr
+            value = addr if reg == 0 else self.reg(idx, reg)
+            return (value & 0xff if byte else value), None, addr
+
+        elif As == 1:
+            if reg == 3:
+                return 1, None, addr
+            x = self.read_word(idx, addr)
+            if reg == 2:                                # &X absoluto
+                ea = x
+            elif reg == 0:                              # X(PC) simbolico
+                ea = (addr + x) & 0xffff
+            else:
+                ea = (self.reg(idx, reg) + x) & 0xffff
+            addr += 2
+
+        elif As == 2:
+            if reg == 2:
+                return 4, None, addr
+            if reg == 3:
+                return 2, None, addr
+            ea = addr if reg == 0 else self.reg(idx, reg)
+
+        else:
+            if reg == 2:
+                return 8, None, addr
+            if reg == 3:
+                return (0xff if byte else 0xffff), None, addr
+            if reg == 0:                                # #N inmediato
+                value = self.read_word(idx, addr)
+                return (value & 0xff if byte else value), None, addr + 2
+            ea = self.reg(idx, reg)
+            self.regs[idx, reg] = (ea + (1 if byte and reg != 1 else 2)) & 0xffff
+
+        if byte:
+            return self.read_byte(idx, ea), ea, addr
+        return self.read_word(idx, ea), ea, addr
+
+
+    def dst_operand(self, idx, Ad, reg, byte, addr):
+        if Ad == 0:
+            value = addr if reg == 0 else self.reg(idx, reg)
+            return (value & 0xff if byte else value), None, addr
+
+        x = self.read_word(idx, addr)
+        if reg == 2 or reg == 3:
+            ea = x
+        elif reg == 0:
+            ea = (addr + x) & 0xffff
+        else:
+            ea = (self.reg(idx, reg) + x) & 0xffff
+
+        if byte:
+            return self.read_byte(idx, ea), ea, addr + 2
+        return self.read_word(idx, ea), ea, addr + 2
+
+
+    def write_result(self, idx, reg, ea, value, byte, addr):
+        """ Como Simulator.write_result. Retorna el PC nuevo """
+        if ea is not None:
+            if byte:
+                self.write_byte(idx, ea, value)
+            else:
+                self.write_word(idx, ea, value)
+            return addr
+
+        value = value & (0xff if byte else 0xffff)
+        if reg == 0:
+            return value
+        if reg != 3:
+            self.regs[idx, reg] = value
+        return addr
+
+    #
+    #   ALU (mismos resultados que alu.py, sobre arrays)
+    #
+
+    def alu(self, optype, src, dst, sr, byte):
+        mask, msb = (0xff, 0x80) if byte else (0xffff, 0x8000)
+
+        if optype == MOV:
+            return src, sr
+        if optype == BIC:
+            return dst & ~src & mask, sr
+        if optype == BIS:
+            return dst | src, sr
+
+        if optype in (ADD, ADDC, SUBC, SUB, CMP):
+            if optype in (SUB, CMP, SUBC):
+                src = ~src & mask
+            if optype in (ADD,):
+                cy = 0
+            elif optype in (SUB, CMP):
+                cy = 1
+            else:
+                cy = sr & FLAG_C
+            r = src + dst + cy
+            res = r & mask
+            flags = (nz_flags(res, msb) | (r > mask) * FLAG_C |
+                     (((~(src ^ dst) & (src ^ res)) & msb) != 0) * FLAG_V)
+            return res, (sr & NOT_FLAGS) | flags
+
+        if optype == DADD:
+            cy = sr & FLAG_C
+            res = 0
+            for shift in (0, 4) if byte else (0, 4, 8, 12):
+                d = DADD_ARRAY[(((src >> shift) & 0x0f) << 5) |
+                               (((dst >> shift) & 0x0f) << 1) | cy]
+                res = res | ((d & 0x0f) << shift)
+                cy = d >> 4
+            return res, (sr & NOT_FLAGS) | nz_flags(res, msb) | (cy != 0) * FLAG_C
+
+        res = src & dst if optype in (BIT, AND) else src ^ dst
+        flags = nz_flags(res, msb) | (res != 0) * FLAG_C
+        if optype == XOR:
+            flags = flags | ((src & dst & msb) != 0) * FLAG_V
+        return res, (sr & NOT_FLAGS) | flags
+
+    #
+    #   Instrucciones
+    #
+
+    def double(self, idx, addr, dec):
+        optype, byte, rd = dec[F_OPTYPE], dec[F_BYTE], dec[F_RD]
+
+        src, _, addr = self.src_operand(idx, dec[F_AS], dec[F_RS], byte, addr)
+        dst, ea, addr = self.dst_operand(idx, dec[F_AD], rd, byte, addr)
+
+        result, sr = self.alu(optype, src, dst, self.reg(idx, Registers.SR), byte)
+        self.regs[idx, Registers.SR] = sr
+
+        if optype in (CMP, BIT):
+            return addr
+        return self.write_result(idx, rd, ea, result, byte, addr)
+
+
+    def single_type1(self, idx, addr, dec):
+        """ RRC, RRA, PUSH """
+        optype, As, byte, reg = dec[F_OPTYPE], dec[F_AS], dec[F_BYTE], dec[F_RD]
+        msb = 0x80 if byte else 0x8000
+
+        value, ea, addr = self.src_operand(idx, As, reg, byte, addr)
+
+        if optype == PUSH:
+            sp = (self.reg(idx, Registers.SP) - 2) & 0xffff
+            self.regs[idx, Registers.SP] = sp
+            if byte:
+                self.write_byte(idx, sp, value)
+            else:
+                self.write_word(idx, sp, value)
+            return addr
+
+        sr = self.reg(idx, Registers.SR)
+        if optype == RRC:
+            result = (value >> 1) | (sr & FLAG_C) * msb
+        else:
+            result = (value >> 1) | (value & msb)
+        self.regs[idx, Registers.SR] = ((sr & NOT_FLAGS) | (value & 1) * FLAG_C |
+                                        nz_flags(result, msb))
+
+        if As != 0 and ea is None:
+            return addr
+        return self.write_result(idx, reg, ea, result, byte, addr)
+
+
+    def single_type2(self, idx, addr, dec):
+        """ SWPB, SXT, CALL """
+        optype, As, reg = dec[F_OPTYPE], dec[F_AS], dec[F_RD]
+
+        value, ea, addr = self.src_operand(idx, As, reg, False, addr)
+
+        if optype == CALL:
+            sp = (self.reg(idx, Registers.SP) - 2) & 0xffff
+            self.regs[idx, Registers.SP] = sp
+            self.write_word(idx, sp, addr)
+            return value
+
+        if optype == SWPB:
+            result = ((value & 0x00ff) << 8) | (value >> 8)
+        else:
+            result = np.where(value & 0x80, value | 0xff00, value & 0x00ff)
+            sr = self.reg(idx, Registers.SR)
+            self.regs[idx, Registers.SR] = ((sr & NOT_FLAGS) | nz_flags(result, 0x8000) |
+                                            (result != 0) * FLAG_C)
+
+        if As != 0 and ea is None:
+            return addr
+        return self.write_result(idx, reg, ea, result, False, addr)
+
+
+    def reti(self, idx, addr, dec):
+        sp = self.reg(idx, Registers.SP)
+        self.regs[idx, Registers.SR] = self.read_word(idx, sp)
+        pc = self.read_word(idx, (sp + 2) & 0xffff)
+        self.regs[idx, Registers.SP] = (sp + 4) & 0xffff
+        return pc
+
+
+    def jump(self, idx, addr, dec):
+        optype = dec[F_OPTYPE]
+        target = (addr + 2*dec[F_OFFSET]) & 0xffff
+        if optype == JMP:
+            return target
+
+        sr = self.reg(idx, Registers.SR)
+        if optype == JNZ:
+            cond = (sr & FLAG_Z) == 0
+        elif optype == JZ:
+            cond = (sr & FLAG_Z) != 0
+        elif optype == JNC:
+            cond = (sr & FLAG_C) == 0
+        elif optype == JC:
+            cond = (sr & FLAG_C) != 0
+        elif optype == JN:
+            cond = (sr & FLAG_N) != 0
+        elif optype == JGE:
+            cond = ((sr >> 2) ^ (sr >> 8)) & 1 == 0
+        else:
+            cond = ((sr >> 2) ^ (sr >> 8)) & 1 != 0
+        return np.where(cond, target, addr)
+
+
+    def nop(self, idx, addr, dec):
+        return addr
+
+    #
+    #   Ejecucion
+    #
+
+    def execute(self, idx, pc, opcode):
+        """ Ejecuta <opcode> (ubicado en <pc>) en los carriles <idx>.
+            Retorna el PC nuevo (escalar o array).
+        """
+        if opcode == JMP_SELF:
+            self.halted[idx] = True
+            return pc
+
+        self.cycles[idx] += CYCLE_ARRAY[opcode]
+        self.instructions[idx] += 1
+
+        dec = DECODE_TABLE[opcode]
+        return self.handlers[dec[F_GROUP]](idx, pc + 2, dec)
+
+
+    def step(self, until = None):
+        """ Ejecuta una instruccion en cada carril activo. Retorna False
+            si ya no quedan carriles activos.
+        """
+        active = np.flatnonzero(~self.halted)
+        if len(active) == 0:
+            return False
+
+        pcs = self.reg(active, Registers.PC)
+        keys = (pcs << 16) | self.read_word(active, pcs)
+        groups = np.unique(keys)
+        if len(groups) == 1:
+            self.regs[active, Registers.PC] = self.execute(active, int(pcs[0]), int(keys[0]) & 0xffff)
+        else:
+            for key in groups:
+                idx = active[keys == key]
+                key = int(key)
+                self.regs[idx, Registers.PC] = self.execute(idx, key >> 16, key & 0xffff)
+
+        if until != None:
+            self.halted |= self.regs[:, Registers.PC] == until
+        return True
+
+
+    def run(self, max_steps = None, until = None):
+        """ Ejecuta hasta que todos los carriles se detengan, o hasta
+            <max_steps> pasos. Retorna la cantidad de pasos.
+        """
+        steps = 0
+        while max_steps == None or steps < max_steps:
+            if not self.step(until):
+                break
+            steps += 1
+        return steps
+
+
+
+def main():
+    import time
+    from cpu import CPU
+
+    # Suma de R15 .. 1 en R14, con una subrutina
+    cpu = CPU()
+    cpu.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0x421f, 0x0200,             # mov   &0x0200, R15
+                0x12b0, 0xc214,             # call  #suma
+                0x831f,                     # dec   R15
+                0x23fc,                     # jnz   $-6
+                0x3fff,                     # jmp   $
+                0x4303,                     # nop
+                0x5f0e,                     # suma: add R15, R14
+                0x4130])                    # ret
+    cpu.RAM.store_word_at(0x0200, 1)
+    cpu.reset()
+
+    n = 1000
+    lanes = Lockstep_simulator(cpu, n)
+    lanes.store_words(0x0200, np.arange(1, n + 1))
+
+    t = time.perf_counter()
+    steps = lanes.run()
+    elapsed = time.perf_counter() - t
+
+    print("{:d} carriles, {:d} pasos, {:d} instrucciones en {:.3f} s".format(
+                n, steps, int(lanes.instructions.sum()), elapsed))
+    for lane in (0, 9, n - 1):
+        print("Carril {:4d}: R14 = 0x{:04x}, {:d} ciclos".format(
+                    lane, int(lanes.regs[lane, 14]), int(lanes.cycles[lane])))
+    return 0
+
+if __name__ == '__main__':
+    main()
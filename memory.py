@@ -24,21 +24,40 @@
 
 import sys
 import pdb
+import struct
 
 class MemoryException(Exception): pass
+class IntelHexException(MemoryException): pass
+
+
+WORD = struct.Struct("<H")          # Palabra de 16 bits, little endian
+MAX_WATCHERS = 8                    # Un bit por observador en Memory.watched
 
 
 class Memory():
     def __init__(self, mem_size,            # Tamaño de la memoria (en bytes)
                        mem_start = 0,       # Inicio de la memoria (en bytes)
-                       readonly = False):   # Si la memoria puede ser modificado por código
+                       readonly = False,    # Si la memoria puede ser modificado por código
+                       track_init = True):  # Controlar lecturas de memoria no inicializada
 
         self.mem_size    = mem_size
         self.mem_start   = mem_start
         self.readonly    = readonly
+        self.track_init  = track_init
 
         self.instruction_words = []
 
+        # Observadores de escritura (ver add_watcher): un bit por
+        # observador en cada pagina de 256 bytes vigilada
+        self.watchers = []
+        self.watched = bytearray((mem_size + 0xff) >> 8)
+
+        # Instantaneas (ver snapshot): paginas de la ultima instantanea y
+        # paginas escritas desde entonces
+        self.snap_bit = 0
+        self.snap_pages = None
+        self.dirty = set()
+
         self.initialize()
 
     def __str__(self):
@@ -70,9 +89,174 @@ class Memory():
         return s
 
 
-    # Inicializa la memoria seteando todas las posiciones de memoria en None
+    # Inicializa la memoria: todos los bytes en 0 y marcados como no
+    # inicializados. El contenido se guarda en un bytearray (self.mem) y
+    # cada byte tiene un bit en self.init_map que indica si fue escrito.
+    # Con track_init = False se consideran todos los bytes inicializados.
     def initialize(self):
-        self.mem = [None] * self.mem_size
+        self.mem = bytearray(self.mem_size)
+        self.view = memoryview(self.mem)
+        fill = 0x00 if self.track_init else 0xff
+        self.init_map = bytearray([fill]) * ((self.mem_size + 7) >> 3)
+        self.notify_all()
+
+
+    # Usa <data> y <init_map> como contenido y mapa de inicializacion, sin
+    # copiarlos: pueden ser memoryviews sobre un archivo mapeado con mmap
+    # (ver image.py). Deben ser modificables y del tamaño de la memoria.
+    def map_buffer(self, data, init_map):
+        if len(data) != self.mem_size or len(init_map) != (self.mem_size + 7) >> 3:
+            raise MemoryException("Tamaño de buffer incorrecto ({:d} bytes)".format(len(data)))
+
+        self.mem = data
+        self.view = memoryview(data)
+        self.init_map = init_map
+        self.instruction_words = []
+        self.notify_all()
+
+
+    # Todo el contenido cambio: avisar a quienes vigilan alguna pagina
+    def notify_all(self):
+        flags = 0
+        for w in self.watched:
+            flags |= w
+        if flags:
+            self.notify(flags, self.mem_start, self.mem_size)
+
+
+    # Registra <callback>(addr, size), que será llamado cada vez que se
+    # escriba en una página marcada con watch(). En las escrituras del
+    # simulador (write_*/store_*) se llama antes de escribir, de modo que
+    # el observador puede leer el contenido anterior. Retorna el bit
+    # asignado al observador (se reusan los liberados con
+    # remove_watcher). Hay lugar para MAX_WATCHERS observadores.
+    def add_watcher(self, callback):
+        for nr, watcher in enumerate(self.watchers):
+            if watcher == None:
+                self.watchers[nr] = callback
+                return 1 << nr
+        if len(self.watchers) >= MAX_WATCHERS:
+            raise MemoryException("Demasiados observadores de memoria (maximo {:d})".format(MAX_WATCHERS))
+        self.watchers.append(callback)
+        return 1 << (len(self.watchers) - 1)
+
+    # Libera el <bit> de un observador: se desmarcan sus paginas y el bit
+    # queda para otro add_watcher
+    def remove_watcher(self, bit):
+        self.watch(self.mem_start, self.mem_size, bit, False)
+        self.watchers[bit.bit_length() - 1] = None
+
+    # Marca (o desmarca) las paginas que cubren <addr>..<addr + size> para
+    # el observador <bit>
+    def watch(self, addr, size, bit, enable = True):
+        first = (addr - self.mem_start) >> 8
+        last = (addr - self.mem_start + size - 1) >> 8
+        for page in range(max(first, 0), min(last + 1, len(self.watched))):
+            if enable:
+                self.watched[page] |= bit
+            else:
+                self.watched[page] &= ~bit
+
+    # Avisa a los observadores indicados en <flags> de una escritura
+    def notify(self, flags, addr, size):
+        for nr, callback in enumerate(self.watchers):
+            if flags & (1 << nr):
+                callback(addr, size)
+
+
+    # Retorna True si el byte en el desplazamiento <offs> fue inicializado
+    def is_initialized(self, offs):
+        return (self.init_map[offs >> 3] >> (offs & 7)) & 1 != 0
+
+
+    # Marca como inicializados los bytes desde <offs> hasta <offs + n>
+    def mark_initialized(self, offs, n = 1):
+        end = offs + n
+        # Bits sueltos hasta llegar a un byte completo del mapa
+        while offs < end and offs & 7:
+            self.init_map[offs >> 3] |= 1 << (offs & 7)
+            offs += 1
+        # Bytes completos del mapa
+        full = (end - offs) >> 3
+        if full > 0:
+            self.init_map[offs >> 3 : (offs >> 3) + full] = b"\xff" * full
+            offs += full << 3
+        # Bits restantes
+        while offs < end:
+            self.init_map[offs >> 3] |= 1 << (offs & 7)
+            offs += 1
+
+
+    # Retorna una instantanea del contenido: una tupla con una entrada
+    # (bytes inmutables) por pagina de 256 bytes, con los datos seguidos
+    # de los 32 bytes del mapa de inicializacion de la pagina.
+    # Es copy-on-write: solo se copian las paginas escritas desde la
+    # instantanea anterior; las demas son los mismos objetos que en ella.
+    # Las paginas se vigilan (add_watcher) para enterarse de la primera
+    # escritura; luego se dejan de vigilar, sin costo en los accesos.
+    def snapshot(self):
+        nr_pages = len(self.watched)
+        if self.snap_bit == 0:
+            self.snap_bit = self.add_watcher(self.page_written)
+        if self.snap_pages == None:
+            self.snap_pages = [None] * nr_pages
+            self.dirty = set(range(nr_pages))
+
+        for page in self.dirty:
+            self.snap_pages[page] = self.page_bytes(page)
+        self.dirty.clear()
+        self.watch(self.mem_start, self.mem_size, self.snap_bit)
+
+        return (tuple(self.snap_pages), tuple(self.instruction_words))
+
+    # Vuelve al contenido de la instantanea <snap>. Solo se copian las
+    # paginas que difieren del contenido actual.
+    def restore(self, snap):
+        pages, instruction_words = snap
+        assert len(pages) == len(self.watched)
+
+        for page, data in enumerate(pages):
+            if data is self.snap_pages[page] and page not in self.dirty:
+                continue
+            start = page << 8
+            end = min(start + 0x100, self.mem_size)
+            size = end - start
+            self.mem[start:end] = data[:size]
+            self.init_map[start >> 3 : (end + 7) >> 3] = data[size:]
+
+            # Avisar a los demas observadores (el de instantaneas no)
+            flags = self.watched[page] & ~self.snap_bit
+            if flags:
+                self.notify(flags, self.mem_start + start, size)
+
+        self.snap_pages = list(pages)
+        self.dirty.clear()
+        self.watch(self.mem_start, self.mem_size, self.snap_bit)
+        self.instruction_words = list(instruction_words)
+
+    # Contenido de la pagina <page>, con su parte del mapa de inicializacion
+    def page_bytes(self, page):
+        start = page << 8
+        end = min(start + 0x100, self.mem_size)
+        return bytes(self.view[start:end]) + bytes(self.init_map[start >> 3 : (end + 7) >> 3])
+
+    # Observador de instantaneas: marca las paginas escritas y las deja
+    # de vigilar hasta la proxima instantanea
+    def page_written(self, addr, size):
+        first = (addr - self.mem_start) >> 8
+        last = (addr - self.mem_start + size - 1) >> 8
+        self.dirty.update(range(first, last + 1))
+        self.watch(addr, size, self.snap_bit, False)
+
+
+    # Retorna una copia independiente de esta memoria (contenido y mapa
+    # de inicializacion)
+    def copy(self):
+        m = Memory(self.mem_size, self.mem_start, self.readonly, self.track_init)
+        m.mem[:] = self.mem
+        m.init_map[:] = self.init_map
+        m.instruction_words = list(self.instruction_words)
+        return m
 
 
     # Determina si el desplazamiento en la memoria <offs> esta dentro del rango de la memoria
@@ -87,13 +271,19 @@ class Memory():
     def load_mem_word_at(self, offs):
         """ <offs> es el offset en self.mem! NO la dirección en la memoria
         """
-        if not self.in_mem_range(offs) or not self.in_mem_range(offs+1):
+        if offs < 0 or offs + 1 >= self.mem_size:
             raise MemoryException("Dirección fuera de rango (Offset: 0x{:04x})".format(offs))
-        
-        if self.mem[offs] == None or self.mem[offs+1] == None:
+
+        if offs & 1 == 0:
+            # Offset par: los dos bits estan en el mismo byte del mapa
+            initialized = (self.init_map[offs >> 3] >> (offs & 7)) & 3 == 3
+        else:
+            initialized = self.is_initialized(offs) and self.is_initialized(offs + 1)
+
+        if not initialized:
             raise MemoryException("Lectura de memoria no inicializada (Offset: 0x{:04x})".format(offs))
 
-        return (self.mem[offs] + (self.mem[offs + 1] << 8))
+        return WORD.unpack_from(self.mem, offs)[0]
 
     # Guarda el contenido de la palabra <word> en la posicion <offs> y <offs +1>
     # Controla que esas posiciones no esten fuera de rango 
@@ -102,12 +292,44 @@ class Memory():
     def store_mem_word_at(self, offs, word):
         """ <offs> es el offset en self.mem! NO la dirección en la memoria
         """
-        if not self.in_mem_range(offs) or not self.in_mem_range(offs+1):
+        if offs < 0 or offs + 1 >= self.mem_size:
             raise MemoryException("Dirección fuera de rango (Offset: 0x{:04x})".format(offs))
 
-        self.mem[offs] = word & 0xff
-        self.mem[offs + 1] = word >> 8
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], self.mem_start + offs, 2)
+
+        WORD.pack_into(self.mem, offs, word & 0xffff)
+
+        if offs & 1 == 0:
+            self.init_map[offs >> 3] |= 3 << (offs & 7)
+        else:
+            self.mark_initialized(offs, 2)
+
+
 
+    # Acceso rapido para el simulador: read_word/read_byte no controlan si
+    # la memoria fue inicializada (devuelven 0) y nunca lanzan excepciones.
+    # <addr> es la direccion absoluta y debe estar dentro de la memoria
+    # (el bus se encarga de eso). Las palabras se alinean a direccion par.
+    def read_word(self, addr):
+        return WORD.unpack_from(self.mem, (addr - self.mem_start) & ~1)[0]
+
+    def read_byte(self, addr):
+        return self.mem[addr - self.mem_start]
+
+    def write_word(self, addr, value):
+        offs = (addr - self.mem_start) & ~1
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], self.mem_start + offs, 2)
+        WORD.pack_into(self.mem, offs, value & 0xffff)
+        self.init_map[offs >> 3] |= 3 << (offs & 7)
+
+    def write_byte(self, addr, value):
+        offs = addr - self.mem_start
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], addr, 1)
+        self.mem[offs] = value & 0xff
+        self.init_map[offs >> 3] |= 1 << (offs & 7)
 
 
     def load_from_intel(self, fname):
@@ -117,243 +339,221 @@ class Memory():
                                  ++----Suma de control
                              ++++------Datos
                            ++----------Tipo de linea: 00: datos,
-                                                      01: fin de archivo
+                                                      01: fin de archivo,
+                                                      02: direccion de segmento extendida,
+                                                      04: direccion lineal extendida,
                                                       Otros: ignorar
                        ++++------------Direccion de destino
                      ++----------------Numero de bytes de datos
                     +------------------':' es el inicio del registro
+
+            Cada registro se decodifica con bytes.fromhex, se verifica su
+            suma de control y se copia a la memoria de una sola vez. Los
+            datos fuera del rango de esta memoria se ignoran.
+            Lanza IntelHexException (con el numero de linea) si el archivo
+            tiene errores.
         """
         self.initialize()
 
         # Limpiar la lista de instrucciones
         self.instruction_words.clear()
 
+        base = 0                                # Registros 02 y 04
+        end = self.mem_start + self.mem_size
+
         with open(fname, "r") as inf:
-            for line in inf:
-                line = line.rstrip('\n')
-                if line[0] != ":": continue
-                if len(line) < 11:
-                    print("Linea invalida en archivo hex [%s]" % line)
-                    sys.exit(1)
+            for linenr, line in enumerate(inf, 1):
+                line = line.strip()
+                if line[:1] != ":": continue
+
+                try:
+                    record = bytes.fromhex(line[1:])
+                except ValueError:
+                    raise IntelHexException("Linea {:d}: caracteres invalidos [{:s}]".format(linenr, line))
 
-                nrb = int(line[1:3], 16)         # Extrae nro de bytes
-                adr = int(line[3:7], 16)         # Extrae direccion
-                typ = int(line[7:9], 16)         # Extrae tipo de linea
+                if len(record) < 5 or len(record) != record[0] + 5:
+                    raise IntelHexException("Linea {:d}: largo invalido [{:s}]".format(linenr, line))
+                if sum(record) & 0xff != 0:
+                    raise IntelHexException("Linea {:d}: error de suma de control [{:s}]".format(linenr, line))
+
+                typ = record[3]
+                data = record[4:-1]
 
                 if typ == 0:
-                    byte_nr = 0
-
-                    for byte_nr in range(nrb):
-                        s = line[9 + byte_nr*2 : 11 + byte_nr*2]
-                        value = int(s, 16)
-                        self.store_byte_at(adr, value)
-                        adr += 1
-                        s = ""
-                        byte_nr += 1                            
-
-                    addr = int(line[3:7], 16)
-
-                    for i in range(0, int(nrb/2)):
-                        if hex(addr) != "0xfffe":
-                            try:
-                                if self.load_word_at(addr+2) < int("0x1000", 16) or self.load_word_at(addr+2) > int("0x12B0", 16):
-                                    nrb -= 2
-                                    # print(nrb)
-                                addr += 2
-                            except MemoryException:
-                                addr += 2
-
-                    addr = int(line[3:7], 16)
-
-                    # print(int(nrb/2))
-
-                    # Inicializar las listas con las instrucciones y las palabras de memoria
-                    for i in range(0, int(nrb/2)):
-                        if hex(addr) != "0xfffe":
-                            if nrb > 0 and nrb <= 2:
-                                if self.load_word_at(addr) >= int("0x1000", 16) and self.load_word_at(addr) <= int("0x12B0", 16):
-                                    # Instruction word
-                                    self.instruction_words.append({ "LOCATION": addr, "CONTENT": self.load_word_at(addr), "OFFSET": None, "OFFSET_LOCATION": None })
-                            else:
-                                # Instruction word
-                                try:
-                                    if self.load_word_at(addr+2) < int("0x1000", 16) or self.load_word_at(addr+2) > int("0x12B0", 16):
-                                        # Instruction word con offset
-                                        self.instruction_words.append({ "LOCATION": addr, "CONTENT": self.load_word_at(addr), "OFFSET": self.load_word_at(addr+2), "OFFSET_LOCATION": addr+2 })
-                                        addr += 2
-                                    else:
-                                        # Instruction word sin offset
-                                        self.instruction_words.append({ "LOCATION": addr, "CONTENT": self.load_word_at(addr), "OFFSET": None, "OFFSET_LOCATION": None })
-
-                                except MemoryException:
-                                    self.instruction_words.append({ "LOCATION": addr, "CONTENT": self.load_word_at(addr), "OFFSET": None, "OFFSET_LOCATION": None })
-
-                            addr += 2
+                    addr = base + ((record[1] << 8) | record[2])
+
+                    # Recortar al rango de la memoria
+                    first = max(addr, self.mem_start)
+                    last = min(addr + len(data), end)
+                    if first >= last:
+                        continue
+                    offs = first - self.mem_start
+                    self.mem[offs : offs + last - first] = data[first - addr : last - addr]
+                    self.mark_initialized(offs, last - first)
+
+                    if addr == first and addr & 1 == 0:
+                        self.scan_instruction_words(addr, data[: (last - first) & ~1])
 
                 elif typ == 1:
                     break
+                elif typ in (2, 4) and len(data) != 2:
+                    raise IntelHexException("Linea {:d}: registro de direccion sin 2 bytes [{:s}]".format(linenr, line))
+                elif typ == 2:
+                    base = ((data[0] << 8) | data[1]) << 4
+                elif typ == 4:
+                    base = ((data[0] << 8) | data[1]) << 16
+
+
+    def scan_instruction_words(self, addr, data):
+        """ Agrega a self.instruction_words las palabras de un registro
+            de datos (<data>, cargado en <addr>) que parecen instrucciones
+            de simple operando (0x1000..0x12b0), cada una con su palabra
+            de extension si la siguiente palabra no parece una instruccion.
+            Es la misma heuristica que usaba la version anterior de
+            load_from_intel, sin volver a leer la memoria.
+        """
+        words = [w for w, in WORD.iter_unpack(data)]
+
+        def word(i):
+            """ Palabra i del registro. Mas alla del registro se usa la
+                memoria, si ya fue cargada (si no, None)
+            """
+            if i < len(words):
+                return words[i]
+            offs = addr - self.mem_start + i*2
+            if offs + 1 < self.mem_size and self.is_initialized(offs) and self.is_initialized(offs + 1):
+                return WORD.unpack_from(self.mem, offs)[0]
+            return None
+
+        def is_opcode(w):
+            return w != None and 0x1000 <= w <= 0x12b0
+
+        # Cada palabra seguida de una que no parece instruccion descuenta
+        # una palabra del total
+        count = len(words)
+        for i in range(len(words)):
+            w = word(i + 1)
+            if addr + i*2 != 0xfffe and w != None and not is_opcode(w):
+                count -= 1
+
+        i = 0
+        for n in range(count):
+            location = addr + i*2
+            if location != 0xfffe:
+                if count == 1:
+                    if is_opcode(words[i]):
+                        self.instruction_words.append({ "LOCATION": location, "CONTENT": words[i], "OFFSET": None, "OFFSET_LOCATION": None })
+                elif not is_opcode(word(i + 1)) and word(i + 1) != None:
+                    # Instruction word con offset
+                    self.instruction_words.append({ "LOCATION": location, "CONTENT": words[i], "OFFSET": word(i + 1), "OFFSET_LOCATION": location + 2 })
+                    i += 1
                 else:
-                    continue
-
-            # print("I,", self.instruction_words)
+                    # Instruction word sin offset
+                    self.instruction_words.append({ "LOCATION": location, "CONTENT": words[i], "OFFSET": None, "OFFSET_LOCATION": None })
+            i += 1
 
 
     def check_intel_line(self, line):
-        if line[0] != ':': return False
-        if len(line) < 11: return False
-
-        checksum = 0
-        i = 1
-        while i < len(line):
-            try:
-                checksum += int(line[i:i+2], 16)
-            except ValueError:
-                return False
-            i += 2
-
-        return (checksum & 0xff) == 0
-
-
-    def store_to_intel(self, fname):
-        words_per_line = 8
-
-        addr = 0
-        intel = ""
-        line_break = True
-        word_count = 0
-        last_addr = -4
-
-        while addr < self.mem_size:
-            if self.mem[addr] != None:
-                opcode = self.load_word_at(addr + self.mem_start)
-                opc_l = opcode & 0xff
-                opc_h = (opcode & 0xff00) >> 8
-                addr_abs = addr + self.mem_start
-                addr_l = addr_abs & 0xff
-                addr_h = (addr_abs & 0xff00) >> 8
-
-                if (last_addr + 2) != addr:
-                    if word_count != 0:
-                        checksum += word_count
-                        intel += ":{:02x}".format(word_count * 2) + \
-                                 s + \
-                                 "{:02x}\n".format(256 - checksum & 0xff)
-                        first_line = False
-                        word_count = 0
-
-                    s = "{:04x}00".format(addr_abs)
-                    checksum = addr_l + addr_h
-
-                s += "{:02x}{:02x}".format(opc_l, opc_h)
-                checksum += opc_l + opc_h
-                last_addr = addr
-
-                word_count += 1
-                if word_count == words_per_line:
-                    last_addr -= 2              # Forzar salto de bloque
-
-            addr += 2
-
-        if word_count != 0:
-            checksum += word_count
-            intel += ":{:02x}".format(word_count * 2) + \
-                     s + \
-                     "{:02x}\n".format(256 - checksum & 0xff)
-
-        intel += ":00000001FF\n"
-
-        with open(fname, "w") as outf:
-            outf.write(intel)
+        """ True si <line> es un registro Intel HEX valido (formato, largo
+            y suma de control)
+        """
+        if line[:1] != ':': return False
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError:
+            return False
+        return (len(record) >= 5 and len(record) == record[0] + 5 and
+                sum(record) & 0xff == 0)
+
+
+    def initialized_runs(self):
+        """ Generador de los tramos de bytes inicializados, como
+            (offset, cantidad), recorriendo self.init_map de a 8 bytes
+        """
+        start = None
+        for i, bits in enumerate(self.init_map):
+            if bits == 0xff:
+                if start == None:
+                    start = i << 3
+            elif bits == 0:
+                if start != None:
+                    yield start, (i << 3) - start
+                    start = None
+            else:
+                for bit in range(8):
+                    offs = (i << 3) + bit
+                    if (bits >> bit) & 1:
+                        if start == None:
+                            start = offs
+                    elif start != None:
+                        yield start, offs - start
+                        start = None
+
+        if start != None:
+            yield start, min(len(self.init_map) << 3, self.mem_size) - start
+
+
+    def store_to_intel(self, fname, record_len = 16, words = None):
+        """ Graba la memoria en formato Intel HEX, en el archivo <fname>:
+                record_len  Bytes de datos por registro (16, 32, ... 255)
+                words       Si no es None, una lista como instruction_words:
+                            se graban esas palabras (con sus extensiones)
+                            en lugar del contenido de la memoria, y luego
+                            el vector de reset tomado de la memoria
+            Los registros se generan de a uno (intel_records) y se
+            escriben a traves de un buffer.
+        """
+        if not 0 < record_len <= 255:
+            raise IntelHexException("Largo de registro invalido ({:d})".format(record_len))
 
-        return
+        if words == None:
+            chunks = ((self.mem_start + offs, self.view[offs : offs + size])
+                                for offs, size in self.initialized_runs())
+        else:
+            chunks = self.words_chunks(words)
+
+        with open(fname, "w", buffering = 1 << 16) as outf:
+            outf.writelines(intel_records(chunks, record_len))
 
 
     def store_to_intel_with_words_list(self, fname, instruction_words_list = []):
-        # print(instruction_words_list)
-
-        words_per_line = 8
-
-        addr = 0
-        intel = ""
-        line_break = True
-        word_count = 0
-        last_addr = -4
-
-        for word in instruction_words_list:
-            opcode = word["CONTENT"]
-            opc_l = opcode & 0xff
-            opc_h = (opcode & 0xff00) >> 8
-            addr_abs = word["LOCATION"]
-            addr_l = addr_abs & 0xff
-            addr_h = (addr_abs & 0xff00) >> 8
-
-            if (last_addr + 2) != addr:
-                if word_count != 0:
-                    checksum += word_count
-                    intel += ":{:02x}".format(word_count * 2) + \
-                                s + \
-                                "{:02x}\n".format(256 - checksum & 0xff)
-                    first_line = False
-                    word_count = 0
-
-                s = "{:04x}00".format(addr_abs)
-                checksum = addr_l + addr_h
-
-            s += "{:02x}{:02x}".format(opc_l, opc_h)
-            checksum += opc_l + opc_h
-            last_addr = addr
-
-            word_count += 1
-            if word_count == words_per_line:
-                last_addr -= 2              # Forzar salto de bloque
-
-            addr += 2
-
-            if (word["OFFSET"] != None):
-                opcode = word["OFFSET"]
-                opc_l = opcode & 0xff
-                opc_h = (opcode & 0xff00) >> 8
-                addr_abs = word["OFFSET_LOCATION"]
-                addr_l = addr_abs & 0xff
-                addr_h = (addr_abs & 0xff00) >> 8
-
-                if (last_addr + 2) != addr:
-                    if word_count != 0:
-                        checksum += word_count
-                        intel += ":{:02x}".format(word_count * 2) + \
-                                    s + \
-                                    "{:02x}\n".format(256 - checksum & 0xff)
-                        first_line = False
-                        word_count = 0
-
-                    s = "{:04x}00".format(addr_abs)
-                    checksum = addr_l + addr_h
-
-                s += "{:02x}{:02x}".format(opc_l, opc_h)
-                checksum += opc_l + opc_h
-                last_addr = addr
-
-                word_count += 1
-                if word_count == words_per_line:
-                    last_addr -= 2              # Forzar salto de bloque
-
-                addr += 2
-
-        if word_count != 0:
-            checksum += word_count
-            intel += ":{:02x}".format(word_count * 2) + \
-                     s + \
-                     "{:02x}\n".format(256 - checksum & 0xff)
-
-        intel += ":02fffe0000c240\n"
-        intel += ":00000001FF\n"
-
-        # print(intel)
-
-        with open(fname, "w") as outf:
-            outf.write(intel)
+        """ Graba solo las palabras de <instruction_words_list> (ver
+            store_to_intel)
+        """
+        self.store_to_intel(fname, words = instruction_words_list)
 
-        return
+
+    def words_chunks(self, words):
+        """ Tramos (direccion, bytes) de las palabras de una lista como
+            instruction_words, uniendo las que son consecutivas. Termina
+            con el vector de reset (0xfffe) de la memoria, si esta cargado
+            y la lista no lo incluye.
+        """
+        start = None
+        data = bytearray()
+        reset_vector = 0xfffe
+
+        for word in words:
+            for location, content in ((word["LOCATION"], word["CONTENT"]),
+                                      (word["OFFSET_LOCATION"], word["OFFSET"])):
+                if content == None:
+                    continue
+                if start != None and location != start + len(data):
+                    yield start, data
+                    start, data = None, bytearray()
+                if start == None:
+                    start = location
+                data += WORD.pack(content & 0xffff)
+                if location == reset_vector:
+                    reset_vector = None
+
+        if start != None:
+            yield start, data
+
+        if reset_vector != None and self.in_mem_range(reset_vector - self.mem_start):
+            offs = reset_vector - self.mem_start
+            if self.is_initialized(offs) and self.is_initialized(offs + 1):
+                yield reset_vector, self.view[offs : offs + 2]
 
 
     def load_word_at(self, addr):
@@ -401,6 +601,36 @@ class Memory():
             self.store_word_at(addr + i*2, word)
 
 
+    def store_bytes_at(self, addr, data):
+        """ Copia <data> (bytes, memoryview, ...) a la memoria desde la
+            direccion <addr>, de una sola vez, y lo marca inicializado.
+            Lanza MemoryException si no entra en la memoria.
+        """
+        offs = addr - self.mem_start
+        if offs < 0 or offs + len(data) > self.mem_size:
+            raise MemoryException("Dirección fuera de rango (0x{:04x}, {:d} bytes)".format(addr, len(data)))
+
+        flags = 0
+        for page in range(offs >> 8, (offs + len(data) + 0xff) >> 8):
+            flags |= self.watched[page]
+        if flags:
+            self.notify(flags, addr, len(data))
+
+        self.mem[offs : offs + len(data)] = data
+        self.mark_initialized(offs, len(data))
+
+
+    def load_bytes_at(self, addr, size):
+        """ Retorna <size> bytes desde <addr>, como memoryview sobre la
+            memoria (sin copiar, y sin controlar la inicializacion).
+            Lanza MemoryException si no estan en la memoria.
+        """
+        offs = addr - self.mem_start
+        if offs < 0 or offs + size > self.mem_size:
+            raise MemoryException("Dirección fuera de rango (0x{:04x}, {:d} bytes)".format(addr, size))
+        return self.view[offs : offs + size]
+
+
     def load_byte_at(self, addr):
         """ Load devuelve el contenido de la memory en la direccion <addr>.
             Controla si <addr> se encuentra en el rango correcto.
@@ -411,8 +641,11 @@ class Memory():
             print("Dirección fuera de rango (%d, 0x%x)" % (addr, addr))
             return
 
-        b = self.mem[addr - self.mem_start]
-        return b
+        offs = addr - self.mem_start
+        if not self.is_initialized(offs):
+            return None
+
+        return self.mem[offs]
 
 
     def store_byte_at(self, addr, value):
@@ -424,11 +657,32 @@ class Memory():
             print("Direccion fuera de rango")
             return
 
-        self.mem[addr - self.mem_start] = value
+        offs = addr - self.mem_start
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], addr, 1)
+
+        self.mem[offs] = value & 0xff
+        self.init_map[offs >> 3] |= 1 << (offs & 7)
         return
 
 
 
+def intel_records(chunks, record_len = 16):
+    """ Generador de las lineas Intel HEX para los tramos <chunks>
+        (secuencia de (direccion, bytes)), en registros de hasta
+        <record_len> bytes, terminando con el registro de fin de archivo
+    """
+    for addr, data in chunks:
+        for pos in range(0, len(data), record_len):
+            piece = data[pos : pos + record_len]
+            rec_addr = (addr + pos) & 0xffff
+            record = bytes((len(piece), rec_addr >> 8, rec_addr & 0xff, 0)) + piece
+            yield ":{:s}{:02x}\n".format(record.hex(), -sum(record) & 0xff)
+
+    yield ":00000001FF\n"
+
+
+
 def main():
     #~ M = Memory(1024, mem_start = 0xfc00)
 
@@ -464,11 +718,11 @@ def main():
         M.store_to_intel("test.hex")
 
         print("Check 'check_intel_line'... Some good lines:")
-        print(M.check_intel_line(":08c24000a4110412441214121900541219002412e1"))
-        print(M.check_intel_line(":08fd100098101a00a910b910051196111b002b1292"))
+        print(M.check_intel_line(":10c24000a4110412441214121900541219002412d9"))
+        print(M.check_intel_line(":10fd100098101a00a910b910051196111b002b128a"))
         print(M.check_intel_line(":00000001FF"))
         print("... and some bad lines:")
-        print(M.check_intel_line(":08c24000a4110412441214121900541319002412e1"))    # Incorrect value
+        print(M.check_intel_line(":10c24000a4110412441214121900541319002412d9"))    # Incorrect value
         print(M.check_intel_line(":08fd1000912"))                                   # Nibble missing
         print(M.check_intel_line(":08fd1000"))                                      # Too short
         print(M.check_intel_line(":08fd100098z01a00a910b910051196111b002b1292"))    # Invalid hex char
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  peripherals.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Marco para los perifericos mapeados en memoria (0x0000..0x01ff).
+
+    Peripheral_space es la region del bus que cubre el espacio de
+    perifericos: reparte cada acceso al dispositivo (Peripheral) que
+    registro esa direccion, con una tabla de 512 entradas.
+
+    Las escrituras avisan a los observadores de la pagina, igual que en
+    Memory (add_watcher/watch): asi funcionan los watchpoints de escritura
+    sobre los registros de los perifericos.
+
+    Los dispositivos piden interrupciones al controlador del CPU (ver
+    interrupts.py): actualizan su linea cada vez que cambian sus
+    banderas o habilitaciones.
+
+    Scheduler es una cola de prioridad (heapq) de eventos futuros,
+    indexada por ciclo de MCLK. Los dispositivos no se actualizan en cada
+    instruccion: calculan cuando ocurre su proximo evento (desborde de un
+    timer, fin de transmision de un byte, ...) y lo agendan. CPU.run solo
+    compara sim.cycles con Scheduler.next_cycle luego de cada
+    instruccion o bloque.
+
+    Los modelos de dispositivos estan en devices.py.
+"""
+
+import heapq
+import itertools
+
+from memory import Memory, MemoryException
+
+
+def copy_state(value):
+    """ Copia de un atributo de estado: las listas y los bytearrays se
+        copian, el resto se comparte
+    """
+    if isinstance(value, (list, bytearray)):
+        return value[:]
+    return value
+
+
+
+class Event():
+    """ Evento agendado: se llama a <callback>() en el ciclo <cycle>. Se
+        puede cancelar (Scheduler.cancel) sin sacarlo de la cola. Con
+        <keep> sobrevive a un PUC (Scheduler.clear).
+    """
+    __slots__ = ("cycle", "callback", "cancelled", "keep")
+
+    def __init__(self, cycle, callback, keep = False):
+        self.cycle = cycle
+        self.callback = callback
+        self.cancelled = False
+        self.keep = keep
+
+
+class Scheduler():
+    """ Cola de eventos, ordenada por ciclo:
+            next_cycle  Ciclo del proximo evento (infinito si no hay)
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.queue = []
+        self.seq = itertools.count()        # Orden entre eventos del mismo ciclo
+        self.next_cycle = float("inf")
+
+
+    def clear(self):
+        """ Borra los eventos, salvo los agendados con <keep>. La cola se
+            vacia en el lugar: un evento que provoca un PUC llama a clear
+            desde run(), que la sigue recorriendo.
+        """
+        queue = self.queue
+        queue[:] = [entry for entry in queue if entry[2].keep and not entry[2].cancelled]
+        heapq.heapify(queue)
+        self.next_cycle = queue[0][0] if queue else float("inf")
+
+
+    def schedule(self, cycle, callback, keep = False):
+        """ Agenda <callback>() para el ciclo <cycle>. Retorna el Event """
+        event = Event(cycle, callback, keep)
+        heapq.heappush(self.queue, (cycle, next(self.seq), event))
+        if cycle < self.next_cycle:
+            self.next_cycle = cycle
+        return event
+
+
+    def schedule_in(self, delay, callback):
+        """ Agenda <callback>() dentro de <delay> ciclos """
+        return self.schedule(self.sim.cycles + delay, callback)
+
+
+    def cancel(self, event):
+        if event != None:
+            event.cancelled = True
+
+
+    def run(self, cycle):
+        """ Ejecuta los eventos hasta el ciclo <cycle> inclusive, en orden.
+            Un evento puede agendar otros (que se ejecutan si tambien
+            caen antes de <cycle>).
+        """
+        queue = self.queue
+        while queue and queue[0][0] <= cycle:
+            _, _, event = heapq.heappop(queue)
+            if not event.cancelled:
+                event.callback()
+        self.next_cycle = queue[0][0] if queue else float("inf")
+
+
+    def pending(self):
+        """ Eventos no cancelados, en orden: lista de (ciclo, Event) """
+        return [(cycle, event) for cycle, _, event in sorted(self.queue)
+                               if not event.cancelled]
+
+
+    def snapshot(self):
+        """ Estado de la cola (ver CPU.snapshot). Se guardan los mismos
+            Event, que los dispositivos tambien guardan en su estado, con
+            su marca de cancelado. Los eventos con <keep> no son parte del
+            estado de la maquina (el limite de un CPU.run).
+        """
+        return [(entry, entry[2].cancelled) for entry in self.queue
+                                            if not entry[2].keep]
+
+
+    def restore(self, state):
+        """ Vuelve a la cola guardada con snapshot(), conservando los
+            eventos con <keep> actuales
+        """
+        queue = self.queue
+        kept = [entry for entry in queue if entry[2].keep]
+        queue[:] = kept
+        for entry, cancelled in state:
+            entry[2].cancelled = cancelled
+            queue.append(entry)
+        heapq.heapify(queue)
+        self.next_cycle = queue[0][0] if queue else float("inf")
+
+
+
+class Peripheral():
+    """ Base de los dispositivos. Un dispositivo declara en <ranges> las
+        direcciones que atiende (lista de (inicio, tamaño)) y redefine
+        read_byte/write_byte (y read_word/write_word si tiene registros de
+        16 bits). Al agregarlo a un Peripheral_space recibe el CPU, el
+        Scheduler y el controlador de interrupciones en attach().
+        En <state> nombra los atributos que forman su estado (para
+        snapshot/restore).
+    """
+    name = "periferico"
+    state = ()
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.cpu = None
+        self.scheduler = None
+        self.interrupts = None
+
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        self.scheduler = cpu.scheduler
+        self.interrupts = cpu.interrupts
+
+
+    def reset(self):
+        """ Estado luego de un reset (los eventos ya fueron borrados) """
+        pass
+
+
+    def cycles(self):
+        """ Ciclo de MCLK actual """
+        return self.cpu.sim.cycles
+
+
+    def snapshot(self):
+        """ Copia de los atributos nombrados en <state>. Los Event se
+            guardan tal cual (ver Scheduler.snapshot).
+        """
+        return [copy_state(getattr(self, name)) for name in self.state]
+
+
+    def restore(self, values):
+        for name, value in zip(self.state, values):
+            setattr(self, name, copy_state(value))
+
+
+    def read_byte(self, addr):
+        return 0
+
+    def write_byte(self, addr, value):
+        pass
+
+    def read_word(self, addr):
+        return self.read_byte(addr) | (self.read_byte(addr + 1) << 8)
+
+    def write_word(self, addr, value):
+        self.write_byte(addr, value & 0xff)
+        self.write_byte(addr + 1, (value >> 8) & 0xff)
+
+
+    def __str__(self):
+        return "{:s} ({:s})".format(self.name, ", ".join(
+                    "0x{:04x}..0x{:04x}".format(start, start + size - 1)
+                            for start, size in self.ranges))
+
+
+
+class Peripheral_space():
+    """ Region del bus con los perifericos (0x0000..0x01ff). Las
+        direcciones sin dispositivo se leen como 0 y las escrituras se
+        ignoran.
+    """
+    def __init__(self, cpu, mem_start = 0x0000, mem_size = 0x0200):
+        self.cpu = cpu
+        self.mem_start = mem_start
+        self.mem_size = mem_size
+        self.devices = []
+        self.owner = [None] * mem_size
+        self.watchers = []
+        self.watched = bytearray((mem_size + 0xff) >> 8)
+
+
+    def __str__(self):
+        return "\n".join(str(dev) for dev in self.devices)
+
+    # Observadores de escrituras: los mismos metodos que en Memory
+    add_watcher = Memory.add_watcher
+    remove_watcher = Memory.remove_watcher
+    watch = Memory.watch
+    notify = Memory.notify
+
+
+    def add(self, device):
+        """ Agrega <device> en las direcciones de device.ranges """
+        for start, size in device.ranges:
+            for addr in range(start, start + size):
+                offs = addr - self.mem_start
+                if not 0 <= offs < self.mem_size:
+                    raise MemoryException("{:s}: fuera del espacio de perifericos (0x{:04x})".format(
+                                device.name, addr))
+                if self.owner[offs] != None:
+                    raise MemoryException("{:s}: 0x{:04x} ya es de {:s}".format(
+                                device.name, addr, self.owner[offs].name))
+
+        for start, size in device.ranges:
+            for addr in range(start, start + size):
+                self.owner[addr - self.mem_start] = device
+        self.devices.append(device)
+        device.attach(self.cpu)
+        device.reset()
+        return device
+
+
+    def device(self, name):
+        """ El dispositivo llamado <name>, o None """
+        for dev in self.devices:
+            if dev.name == name:
+                return dev
+        return None
+
+
+    def reset(self):
+        for dev in self.devices:
+            dev.reset()
+
+
+    def snapshot(self):
+        """ Estado de los dispositivos (ver CPU.snapshot) """
+        return [dev.snapshot() for dev in self.devices]
+
+
+    def restore(self, state):
+        for dev, values in zip(self.devices, state):
+            dev.restore(values)
+
+    #
+    #   Accesos rapidos (del simulador)
+    #
+
+    def read_word(self, addr):
+        dev = self.owner[(addr & ~1) - self.mem_start]
+        return dev.read_word(addr & ~1) if dev != None else 0
+
+    def read_byte(self, addr):
+        dev = self.owner[addr - self.mem_start]
+        return dev.read_byte(addr) if dev != None else 0
+
+    def write_word(self, addr, value):
+        offs = (addr & ~1) - self.mem_start
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], addr & ~1, 2)
+        dev = self.owner[offs]
+        if dev != None:
+            dev.write_word(addr & ~1, value & 0xffff)
+
+    def write_byte(self, addr, value):
+        offs = addr - self.mem_start
+        if self.watched[offs >> 8]:
+            self.notify(self.watched[offs >> 8], addr, 1)
+        dev = self.owner[offs]
+        if dev != None:
+            dev.write_byte(addr, value & 0xff)
+
+    #
+    #   Accesos controlados: los perifericos siempre estan inicializados
+    #
+
+    def load_word_at(self, addr):
+        if addr & 1:
+            raise MemoryException("Dirección para acceso por palabra debe ser par (0x{:04x})".format(addr))
+        return self.read_word(addr)
+
+    def store_word_at(self, addr, value):
+        if addr & 1:
+            raise MemoryException("Dirección para acceso por palabra debe ser par (0x{:04x})".format(addr))
+        self.write_word(addr, value)
+
+    load_byte_at = read_byte
+    store_byte_at = write_byte
+
+    def store_bytes_at(self, addr, data):
+        for i, value in enumerate(data):
+            self.write_byte(addr + i, value)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  profiler.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Profiler de ejecucion, a nivel de instruccion.
+
+    Se activa asignandolo a cpu.profiler (ver Profiler.attach): CPU.run y
+    CPU.step llaman a record() luego de cada instruccion, y a interrupt()
+    al entrar a una rutina de interrupcion, y dejan de usar el cache de
+    bloques mientras haya un profiler.
+
+    Los contadores por PC y por opcode son arrays de 65536 entradas,
+    indexados directamente: registrar una instruccion cuesta un par de
+    incrementos. Las funciones se resuelven con una Symbol_table (el
+    simbolo mas cercano hacia abajo) recien al generar el reporte.
+
+    Uso:
+        profiler.py programa [-a fuente.asm] [-n instrucciones]
+                             [-t cantidad] [-f salida.folded]
+"""
+
+import sys
+import argparse
+from array import array
+from bisect import bisect_right
+
+from timing import CYCLE_TABLE, INTERRUPT_CYCLES
+from decode import DECODE_TABLE, F_GROUP, F_OPTYPE, F_MNEMONIC, SINGLE2, RETI, CALL
+
+RET_OPCODE = 0x4130                 # mov @SP+, PC
+
+
+class Profiler():
+    """ Contadores:
+            hits            Ejecuciones de cada direccion (array de 64K)
+            pc_cycles       Ciclos consumidos en cada direccion
+            opcode_hits     Ejecuciones de cada opcode
+            calls           Cantidad de llamadas (caller, callee)
+            stacks          Ciclos por pila de llamadas (tupla de
+                            direcciones de entrada), para el folded-stack
+    """
+    def __init__(self, symtab = None):
+        self.symtab = symtab
+        self.reset()
+
+
+    def reset(self):
+        self.hits        = array('L', [0]) * 0x10000
+        self.pc_cycles   = array('L', [0]) * 0x10000
+        self.opcode_hits = array('L', [0]) * 0x10000
+        self.calls  = {}
+        self.stacks = {}
+        self.stack  = (None,)       # Entrada de cada funcion activa
+        self.instructions = 0
+        self.cycles = 0
+
+
+    def attach(self, cpu):
+        """ Empieza a registrar la ejecucion de <cpu> """
+        self.mem = cpu.bus
+        cpu.profiler = self
+
+
+    def detach(self, cpu):
+        cpu.profiler = None
+
+
+    def record(self, pc, next_pc):
+        """ Registra la instruccion ejecutada en <pc>. <next_pc> es el PC
+            luego de ejecutarla.
+        """
+        opcode = self.mem.read_word(pc)
+        cycles = CYCLE_TABLE[opcode]
+
+        self.hits[pc] += 1
+        self.pc_cycles[pc] += cycles
+        self.opcode_hits[opcode] += 1
+        self.instructions += 1
+        self.cycles += cycles
+
+        stack = self.stack
+        self.stacks[stack] = self.stacks.get(stack, 0) + cycles
+
+        dec = DECODE_TABLE[opcode]
+        if dec[F_GROUP] == SINGLE2 and dec[F_OPTYPE] == CALL:
+            key = (stack[-1], next_pc)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.stack = stack + (next_pc,)
+        elif (opcode == RET_OPCODE or dec[F_GROUP] == RETI) and len(stack) > 1:
+            self.stack = stack[:-1]
+
+
+    def interrupt(self, pc, isr):
+        """ Registra la entrada a la rutina de interrupcion <isr>, con el
+            PC interrumpido en <pc>: la rutina se apila como una funcion
+            mas (el RETI la desapila), y los ciclos de la entrada se le
+            cuentan a ella.
+        """
+        self.stack = self.stack + (isr,)
+        self.cycles += INTERRUPT_CYCLES
+        self.stacks[self.stack] = self.stacks.get(self.stack, 0) + INTERRUPT_CYCLES
+
+    #
+    #   Reportes
+    #
+
+    def symbols(self):
+        """ Lista ordenada de (direccion, nombre) de la tabla de simbolos """
+        if self.symtab == None:
+            return []
+        return sorted((value, name) for name, value in self.symtab.symbols.items()
+                                    if value != None)
+
+
+    def function_name(self, addr, symbols = None):
+        """ Nombre de la funcion que contiene a <addr>: el simbolo mas
+            cercano en o antes de <addr>, o la direccion en hex
+        """
+        if addr == None:
+            return "[inicio]"
+        if symbols == None:
+            symbols = self.symbols()
+        i = bisect_right([value for value, name in symbols], addr)
+        if i == 0:
+            return "0x{:04x}".format(addr)
+        value, name = symbols[i - 1]
+        return name if value == addr else "{:s}+0x{:x}".format(name, addr - value)
+
+
+    def hot_spots(self, count = 20):
+        """ Las <count> direcciones mas ejecutadas: lista de
+            (direccion, ejecuciones, ciclos)
+        """
+        hits, cycles = self.hits, self.pc_cycles
+        pcs = sorted((pc for pc in range(0x10000) if hits[pc]),
+                     key = lambda pc: cycles[pc], reverse = True)
+        return [(pc, hits[pc], cycles[pc]) for pc in pcs[:count]]
+
+
+    def opcode_classes(self):
+        """ Ejecuciones por mnemonico (mov, add, jnz, ...) """
+        classes = {}
+        for opcode, n in enumerate(self.opcode_hits):
+            if n:
+                mnemonic = DECODE_TABLE[opcode][F_MNEMONIC]
+                classes[mnemonic] = classes.get(mnemonic, 0) + n
+        return classes
+
+
+    def function_cycles(self):
+        """ Ciclos propios (sin las subrutinas) de cada funcion, segun la
+            tabla de simbolos. Sin tabla, todo queda en una sola entrada.
+        """
+        symbols = self.symbols()
+        starts = [value for value, name in symbols]
+        functions = {}
+        for pc, cycles in enumerate(self.pc_cycles):
+            if cycles:
+                i = bisect_right(starts, pc)
+                name = symbols[i - 1][1] if i else "[sin simbolo]"
+                functions[name] = functions.get(name, 0) + cycles
+        return functions
+
+
+    def call_graph(self):
+        """ Lista de (caller, callee, llamadas), con nombres """
+        symbols = self.symbols()
+        return [(self.function_name(caller, symbols),
+                 self.function_name(callee, symbols), n)
+                        for (caller, callee), n in sorted(self.calls.items(),
+                                    key = lambda c: (c[0][0] or 0, c[0][1]))]
+
+
+    def report(self, count = 20):
+        """ Reporte de texto con los puntos calientes """
+        symbols = self.symbols()
+        total = self.cycles or 1
+
+        s = "{:d} instrucciones, {:d} ciclos\n\n".format(self.instructions, self.cycles)
+
+        s += "Direcciones mas ejecutadas\n"
+        s += "  {:>6s} {:>10s} {:>10s} {:>6s}  {:s}\n".format(
+                    "Dir", "Veces", "Ciclos", "%", "Funcion")
+        for pc, hits, cycles in self.hot_spots(count):
+            s += "  0x{:04x} {:10d} {:10d} {:6.2f}  {:s}\n".format(
+                        pc, hits, cycles, 100 * cycles / total,
+                        self.function_name(pc, symbols))
+
+        s += "\nCiclos por funcion\n"
+        for name, cycles in sorted(self.function_cycles().items(),
+                                   key = lambda f: f[1], reverse = True):
+            s += "  {:20s} {:10d} {:6.2f}\n".format(name, cycles, 100 * cycles / total)
+
+        s += "\nInstrucciones por tipo\n"
+        for mnemonic, n in sorted(self.opcode_classes().items(),
+                                  key = lambda c: c[1], reverse = True):
+            s += "  {:8s} {:10d}\n".format(mnemonic, n)
+
+        graph = self.call_graph()
+        if graph:
+            s += "\nLlamadas\n"
+            for caller, callee, n in graph:
+                s += "  {:20s} -> {:20s} {:8d}\n".format(caller, callee, n)
+        return s
+
+
+    def store_folded(self, fname):
+        """ Graba los ciclos por pila de llamadas en formato 'folded'
+            (una linea "main;func;subfunc ciclos"), como lo usan
+            flamegraph.pl y speedscope.
+        """
+        symbols = self.symbols()
+        with open(fname, "w") as outf:
+            for stack, cycles in sorted(self.stacks.items(), key = lambda s: s[0][1:]):
+                outf.write("{:s} {:d}\n".format(
+                            ";".join(self.function_name(addr, symbols) for addr in stack),
+                            cycles))
+
+
+
+def assemble_symbols(fname):
+    """ Ensambla <fname> (en una memoria descartable) solo para obtener
+        la tabla de simbolos
+    """
+    from cpu import CPU
+    from analyser import Syntax_analyser, Opcodes
+
+    syntax = Syntax_analyser(CPU().ROM)
+    with open(fname, "r") as srcf:
+        for line in srcf:
+            if syntax.analyse(line.rstrip('\n')) == Opcodes.END:
+                break
+    return syntax.symtable
+
+
+def main():
+    from cpu import CPU
+
+    argp = argparse.ArgumentParser(description = "Profiler del simulador MSP430")
+    argp.add_argument("hexfile", help = "Programa (Intel HEX, ELF o imagen)")
+    argp.add_argument("-a", "--asm", help = "Fuente, para los nombres de las funciones")
+    argp.add_argument("-n", "--instructions", type = int, default = 1000000,
+                      help = "Maximo de instrucciones a ejecutar")
+    argp.add_argument("-t", "--top", type = int, default = 20,
+                      help = "Cantidad de direcciones en el reporte")
+    argp.add_argument("-f", "--folded", help = "Archivo de salida folded-stack")
+    args = argp.parse_args()
+
+    cpu = CPU()
+    symtab = cpu.load_program(args.hexfile)
+    cpu.reset()
+
+    if args.asm:
+        symtab = assemble_symbols(args.asm)
+    prof = Profiler(symtab)
+    prof.attach(cpu)
+    print(cpu.run(args.instructions))
+    print(prof.report(args.top))
+
+    if args.folded:
+        prof.store_folded(args.folded)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,17 +22,42 @@
 #
 #
 
+from array import array
+
+# Bits del registro de status
+FLAG_C = 0x0001
+FLAG_Z = 0x0002
+FLAG_N = 0x0004
+GIE    = 0x0008
+CPUOFF = 0x0010
+OSCOFF = 0x0020
+SCG0   = 0x0040
+SCG1   = 0x0080
+FLAG_V = 0x0100
+FLAGS  = FLAG_C | FLAG_Z | FLAG_N | FLAG_V
+NOT_FLAGS = ~FLAGS & 0xffff
+
+# Letras de get_SR/set_SR
+FLAG_BITS = {'C': FLAG_C, 'Z': FLAG_Z, 'N': FLAG_N, 'V': FLAG_V}
+
+
 class Registers():
+    """ Banco de registros: un array('H') de 16 registros de 16 bits, que
+        el simulador usa directamente (get_registers). Las escrituras con
+        los metodos se recortan a 16 bits; las escrituras directas al
+        array fuera de rango lanzan OverflowError.
+    """
     R0, R1, R2, R3, R4, R5, R6, R7, R8, R9, R10, R11, R12, R13, R14, R15 = range(16)
     PC = R0
     SP = R1
     SR = CG1 = R2
     CG2 = R3
 
+    __slots__ = ("reg",)
+
     def __init__(self):
-        self.reg = [0] * 16
+        self.reg = array('H', bytes(32))
         self.reg[Registers.PC] = 0xfffe
-        self.reg[Registers.SR] = 0
 
 
     def __str__(self):
@@ -83,22 +108,26 @@ class Registers():
                 (<state> debe ser True o False)
         """
         if bit == None:
-            self.reg[reg] = state
+            self.reg[reg] = state & 0xffff
+        elif state:
+            self.reg[reg] |= (1 << bit)
         else:
-            if state:
-                self.reg[reg] |= (1 << bit)
-            else:
-                self.reg[reg] &= ~(1 << bit)
+            self.reg[reg] &= ~(1 << bit) & 0xffff
+
+
+    def load(self, values):
+        """ Carga los 16 registros con <values> (cualquier secuencia) """
+        self.reg[:] = array('H', (value & 0xffff for value in values))
 
 
     def get_PC(self):
         """ Leer el Program Counter """
-        return self.get(Registers.PC)
+        return self.reg[Registers.PC]
 
 
     def set_PC(self, new_pc):
         """ Setear al Program Counter """
-        self.set(Registers.PC, new_pc)
+        self.reg[Registers.PC] = new_pc & 0xffff
 
 
     def get_SR(self, bit = None):
@@ -108,18 +137,9 @@ class Registers():
             Si bit es una letra de Z, C, N, V:
                 devuelve (True o False) del bit requerido
         """
-        sr = Registers.SR
-
         if bit == None:
-            return self.reg[sr]
-        elif bit == 'Z':
-            return self.get(sr, 1)
-        elif bit == 'C':
-            return self.get(sr, 0)
-        elif bit == 'N':
-            return self.get(sr, 2)
-        elif bit == 'V':
-            return self.get(sr, 8)
+            return self.reg[Registers.SR]
+        return (self.reg[Registers.SR] & FLAG_BITS[bit]) != 0
 
 
     def set_SR(self, new_sr, bit = None):
@@ -129,18 +149,37 @@ class Registers():
             Si bit es una letra de Z, C, N, V:
                 <new_sr> (True o False) será asignado al bit especificado
         """
+        if bit == None:
+            self.reg[Registers.SR] = new_sr & 0xffff
+        elif new_sr:
+            self.reg[Registers.SR] |= FLAG_BITS[bit]
+        else:
+            self.reg[Registers.SR] &= ~FLAG_BITS[bit] & 0xffff
+
+
+    def set_flags(self, n, z, c, v):
+        """ Asigna los cuatro flags (valores de verdad) con una sola
+            escritura del SR
+        """
         sr = Registers.SR
+        self.reg[sr] = ((self.reg[sr] & NOT_FLAGS) |
+                        (FLAG_N if n else 0) | (FLAG_Z if z else 0) |
+                        (FLAG_C if c else 0) | (FLAG_V if v else 0))
 
-        if bit == None:
-            self.reg[sr] = new_sr
-        elif bit == 'Z':
-            self.set(Registers.SR, new_sr, 1)
-        elif bit == 'C':
-            self.set(Registers.SR, new_sr, 0)
-        elif bit == 'N':
-            self.set(Registers.SR, new_sr, 2)
-        elif bit == 'V':
-            self.set(Registers.SR, new_sr, 8)
+
+    def update_nzcv(self, result, width, c = False, v = False):
+        """ N y Z segun <result>, recortado a <width> bits (8 o 16), y los
+            <c> y <v> dados, con una sola escritura del SR. Retorna el
+            resultado recortado.
+        """
+        mask = (1 << width) - 1
+        result &= mask
+        sr = Registers.SR
+        self.reg[sr] = ((self.reg[sr] & NOT_FLAGS) |
+                        (FLAG_N if result > mask >> 1 else 0) |
+                        (0 if result else FLAG_Z) |
+                        (FLAG_C if c else 0) | (FLAG_V if v else 0))
+        return result
 
 
     def get_registers(self):
@@ -165,6 +204,10 @@ def main():
     r.set_SR(0xaa)
     print(str(r))
 
+    print(r.update_nzcv(0x1ff80, 16, c = True), hex(r.get_SR()))
+    r.set_flags(False, True, False, False)
+    print(hex(r.get_SR()))
+
     return 0
 
 
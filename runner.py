@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  runner.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Ejecucion de pruebas de regresion en paralelo, sin interfaz grafica.
+
+    El manifiesto es un archivo JSON:
+
+        {"defaults": {"part": "MSP430iua", "max_instructions": 100000},
+         "tests": [
+            {"name":  "suma",
+             "image": "suma.hex",               (HEX, ELF o imagen)
+             "until": "fin",                    (direccion o simbolo)
+             "max_instructions": 5000,          (y/o "max_cycles")
+             "expect": {
+                "registers": {"R14": "0x0037", "SP": 1024},
+                "memory":    {"0x0300": "0x1234"},     (palabras)
+                "bytes":     {"0x0302": 18},
+                "reason":    "until"}}]}
+
+    Los valores pueden ser enteros o textos ("0x..", "0b..", decimal).
+    Las rutas de los programas son relativas al manifiesto.
+
+    Una prueba sin max_instructions ni max_cycles se corta a las
+    MAX_INSTRUCTIONS instrucciones. Si una prueba termina por el limite
+    sin haberlo pedido (tiene "until", o usa el limite por defecto, y no
+    espera "reason": "limit") falla por tiempo agotado ("timeout": true
+    en su registro).
+
+    Cada proceso del pool crea un solo CPU por micro y lo reusa (ver
+    CPU.clear). El resultado es un JSON con un registro por prueba y los
+    totales de ciclos e instrucciones.
+
+    Uso:
+        runner.py manifiesto.json [-j procesos] [-o resultados.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+from cpu import CPU, CPUException, Run_result
+from registers import Registers
+from memory import MemoryException
+
+REGISTER_NAMES = {"PC": Registers.PC, "SP": Registers.SP,
+                  "SR": Registers.SR, "CG2": Registers.CG2}
+REGISTER_NAMES.update(("R%d" % r, r) for r in range(16))
+
+# Limite de instrucciones de una prueba que no fija ninguno: un programa
+# que no termina no bloquea a su proceso del pool
+MAX_INSTRUCTIONS = 10000000
+
+# CPUs del proceso, uno por micro
+cpus = {}
+
+
+def to_int(value):
+    return value if isinstance(value, int) else int(value, 0)
+
+
+def resolve_address(value, symtab):
+    """ <value> es un entero, un numero en texto o un simbolo """
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value, 0)
+    except ValueError:
+        if symtab != None and symtab.defined(value) and symtab.lookup(value) != None:
+            return symtab.lookup(value)
+        raise CPUException("Simbolo no definido: {:s}".format(value))
+
+
+def check_expectations(cpu, expect, result, symtab):
+    """ Retorna la lista de diferencias con lo esperado (vacia si pasa) """
+    failures = []
+
+    for name, value in expect.get("registers", {}).items():
+        reg = REGISTER_NAMES[name.upper()]
+        got = cpu.reg.get(reg)
+        if got != to_int(value):
+            failures.append("{:s} = 0x{:04x}, se esperaba 0x{:04x}".format(name, got, to_int(value)))
+
+    for kind, read, fmt in (("memory", cpu.bus.read_word, "0x{:04x}"),
+                            ("bytes",  cpu.bus.read_byte, "0x{:02x}")):
+        for addr, value in expect.get(kind, {}).items():
+            addr = resolve_address(addr, symtab)
+            got = read(addr & 0xffff)
+            if got != to_int(value):
+                failures.append(("[0x{:04x}] = " + fmt + ", se esperaba " + fmt).format(
+                            addr, got, to_int(value)))
+
+    if "reason" in expect and Run_result.REASONS[result.reason] != expect["reason"]:
+        failures.append("Termino por {:s}, se esperaba {:s}".format(
+                    Run_result.REASONS[result.reason], expect["reason"]))
+
+    return failures
+
+
+def run_test(test):
+    """ Ejecuta una prueba (un elemento del manifiesto, ya combinado con
+        los valores por defecto). Se ejecuta en un proceso del pool.
+    """
+    part = test.get("part", "MSP430iua")
+    if part not in cpus:
+        cpus[part] = CPU(part)
+    cpu = cpus[part]
+
+    record = {"name": test.get("name", test["image"]),
+              "image": test["image"]}
+    try:
+        cpu.clear()
+        symtab = cpu.load_program(test["image"])
+
+        until = test.get("until")
+        if until != None:
+            until = resolve_address(until, symtab)
+
+        max_instructions = test.get("max_instructions")
+        max_cycles = test.get("max_cycles")
+        default_limit = max_instructions == None and max_cycles == None
+        if default_limit:
+            max_instructions = MAX_INSTRUCTIONS
+
+        result = cpu.run(max_instructions, until, max_cycles = max_cycles)
+        expect = test.get("expect", {})
+        failures = check_expectations(cpu, expect, result, symtab)
+
+        timeout = (result.reason == Run_result.LIMIT and
+                   (until != None or default_limit) and
+                   expect.get("reason") != "limit")
+        if timeout:
+            failures.insert(0, "Tiempo agotado: {:d} instrucciones, {:d} ciclos".format(
+                        result.instructions, result.cycles))
+
+        record.update(passed = not failures,
+                      timeout = timeout,
+                      failures = failures,
+                      result = result.as_dict(),
+                      cycles = cpu.cycles(),
+                      instructions = cpu.instructions())
+
+    except (CPUException, MemoryException, OSError, KeyError, ValueError) as ex:
+        record.update(passed = False,
+                      timeout = False,
+                      failures = ["{:s}: {:s}".format(type(ex).__name__, str(ex))],
+                      result = None,
+                      cycles = 0,
+                      instructions = 0)
+
+    return record
+
+
+def load_manifest(fname):
+    """ Lista de pruebas del manifiesto, con los valores por defecto
+        aplicados y las rutas resueltas
+    """
+    with open(fname, "r") as inf:
+        manifest = json.load(inf)
+
+    base = os.path.dirname(os.path.abspath(fname))
+    defaults = manifest.get("defaults", {})
+    tests = []
+    for test in manifest["tests"]:
+        merged = dict(defaults)
+        merged.update(test)
+        merged["image"] = os.path.join(base, merged["image"])
+        tests.append(merged)
+    return tests
+
+
+def run_manifest(tests, jobs = None):
+    """ Ejecuta las pruebas en un pool de <jobs> procesos (por defecto,
+        uno por nucleo). Retorna el diccionario de resultados.
+    """
+    start = time.perf_counter()
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.map(run_test, tests, chunksize = 1)
+
+    return {"results": results,
+            "total": len(results),
+            "passed": sum(1 for r in results if r["passed"]),
+            "failed": sum(1 for r in results if not r["passed"]),
+            "timeouts": sum(1 for r in results if r["timeout"]),
+            "cycles": sum(r["cycles"] for r in results),
+            "instructions": sum(r["instructions"] for r in results),
+            "seconds": time.perf_counter() - start}
+
+
+def main():
+    argp = argparse.ArgumentParser(description = "Pruebas de regresion del simulador MSP430")
+    argp.add_argument("manifest", help = "Manifiesto JSON")
+    argp.add_argument("-j", "--jobs", type = int, default = None,
+                      help = "Cantidad de procesos (por defecto, uno por nucleo)")
+    argp.add_argument("-o", "--output", help = "Archivo de resultados (por defecto, la salida)")
+    args = argp.parse_args()
+
+    summary = run_manifest(load_manifest(args.manifest), args.jobs)
+
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(summary, outf, indent = 2)
+    else:
+        json.dump(summary, sys.stdout, indent = 2)
+        print()
+
+    print("{:d} pruebas, {:d} fallidas ({:d} por tiempo agotado), {:d} ciclos, "
+          "{:d} instrucciones, {:.2f} s".format(
+                summary["total"], summary["failed"], summary["timeouts"],
+                summary["cycles"], summary["instructions"], summary["seconds"]),
+          file = sys.stderr)
+
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,13 +26,12 @@ import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Pango
 
-from datetime import datetime, timedelta
-
-from cpu import CPU
+from cpu import CPU, CPUException
+from history import History
 from registers import Registers
 from main_menu import Sim_main_menu
 from disasm import Disassembler
-from memory import MemoryException
+from memory import MemoryException, IntelHexException
 from memory_editor_words_dialog import Memory_editor_instruction_word_dialog, Memory_editor_memory_word_dialog, ValueIsNotEvenException, ValueNegativeOrZeroException
 import pdb
 
@@ -448,7 +447,7 @@ class Sim_registers(Gtk.Frame):
 
 
     def callback(self, new_val, reg_nr = None):
-        self.regs[reg_nr] = new_val
+        self.regs[reg_nr] = new_val & 0xffff
 
 
 class Memory_editor(Gtk.Frame):
@@ -542,7 +541,8 @@ class Memory_editor(Gtk.Frame):
 
 
 class ExecutionTime(Gtk.Frame):
-    """ Muestra el tiempo de ejecucion en pasos del procesador
+    """ Muestra los ciclos de MCLK y el tiempo simulado (segun la
+        frecuencia cpu.mclk) desde el ultimo reset
     """
     def __init__(self, toplevel):
         super(ExecutionTime, self).__init__()
@@ -552,40 +552,20 @@ class ExecutionTime(Gtk.Frame):
 
         self.toplevel = toplevel
 
-        self.time_start = datetime.now()                            # Tiempo de inicio
-        self.delta_time = datetime.now() - self.time_start          # Delta de tiempo entre el tiempo actual y el inicial
-        self.accumulated = 0
-        self.is_reset = False
-
-        self.label = Gtk.Label(self.format_value(self.delta_time.seconds))
+        self.label = Gtk.Label(self.format_value(0, 0, 0.0))
         self.label.modify_font(Pango.FontDescription("Mono 10"))
         self.add(self.label)
 
-    def format_value(self, delta_time_seconds):
-        self.accumulated += delta_time_seconds
-        return 'Tiempo de ejecución: {}'.format(timedelta(seconds=self.accumulated))
- 
-    def get_time_start(self):
-        return self.time_start
-
-    def set_time_start(self):
-        self.time_start = datetime.now()
-
-    def get_delta_time(self):
-        return self.delta_time
-
-    def set_delta_time(self):
-        self.delta_time = datetime.now() - self.get_time_start()
-
-    def update_time(self, delta_time_seconds):
-        self.label.set_text(self.format_value(delta_time_seconds))
-
-        if self.is_reset:
-            self.is_reset = False
+    def format_value(self, cycles, instructions, seconds):
+        return 'Ciclos: {:d}  Instrucciones: {:d}  Tiempo simulado: {:.6f} s'.format(
+                    cycles, instructions, seconds)
 
-    def reset_time(self):
-        self.accumulated = 0
-        self.is_reset = True
+    def update_time(self):
+        """ Actualiza la pantalla con los contadores del CPU """
+        cpu = self.toplevel.cpu
+        self.label.set_text(self.format_value(cpu.cycles(),
+                                              cpu.instructions(),
+                                              cpu.simulated_time()))
 
 
 class Tools(Gtk.Frame):
@@ -613,6 +593,7 @@ class Source_code(Gtk.Frame):
             append()        Agrega una línea en la pantalla
             select_at_pc()  Selecciona la linea correspondiente al PC
             step()          Ejecutar un paso del programa
+            step_back()     Volver un paso atras
             reset()         Resetear al procesador
     """
     def __init__(self, toplevel):
@@ -638,56 +619,95 @@ class Source_code(Gtk.Frame):
 
         scroller.add(self.editor)
         self.add(scroller)
-        self.index = {}
+        self.index = {}                 # PC -> fila del listado
+        self.marked = None              # Fila marcada con el PC actual
 
 
     def clear(self):
         """ Borrar el listado del código """
         self.store.clear()
+        self.index.clear()
+        self.marked = None
 
 
-    def append(self, pc, s):
+    def append(self, pc, s, label = ""):
         """ Agrega una linea a la pantalla """
-        self.store.append( ("",
-                            "{:04x}".format(pc),
-                            "",
-                            "{:s}".format(s)) )
+        self.index[pc] = self.store.append( ("",
+                                             "{:04x}".format(pc),
+                                             label,
+                                             s) )
 
 
     def select_at_pc(self, pc):
-        """ Modifica el treeview para mostrar la proxima instrucción """
-        pcs = "{:04x}".format(pc)
-        for row in self.store:
-            row[0] = "▶" if (row[1] == pcs) else ""
+        """ Modifica el treeview para mostrar la proxima instrucción. Solo
+            se cambian la fila marcada antes y la del nuevo PC
+        """
+        if self.marked != None:
+            self.store[self.marked][0] = ""
+        self.marked = self.index.get(pc)
+        if self.marked != None:
+            self.store[self.marked][0] = "▶"
 
 
     def step(self, btn):
         """ Ejecutar un paso de simulación """
-        
-        if (self.toplevel.cpu.reg.get_PC() != self.toplevel.cpu.ROM.mem_start):
-            self.toplevel.exectime.set_time_start()
+        try:
+            self.toplevel.cpu.step()
+        except CPUException:
+            self.program_ended()
+
+        self.toplevel.registers.show_registers()
+        self.select_at_pc(self.toplevel.cpu.reg.get_PC())
+        self.toplevel.exectime.update_time()
+
+
+    def step_back(self, btn):
+        """ Deshacer el ultimo paso (ver history.py) """
+        self.toplevel.cpu.step_back()
 
-        self.toplevel.cpu.step(self.toplevel)
         self.toplevel.registers.show_registers()
         self.select_at_pc(self.toplevel.cpu.reg.get_PC())
+        self.toplevel.exectime.update_time()
 
-        if (self.toplevel.cpu.reg.get_PC() != self.toplevel.cpu.ROM.mem_start):
-            self.toplevel.exectime.set_delta_time()
-            print("START: ", self.toplevel.exectime.get_time_start())
-            print("DELTA_TIME: ", self.toplevel.exectime.get_delta_time())
-            self.toplevel.exectime.update_time(self.toplevel.exectime.get_delta_time().seconds)
 
+    def program_ended(self):
+        """ Se termino el programa: preguntar si se desea reiniciar """
+        dlg = Gtk.Dialog(
+                parent = self.toplevel,
+                title = "Fin del programa",
+                buttons = ("Cancelar", Gtk.ResponseType.CANCEL,
+                            "Aceptar",  Gtk.ResponseType.ACCEPT))
+
+        dlg.set_size_request(250, 50)
+
+        hbox = Gtk.HBox(
+                margin = 10,
+                spacing = 6)
+    
+        hbox.pack_start(Gtk.Label(
+                    "¿Desea reiniciar el programa?"),
+                    True,
+                    False,
+                    0)
+
+        hbox.show_all()
+
+        dlg.get_content_area().add(hbox)                            
+
+        if dlg.run() == Gtk.ResponseType.ACCEPT:
+            self.reset()
+
+        dlg.destroy()
 
 
     def reset(self, btn = None):
-        """ Ejecutar un 'reset': PC buscará vector de inicio en 0xfffe """
+        """ Ejecutar un 'reset': PC toma el vector de inicio (0xfffe) """
         self.toplevel.cpu.reset()
+        self.toplevel.history.clear()
         self.toplevel.registers.show_registers()
-        self.select_at_pc(0xfffe)
+        self.select_at_pc(self.toplevel.cpu.reg.get_PC())
 
-        self.toplevel.exectime.reset_time()
-        self.toplevel.exectime.update_time(0)
-        self.toplevel.exectime.set_time_start()
+        self.toplevel.exectime.update_time()
     
 
 class MainWindow(Gtk.Window):
@@ -699,12 +719,15 @@ class MainWindow(Gtk.Window):
 
         self.cpu = CPU("MSP430iua")             # Modelo CPU
                                                 # ROM: 0xc200..0xffff
+        self.history = History()                # Para volver pasos atras
+        self.history.attach(self.cpu)
         main_menu = Sim_main_menu(self)
         main_menu.add_items_to("File", ((None, None),
                                         ("Open", self.open_intel_file)))
         self.registers = Sim_registers(self, self.cpu.reg.get_registers())
         self.source = Source_code(self)
         self.memedit = Memory_editor(self, self.cpu.ROM)
+        self.disasm = Disassembler(self.cpu.ROM)
         self.tools = Tools(self, "Tools")
 
         self.exectime = ExecutionTime(self)
@@ -740,6 +763,7 @@ class MainWindow(Gtk.Window):
     def create_buttons(self):
         for icon, handler, tooltext in (
                     ("media-playback-start", self.source.step, "Step"),
+                    ("media-skip-backward", self.source.step_back, "Step back"),
                     ("media-seek-backward", self.source.reset, "Reset")):
 
             self.tools.append_button(icon, handler, tooltext)
@@ -757,42 +781,22 @@ class MainWindow(Gtk.Window):
             # Refrescar el contenido del Codigo Fuente
             self.source.clear()                     # Borrar la 'pantalla'
             fname = fc.get_filename()
-            self.cpu.ROM.load_from_intel(fname)     # Carga el archivo en ROM
-
-            instruction_words_list = self.cpu.ROM.get_instruction_words()
-
-            self.memedit.memory_instruction_words_clear()
-
-            self.memedit.set_memory_instruction_words(instruction_words_list)
-
-            # print(self.memedit.get_memory_instruction_words())
-
-            instructions_and_offsets_list = []
-            for word in self.memedit.get_memory_instruction_words():
-                instructions_and_offsets_list.append(word["CONTENT"])
-                if word["OFFSET"] != None:
-                    instructions_and_offsets_list.append(word["OFFSET"])
-
-            dis = Disassembler(self.cpu.ROM)
-            dis_all = dis.disassemble_all()
-
-            for pc, _, s in dis_all:
-                if pc != int("0xfffe", 16) and s.strip() != 'nop' and self.cpu.ROM.load_word_at(pc) in instructions_and_offsets_list:
-                    self.source.append(pc, s)
+            try:
+                symtab = self.cpu.load_program(fname)    # Carga el archivo en ROM
+            except IntelHexException as ex:
+                self.show_error("Error en el archivo HEX", str(ex))
+                fc.destroy()
+                return
 
-            self.memedit.update_rom()
+            self.show_program(symtab)
 
         fc.destroy()
 
 
-    def open_intel_file_without_dialog(self, fname):
-
-        # Refrescar el contenido del Codigo Fuente
-        self.source.clear()                     # Borrar la 'pantalla'
-
-        self.cpu.ROM.load_from_intel(fname)     # Carga el archivo en ROM
-        # print(self.cpu.ROM.dump(0xc200, 1024))
-
+    def show_program(self, symtab = None):
+        """ Muestra el programa cargado en la ROM en el listado, con los
+            nombres de <symtab>
+        """
         instruction_words_list = self.cpu.ROM.get_instruction_words()
 
         self.memedit.memory_instruction_words_clear()
@@ -801,22 +805,47 @@ class MainWindow(Gtk.Window):
 
         # print(self.memedit.get_memory_instruction_words())
 
-        instructions_and_offsets_list = []    
+        instructions_and_offsets = set()
         for word in self.memedit.get_memory_instruction_words():
-            instructions_and_offsets_list.append(word["CONTENT"])
+            instructions_and_offsets.add(word["CONTENT"])
             if word["OFFSET"] != None:
-                instructions_and_offsets_list.append(word["OFFSET"])
-                
-        dis = Disassembler(self.cpu.ROM)
-        dis_all = dis.disassemble_all()
+                instructions_and_offsets.add(word["OFFSET"])
+
+        # El mismo desensamblador en cada apertura: cada uno ocupa un
+        # observador de la ROM, y al cargar otro programa sus lineas
+        # guardadas se descartan solas
+        self.disasm.set_symbols(symtab)
+        load_word_at = self.cpu.ROM.load_word_at
 
-        for pc, _, s in dis_all:
-            if pc != int("0xfffe", 16) and s.strip() != 'nop' and self.cpu.ROM.load_word_at(pc) in instructions_and_offsets_list:
-                self.source.append(pc, s)
+        for pc, _, s in self.disasm.disassemble_all():
+            if pc != 0xfffe and s.strip() != 'nop' and load_word_at(pc) in instructions_and_offsets:
+                self.source.append(pc, s, self.disasm.label(pc))
 
         self.memedit.update_rom()
 
 
+    def show_error(self, title, msg):
+        dlg = Gtk.MessageDialog(
+                parent = self,
+                message_type = Gtk.MessageType.ERROR,
+                buttons = Gtk.ButtonsType.OK,
+                text = title)
+        dlg.format_secondary_text(msg)
+        dlg.run()
+        dlg.destroy()
+
+
+    def open_intel_file_without_dialog(self, fname):
+
+        # Refrescar el contenido del Codigo Fuente
+        self.source.clear()                     # Borrar la 'pantalla'
+
+        symtab = self.cpu.load_program(fname)    # Carga el archivo en ROM
+        # print(self.cpu.ROM.dump(0xc200, 1024))
+
+        self.show_program(symtab)
+
+
 def main():
     mw = MainWindow()
     mw.run()
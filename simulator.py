@@ -22,7 +22,11 @@
 #
 #
 
-from memory import Memory, MemoryException
+from memory import Memory
+from registers import Registers, FLAG_C, FLAG_Z, FLAG_N, FLAG_V
+from timing import CYCLE_TABLE
+from alu import ALU_OPS, NO_WRITEBACK
+from decode import DECODE_TABLE, F_GROUP, F_OPTYPE, F_MNEMONIC, F_AS, F_AD, F_BYTE, F_RS, F_RD, F_OFFSET
 from instructions_utils import simulate_rrc_instruction, simulate_rra_instruction, simulate_push_instruction, simulate_swpb_instruction, simulate_sxt_instruction, simulate_call_instruction
                             
 class Simulator():
@@ -33,6 +37,20 @@ class Simulator():
     def __init__(self, mem, regs):
         self.mem = mem
         self.regs = regs
+        self.registers = regs.get_registers()
+
+        # Contadores de ciclos de MCLK e instrucciones ejecutadas
+        self.cycles = 0
+        self.instructions = 0
+
+        # Rutinas de simulacion, indexadas por el grupo de la instruccion
+        # (ver decode.py). Se enlazan una sola vez, al crear el simulador.
+        self.handlers = (self.opd_single_type1,     # SINGLE1
+                         self.opd_single_type2,     # SINGLE2
+                         self.opd_reti,             # RETI
+                         self.opd_jump,             # JUMP
+                         self.opd_double,           # DOUBLE
+                         self.opd_nop)              # NOP
 
     def one_step(self, addr):
         """ Ejecuta la instruccion ubicada en la memoria ROM en la
@@ -40,53 +58,18 @@ class Simulator():
             Retorna el PC nuevo
         """
         self.addr = addr
-        self.registers = self.regs.get_registers()
 
         opcode = self.mem.load_word_at(self.addr)
         
         if opcode == None:
             return 
         
-        if self.addr >= 0xffc0:          # Estamos en la table de interrupciones?
-            return opcode
-
-        for mask, value, optype, opd in (
-                    (0xff80, 0x1000, self.RRC,     self.opd_single_type1),
-                    (0xff80, 0x1080, self.SWPB,    self.opd_single_type2),
-                    (0xff80, 0x1100, self.RRA,     self.opd_single_type1),
-                    (0xff80, 0x1180, self.SXT,     self.opd_single_type2),
-                    (0xff80, 0x1200, self.PUSH,    self.opd_single_type1),
-                    (0xff80, 0x1280, self.CALL,    self.opd_single_type2),
-                    (0xffff, 0x1300, self.RETI,    self.opd_single_reti),
-
-                    (0xfc00, 0x2000, self.JNZ,     self.opd_jump),
-                    (0xfc00, 0x2400, self.JZ,      self.opd_jump),
-                    (0xfc00, 0x2800, self.JNC,     self.opd_jump),
-                    (0xfc00, 0x2c00, self.JC,      self.opd_jump),
-                    (0xfc00, 0x3000, self.JN,      self.opd_jump),
-                    (0xfc00, 0x3400, self.JGE,     self.opd_jump),
-                    (0xfc00, 0x3800, self.JL,      self.opd_jump),
-                    (0xfc00, 0x3c00, self.JMP,     self.opd_jump),
-
-                    (0xf000, 0x4000, self.MOV,     self.opd_double),
-                    (0xf000, 0x5000, self.ADD,     self.opd_double),
-                    (0xf000, 0x6000, self.ADDC,    self.opd_double),
-                    (0xf000, 0x7000, self.SUBC,    self.opd_double),
-                    (0xf000, 0x8000, self.SUB,     self.opd_double),
-                    (0xf000, 0x9000, self.CMP,     self.opd_double),
-                    (0xf000, 0xa000, self.DADD,    self.opd_double),
-                    (0xf000, 0xb000, self.BIT,     self.opd_double),
-                    (0xf000, 0xc000, self.BIC,     self.opd_double),
-                    (0xf000, 0xd000, self.BIS,     self.opd_double),
-                    (0xf000, 0xe000, self.XOR,     self.opd_double),
-                    (0xf000, 0xf000, self.AND,     self.opd_double),
-
-                    (0x0000, 0x0000, self.NOP,     self.opd_single_reti)):
-
-            if (opcode & mask) == value:
-                self.addr += 2
-                newpc = opd(self.addr, opcode, optype)
-                return newpc
+        self.cycles += CYCLE_TABLE[opcode]
+        self.instructions += 1
+
+        dec = DECODE_TABLE[opcode]
+        self.addr += 2
+        return self.handlers[dec[F_GROUP]](self.addr, opcode, dec)
 
     def opc_register(self, opc):    return opc & 0x000f
     def opc_As(self, opc):          return (opc >> 4) & 0x0003
@@ -97,615 +80,240 @@ class Simulator():
     def opc_suffix(self, opc):      return '.b' if self.opc_Byte(opc) else ''
 
     #
-    #   Instrucciones de simple operando
+    #   Resolucion de operandos
     #
 
-    def opd_single_type1(self, addr, opcode, opcstr):
-        """ Desensamblar instruccion RRC, RRA, PUSH """
-        As = self.opc_As(opcode)
-        Rs = self.opc_source(opcode)
-
-        # Abreviamos el numero de registro
-        regnr = self.opc_register(opcode)
-
-        # Acordarse del estado del CY en ST
-        cy = self.regs.get_SR('C')
-
-        if As == 0:                                             # modo por registro
-
-            if opcstr == 0: # Instruccion RRC.w o RRC.b
-                simulate_rrc_instruction(self, regnr, opcode)
-            elif opcstr == 2: # Instruccion RRA.w o RRA.b
-                simulate_rra_instruction(self, regnr, opcode)
-            elif opcstr == 4: # Instruccion PUSH.w o PUSH.b
-                simulate_push_instruction(self, regnr, opcode)
-
+    def src_operand(self, As, reg, byte, addr):
+        """ Resuelve el operando fuente (o el unico operando en las
+            instrucciones de simple operando) segun el modo <As>:
+                0   Rn          (R3: constante 0)
+                1   X(Rn)       (R2: &X absoluto, R0: simbolico, R3: #1)
+                2   @Rn         (R2: #4, R3: #2)
+                3   @Rn+        (R2: #8, R3: #-1, R0: #N inmediato)
+            <addr> es la direccion de la proxima palabra de extension.
+            Retorna (valor, direccion efectiva, addr):
+                la direccion efectiva es None si el operando no esta en
+                memoria (registro o constante), y addr queda apuntando
+                despues de las palabras de extension usadas.
+            Nunca lanza excepciones: la memoria se lee sin controlar
+            si fue inicializada.
+        """
+        regs = self.registers
+        mem = self.mem
+
+        if As == 0:
+            if reg == 3:
+                return 0, None, addr
+            value = addr if reg == 0 else regs[reg]
+            return (value & 0xff if byte else value), None, addr
+
+        elif As == 1:
+            if reg == 3:
+                return 1, None, addr
+            x = mem.read_word(addr)
+            if reg == 2:                                # &X absoluto
+                ea = x
+            elif reg == 0:                              # X(PC) simbolico
+                ea = (addr + x) & 0xffff
+            else:
+                ea = (regs[reg] + x) & 0xffff
+            addr += 2
+
+        elif As == 2:
+            if reg == 2:
+                return 4, None, addr
+            if reg == 3:
+                return 2, None, addr
+            ea = addr if reg == 0 else regs[reg]
+
+        else:
+            if reg == 2:
+                return 8, None, addr
+            if reg == 3:
+                return (0xff if byte else 0xffff), None, addr
+            if reg == 0:                                # #N inmediato
+                value = mem.read_word(addr)
+                return (value & 0xff if byte else value), None, addr + 2
+            ea = regs[reg]
+            # SP siempre se incrementa de a 2, para mantenerlo par
+            regs[reg] = (ea + (1 if byte and reg != 1 else 2)) & 0xffff
+
+        if byte:
+            return mem.read_byte(ea), ea, addr
+        return mem.read_word(ea), ea, addr
+
+
+    def dst_operand(self, Ad, reg, byte, addr, need_value = True):
+        """ Resuelve el operando destino segun el modo <Ad>:
+                0   Rn
+                1   X(Rn)       (R2: &X absoluto, R0: simbolico)
+            Retorna (valor, direccion efectiva, addr), como src_operand.
+            Si no <need_value> (MOV), la memoria no se lee y el valor es
+            None: leer un registro de un periferico puede tener efectos.
+        """
+        if Ad == 0:
+            value = addr if reg == 0 else self.registers[reg]
+            return (value & 0xff if byte else value), None, addr
+
+        x = self.mem.read_word(addr)
+        if reg == 2:                                    # &X absoluto
+            ea = x
+        elif reg == 0:                                  # X(PC) simbolico
+            ea = (addr + x) & 0xffff
+        elif reg == 3:
+            ea = x
+        else:
+            ea = (self.registers[reg] + x) & 0xffff
+
+        if not need_value:
+            return None, ea, addr + 2
+        if byte:
+            return self.mem.read_byte(ea), ea, addr + 2
+        return self.mem.read_word(ea), ea, addr + 2
+
+
+    def write_result(self, reg, ea, value, byte, addr):
+        """ Escribe <value> en la direccion <ea> o, si <ea> es None, en el
+            registro <reg>. Las operaciones de byte en registros borran
+            los bits 8..15. Las escrituras a R3 (CG2) se ignoran.
+            Retorna el PC nuevo: <addr>, o <value> si se escribio el PC.
+        """
+        if ea != None:
+            if byte:
+                self.mem.write_byte(ea, value)
+            else:
+                self.mem.write_word(ea, value)
             return addr
 
-        elif As== 1:                                            # modo indexado
-        #debo buscar lo que hay en la dirección + x lugares, que diga regnr, en memoria, y luego setearlo en regnr
-            if opcstr == 0: # Instruccion RRC.w o RRC.b
-                cy = None
-                sumacontenidomemoria = None
-                try:
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rrc_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-
-            elif opcstr == 2: # Instruccion RRA.w o RRA.b
-                sumacontenidomemoria = None
-                try:                
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rra_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_rra_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-
-                        simulate_rra_instruction(self, regnr, opcode)
-
-            elif opcstr == 4: # Instruccion PUSH.w o PUSH.b
-                sumacontenidomemoria = None
-                try:
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_push_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_push_instruction(self, regnr, opcode)
-
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-                        
-                        simulate_push_instruction(self, regnr, opcode)
-
-            return addr+2
-    
-        elif As == 2:                                            # modo indirecto por registro
-            if opcstr == 0: # Instruccion RRC.w o RRC.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rrc_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-
-            elif opcstr == 2: # Instruccion RRA.w o RRA.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rra_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-                        
-                        simulate_rra_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
+        value &= 0xff if byte else 0xffff
+        if reg == 0:
+            self.registers[0] = value
+            return value
+        if reg != 3:
+            self.registers[reg] = value
+        return addr
 
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-                        
-                        simulate_rra_instruction(self, regnr, opcode)
-
-            elif opcstr == 4: # Instruccion PUSH.w o PUSH.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    print(self.mem.dump(self.regs.get(regnr), 32))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_push_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        print(self.mem.dump(self.regs.get(regnr), 32))
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_push_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        print(self.mem.dump(self.mem.mem_start + self.regs.get(regnr), 32))
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_push_instruction(self, regnr, opcode)
-            
-            if self.mem.load_byte_at(addr) != None:
-                return addr
-
-        elif As== 3:                                            # modo indirecto autoincrementado
-
-            if opcstr == 0: # Instruccion RRC.w o RRC.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rrc_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_rrc_instruction(self, regnr, opcode)
-                finally:
-                    if self.opc_Byte(opcode):
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0001)
-                    else:
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
-
-            elif opcstr == 2: # Instruccion RRA.w o RRA.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_rra_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_rra_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_rra_instruction(self, regnr, opcode)
-                finally:
-                    if self.opc_Byte(opcode):
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0001)
-                    else:
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
-
-            elif opcstr == 4: # Instruccion PUSH.w o PUSH.b
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_push_instruction(self, regnr, opcode)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_push_instruction(self, regnr, opcode)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_push_instruction(self, regnr, opcode)
-                finally:
-                    if self.opc_Byte(opcode):
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0001)
-                    else:
-                        self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
-
-            if self.mem.load_byte_at(addr) != None:
-                return addr
-
-
-
-    def opd_single_type2(self, addr, opcode, opcstr):
-        """ Desensamblar instruccion SWPB, SXT, CALL """
-        As = self.opc_As(opcode)
-
-        # Abreviamos el numero de registro
-        regnr = self.opc_register(opcode)
-
-        # Acordarse del estado del CY en ST
-        cy = self.regs.get_SR('C')
+    #
+    #   Instrucciones de simple operando
+    #
 
-        if As == 0:                                             # modo por registro
+    def opd_single_type1(self, addr, opcode, dec):
+        """ Simular instruccion RRC, RRA, PUSH """
+        optype, As, byte, regnr = dec[F_OPTYPE], dec[F_AS], dec[F_BYTE], dec[F_RD]
 
-            if opcstr == 1:     # INSTRUCCION SWPB
-                simulate_swpb_instruction(self, regnr)
-            elif opcstr == 3:   # INSTRUCCION SXT
-                simulate_sxt_instruction(self, regnr, True)
-            elif opcstr == 5:   # INSTRUCCION CALL
-                simulate_call_instruction(self, regnr)
-                return self.regs.get(0)
+        value, ea, addr = self.src_operand(As, regnr, byte, addr)
 
+        if optype == self.PUSH:
+            simulate_push_instruction(self, value, byte)
             return addr
-        elif As == 1:                                           # modo indexado
-            if opcstr == 1: # INSTRUCCION SWPB                
-                sumacontenidomemoria = None
-                try:
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_swpb_instruction(self, regnr)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_swpb_instruction(self, regnr)        
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-
-                        simulate_swpb_instruction(self, regnr)
-
-            elif opcstr == 3: # INSTRUCCION SXT
-                sumacontenidomemoria = None
-                try:
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_sxt_instruction(self, regnr)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_sxt_instruction(self, regnr)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-
-                        simulate_sxt_instruction(self, regnr)
-            
-            elif opcstr == 5: # INSTRUCCION CALL
-                sumacontenidomemoria = None
-                try:
-                    sumacontenidomemoria = self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    if (sumacontenidomemoria >= 0xffc0): # estamos en la tabla de interrupciones
-                        sumacontenidomemoria = self.regs.get(regnr) + self.mem.load_word_at(addr)
-
-                    contenido_memoria = self.mem.load_word_at(sumacontenidomemoria)
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_call_instruction(self, regnr)
-
-                    return self.regs.get(0)
-
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(sumacontenidomemoria, 0xabcd)
-
-                        self.regs.set(regnr, self.mem.load_word_at(sumacontenidomemoria))
-
-                        simulate_call_instruction(self, regnr)
-
-                        return self.regs.get(0)
-
-                    elif "Direccion fuera de rango" in str(ex):                    
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr), 0xabcd)
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr) + self.mem.load_word_at(addr)))
-
-                        simulate_call_instruction(self, regnr)
-
-                        return self.regs.get(0)
-
-            return addr+2
-        elif As == 2:                                           # modo indirecto por registro
-
-            if opcstr == 1: # INSTRUCCION SWPB
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_swpb_instruction(self, regnr)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_swpb_instruction(self, regnr)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_swpb_instruction(self, regnr)
-
-            elif opcstr == 3: # INSTRUCCION SXT
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_sxt_instruction(self, regnr)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_sxt_instruction(self, regnr)
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_sxt_instruction(self, regnr)
-
-            elif opcstr == 5: # INSTRUCCION CALL
 
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    print(self.mem.dump(self.regs.get(regnr), 32))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_call_instruction(self, regnr)
-  
-                    return self.regs.get(0)
-
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        print(self.mem.dump(self.regs.get(regnr), 32))
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_call_instruction(self, regnr)
-
-                        return self.regs.get(0)
-
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        print(self.mem.dump(self.mem.mem_start + self.regs.get(regnr), 32))
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_call_instruction(self, regnr)
-
-                        return self.regs.get(0)
+        if optype == self.RRC:
+            result = simulate_rrc_instruction(self, value, byte)
+        else:
+            result = simulate_rra_instruction(self, value, byte)
 
+        # Los modos con constantes o inmediatos no tienen donde escribir
+        if As != 0 and ea == None:
             return addr
-        elif As == 3:                                           # modo indirecto autoincrementado
-
-            if opcstr == 1: # INSTRUCCION SWPB
-
-                try:                    
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    self.regs.set(regnr, contenido_memoria)
-
-                    simulate_swpb_instruction(self, regnr)
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
-
-                        simulate_swpb_instruction(self, regnr)                    
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
-
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_swpb_instruction(self, regnr)
-                finally:
-                    self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
-
-            elif opcstr == 3: # INSTRUCCION SXT
+        return self.write_result(regnr, ea, result, byte, addr)
 
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
 
-                    self.regs.set(regnr, contenido_memoria)
+    def opd_single_type2(self, addr, opcode, dec):
+        """ Simular instruccion SWPB, SXT, CALL """
+        optype, As, regnr = dec[F_OPTYPE], dec[F_AS], dec[F_RD]
 
-                    simulate_sxt_instruction(self, regnr)
-                
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
+        value, ea, addr = self.src_operand(As, regnr, False, addr)
 
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
+        if optype == self.CALL:
+            return simulate_call_instruction(self, value, addr)
 
-                        simulate_sxt_instruction(self, regnr)
-                    
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
+        if optype == self.SWPB:
+            result = simulate_swpb_instruction(self, value)
+        else:
+            result = simulate_sxt_instruction(self, value)
 
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
-
-                        simulate_sxt_instruction(self, regnr)
-                    
-                finally:
-                    self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
-
-            elif opcstr == 5: # INSTRUCCION CALL
-
-                try:
-                    contenido_memoria = self.mem.load_word_at(self.regs.get(regnr))
-
-                    print(self.mem.dump(self.regs.get(regnr), 32))
-
-                    self.regs.set(regnr, contenido_memoria)
+        if As != 0 and ea == None:
+            return addr
+        return self.write_result(regnr, ea, result, False, addr)
 
-                    simulate_call_instruction(self, regnr)
-                    
-                    return self.regs.get(0)
 
-                except MemoryException as ex:
-                    if "Lectura de memoria no inicializada" in str(ex):
-                        self.mem.store_word_at(self.regs.get(regnr), 0xABCD)
 
-                        print(self.mem.dump(self.regs.get(regnr), 32))
+    def opd_reti(self, addr, opcode, dec):
+        """ Simular instruccion RETI: desapila el SR y el PC (ver
+            interrupts.py)
+        """
+        regs = self.registers
+        sp = regs[Registers.SP]
+        regs[Registers.SR] = self.mem.read_word(sp)
+        pc = self.mem.read_word((sp + 2) & 0xffff)
+        regs[Registers.SP] = (sp + 4) & 0xffff
+        return pc
 
-                        self.regs.set(regnr, self.mem.load_word_at(self.regs.get(regnr)))
 
-                        simulate_call_instruction(self, regnr)
-                        
-                        return self.regs.get(0)
+    def opd_nop(self, addr, opcode, dec):
+        """ Opcodes que no corresponden a ninguna instruccion: no hacen nada """
+        return addr
 
-                    elif "Direccion fuera de rango" in str(ex):
-                        self.mem.store_word_at(self.mem.mem_start + self.regs.get(regnr), 0xABCD)
+    #
+    #   Instrucciones de doble operando
+    #
 
-                        print(self.mem.dump(self.mem.mem_start + self.regs.get(regnr), 32))
+    def opd_double(self, addr, opcode, dec):
+        """ Simular instrucciones de doble operando (MOV ... AND) """
+        optype, byte, rd = dec[F_OPTYPE], dec[F_BYTE], dec[F_RD]
 
-                        self.regs.set(regnr, self.mem.load_word_at(self.mem.mem_start + self.regs.get(regnr)))
+        src, _, addr = self.src_operand(dec[F_AS], dec[F_RS], byte, addr)
+        if optype == Simulator.MOV:
+            _, ea, addr = self.dst_operand(dec[F_AD], rd, byte, addr, False)
+            return self.write_result(rd, ea, src, byte, addr)
 
-                        simulate_call_instruction(self, regnr)
-                        
-                        return self.regs.get(0)
+        dst, ea, addr = self.dst_operand(dec[F_AD], rd, byte, addr)
 
-                finally:
-                    self.regs.set(regnr, self.regs.get(regnr) + 0x0002)
+        result, sr = ALU_OPS[optype](src, dst, self.registers[Registers.SR], byte)
+        self.registers[Registers.SR] = sr
 
+        if NO_WRITEBACK[optype]:
             return addr
-
-
-
-    def opd_single_reti(self, addr, opcode, opcstr):
-        """ Desensamblar instruccion RETI """
-        return "%-8s" % (opcstr)
-
-    #
-    #   Instrucciones de doble operando
-    #
-
-    def opd_double(self, addr, opcode, opcstr):
-        pass
-        """En grupos"""
+        return self.write_result(rd, ea, result, byte, addr)
 
     #
     #   Instrucciones de salto (condicional)
     #
 
-    def opd_jump(self, addr, opcode, optype):
+    def opd_jump(self, addr, opcode, dec):
         """ Simular instrucciones de salto """
+        optype = dec[F_OPTYPE]
 
-        offset = (opcode & 0x03ff) - 1    # salto se calcula desde la direccion
-                                          # del opcode (addr ya fue incrementado!)
-        if (offset & 0x0200) != 0:        # Positivo
-            offset |= 0xfe00
-        addr1 = (addr + 2*offset) & 0xffff
+        # El salto se calcula desde la direccion siguiente al opcode
+        # (addr ya fue incrementado!)
+        addr1 = (addr + 2*dec[F_OFFSET]) & 0xffff
 
         if optype == self.JMP:
             return addr1
 
-        elif optype == self.JNZ:
-            return addr1 if not self.regs.get_SR('Z') else addr
+        sr = self.registers[Registers.SR]
+
+        if optype == self.JNZ:
+            return addr1 if not sr & FLAG_Z else addr
 
         elif optype == self.JZ:
-            return addr1 if self.regs.get_SR('Z') else addr
+            return addr1 if sr & FLAG_Z else addr
 
         elif optype == self.JC:
-            return addr1 if self.regs.get_SR('C') else addr
+            return addr1 if sr & FLAG_C else addr
 
         elif optype == self.JNC:
-            return addr1 if not self.regs.get_SR('C') else addr
+            return addr1 if not sr & FLAG_C else addr
 
         elif optype == self.JN:
-            return addr1 if self.regs.get_SR('N') else addr
+            return addr1 if sr & FLAG_N else addr
 
+        # La operacion != es el equivalente de una XOR
         elif optype == self.JL:
-            # La operacion != es el equivalente de una XOR
-            if (self.regs.get_SR('N') != self.regs.get_SR('V')): return addr1
-            else: return addr
+            return addr1 if (sr & FLAG_N != 0) != (sr & FLAG_V != 0) else addr
 
         elif optype == self.JGE:
-            # La operacion != es el equivalente de una XOR
-            if not (self.regs.get_SR('N') != self.regs.get_SR('V')): return addr1
-            else: return addr
+            return addr1 if (sr & FLAG_N != 0) == (sr & FLAG_V != 0) else addr
 
 
     def disassemble(self, start, end):
@@ -724,7 +332,7 @@ class Simulator():
             algo útil con <pc> y <s>  (<s> es el opcode desensamblado)
         """
         pc = self.mem.mem_start
-        while pc < (self.mem.mem_start + self.mem.mem_size):
+        while pc < (self.mem.mem_size):
             if self.mem.load_word_at(pc) == None:
                 pc += 2
                 continue
@@ -734,8 +342,6 @@ class Simulator():
 
 
 def main():
-    from registers import Registers
-
     m = Memory(1024, mem_start = 0xfc00)
     r = Registers()
     s = Simulator(m, r)
@@ -751,10 +357,7 @@ def main():
 
     print(str(m))
 
-    newpc = s.one_step(0xfffe)
-    print("%04x" % newpc)
-
-    newpc = s.one_step(newpc)
+    newpc = s.one_step(m.load_word_at(0xfffe))
     print("%04x" % newpc)
 
     return 0
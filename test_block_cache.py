@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_block_cache.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas del cache de bloques (block_cache.py): ejecutar con y sin el
+    cache tiene que dar el mismo resultado. Se corren con pytest, o
+    directamente (main).
+"""
+
+import sys
+import random
+
+from cpu import CPU
+from registers import FLAG_C, FLAG_N
+
+
+def run_both(words, start, count):
+    """ Ejecuta <count> instrucciones del programa <words> (cargado en
+        <start>, en la RAM o la ROM) con y sin el cache. Retorna los dos
+        estados finales.
+    """
+    results = []
+    for use_cache in (True, False):
+        c = CPU()
+        region = c.RAM if start < c.ROM.mem_start else c.ROM
+        region.store_words_at(start, words)
+        c.ROM.store_word_at(0xfffe, start)
+        c.reset()
+        c.run(count, use_cache = use_cache)
+        results.append((list(c.reg.get_registers()), c.cycles(), c.instructions()))
+    return results
+
+
+def test_self_modifying_block():
+    """ Una escritura sobre una instruccion posterior del mismo bloque:
+        el resto del bloque no se ejecuta traducido con el codigo viejo
+    """
+    cached, interpreted = run_both([
+                0x9306,                     # cmp   #0, R6 (SR no nulo)
+                0x40b2, 0x5316, 0x022c,     # mov   #0x5316, &0x022c
+                0x5315,                     # inc   R5
+                0x5315,                     # inc   R5
+                0x5317,                     # inc   R7 (pasa a ser inc R6)
+                0x3fff],                    # jmp   $
+                0x0220, 20)
+    assert interpreted[0][6] == 1 and interpreted[0][7] == 0
+    assert cached == interpreted
+
+
+def test_byte_operation_on_pc():
+    """ En una operacion de byte el PC destino tambien se recorta """
+    cached, interpreted = run_both([
+                0x9070, 0x0005,             # cmp.b #5, PC (PC = 0xc204)
+                0x3fff],                    # jmp   $
+                0xc200, 2)
+    assert interpreted[0][2] & (FLAG_N | FLAG_C) == FLAG_N
+    assert cached == interpreted
+
+
+DOUBLE_OPS = range(4, 16)                   # MOV .. AND
+
+def random_program(rng, data, data_words):
+    """ Programa al azar de instrucciones de doble y simple operando y
+        saltos cortos, con operandos en registros, inmediatos y absolutos
+        (en <data>, <data_words> palabras). Termina en jmp $.
+    """
+    words = [0x4031, 0x0400]                # mov   #0x400, SP
+    for i in range(40):
+        op = rng.choice(DOUBLE_OPS) << 12
+        rs, rd, byte = rng.randrange(4, 16), rng.randrange(4, 16), rng.randrange(2) << 6
+        kind = rng.randrange(6)
+        if kind == 0:                       # Rs, Rd
+            words.append(op | rs << 8 | byte | rd)
+        elif kind == 1:                     # #N, Rd
+            words += [op | 0x0030 | byte | rd, rng.randrange(0x10000)]
+        elif kind == 2:                     # Rs, &X
+            words += [op | rs << 8 | 0x0080 | byte | 2, data + 2*rng.randrange(data_words)]
+        elif kind == 3:                     # &X, Rd
+            words += [op | 0x0210 | byte | rd, data + 2*rng.randrange(data_words)]
+        elif kind == 4:                     # RRC, SWPB, RRA, SXT, PUSH
+            t = rng.randrange(5)
+            words.append(0x1000 | t << 7 | (byte if t in (0, 2, 4) else 0) | rd)
+        else:                               # Salto condicional a la siguiente
+            words.append(rng.choice((0x2000, 0x2400, 0x2800, 0x2c00, 0x3000, 0x3400, 0x3800)))
+        if rng.random() < 0.2:              # Constantes de R3
+            words.append(op | 0x0300 | rng.randrange(4) << 4 | byte | rd)
+    words.append(0x3fff)                    # jmp   $
+    return words
+
+
+def run_random(words, start, ram, regs, use_cache, count):
+    c = CPU()
+    c.RAM.store_bytes_at(c.RAM.mem_start, ram)
+    region = c.RAM if start < c.ROM.mem_start else c.ROM
+    region.store_words_at(start, words)
+    c.ROM.store_word_at(0xfffe, start)
+    c.reset()
+    for r in range(4, 16):
+        c.reg.set(r, regs[r])
+    result = c.run(count, use_cache = use_cache)
+    return (result.reason, list(c.reg.get_registers()), c.cycles(),
+            c.instructions(), bytes(c.RAM.mem))
+
+
+def test_random_programs():
+    """ Programas al azar, en la ROM y en la RAM. En la RAM escriben
+        sobre su propio codigo
+    """
+    for seed in range(256):
+        rng = random.Random(seed)
+        in_ram = seed & 1
+        start = 0x0280 if in_ram else 0xc200
+        words = random_program(rng, 0x0200, 0x100 if in_ram else 0x40)
+        ram = bytes(rng.randrange(256) for i in range(0x400))
+        regs = [rng.randrange(0x10000) for r in range(16)]
+
+        cached = run_random(words, start, ram, regs, True, 1000)
+        interpreted = run_random(words, start, ram, regs, False, 1000)
+        assert cached == interpreted, seed
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_devices.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de los perifericos (devices.py) y del Scheduler. Se corren
+    con pytest, o directamente (main).
+"""
+
+import sys
+
+from cpu import CPU, Run_result
+from devices import standard_devices, Watchdog
+
+
+def cpu_with_devices(words, start = 0xc200):
+    c = CPU()
+    for dev in standard_devices():
+        c.add_peripheral(dev)
+    c.ROM.store_words_at(start, words)
+    c.ROM.store_word_at(0xfffe, start)
+    c.RAM.store_word_at(0x0200, 0)
+    c.reset()
+    return c
+
+
+def test_reset_loads_vector():
+    """ El reset deja el PC en el vector: el primer paso ya es la
+        primera instruccion del programa
+    """
+    c = CPU()                               # Sin reset explicito
+    assert c.reg.get_PC() == 0xc200
+    assert c.run(5).reason == Run_result.END    # ROM vacia
+
+    c = cpu_with_devices([0x5315])          # inc   R5
+    assert c.reg.get_PC() == 0xc200
+    c.step()
+    assert c.reg.get_PC() == 0xc202
+    assert c.instructions() == 1 and c.reg.get_registers()[5] == 1
+
+
+def test_watchdog_resets_repeatedly():
+    """ Sin detener el watchdog, cada intervalo provoca un PUC """
+    for use_cache in (True, False):
+        c = cpu_with_devices([
+                    0x5392, 0x0200,         # inc   &0x0200 (cuenta los PUC)
+                    0x3fff])                # jmp   $
+        result = c.run(max_cycles = 1200000, use_cache = use_cache)
+
+        interval = Watchdog.INTERVALS[0]
+        starts = c.RAM.load_word_at(0x0200)
+        assert abs(starts - (1 + result.cycles // interval)) <= 1
+        assert 1200000 <= result.cycles < 1200000 + 16
+
+
+def test_puc_during_instruction():
+    """ Una escritura en WDTCTL sin la clave provoca un PUC: la
+        instruccion siguiente no se ejecuta, tampoco dentro de un bloque
+        (el acceso es indirecto, asi que no empieza un bloque)
+    """
+    results = []
+    for use_cache in (True, False):
+        c = cpu_with_devices([
+                    0x4037, 0x0120,         # mov   #WDTCTL, R7
+                    0x5316,                 # inc   R6
+                    0x4687, 0x0000,         # mov   R6, 0(R7) (sin clave: PUC)
+                    0x5315,                 # inc   R5 (nunca)
+                    0x3fff])                # jmp   $
+        c.run(300, use_cache = use_cache)
+        regs = list(c.reg.get_registers())
+        assert regs[5] == 0
+        assert regs[6] > 50
+        results.append((regs, c.cycles()))
+    assert results[0] == results[1]
+
+
+def test_watch_peripheral_write():
+    """ Un watchpoint de escritura sobre un registro de periferico se
+        detiene luego de la instruccion que escribe
+    """
+    from breakpoints import Breakpoints
+
+    c = cpu_with_devices([
+                0x40f2, 0x0001, 0x0021,     # mov.b #1, &P1OUT
+                0x5315,                     # inc   R5
+                0x3fff])                    # jmp   $
+    bp = Breakpoints()
+    bp.attach(c)
+    bp.watch(0x0021, 1, Breakpoints.WRITE)
+    result = c.run(100)
+    assert result.reason == Run_result.WATCH
+    assert bp.hit == (0x0021, 1, Breakpoints.WRITE)
+    assert result.pc == 0xc206 and c.bus.read_byte(0x0021) == 1
+
+    # Sin el watchpoint la pagina deja de avisar
+    bp.unwatch(0x0021)
+    assert c.run(100).reason == Run_result.LIMIT
+    assert c.peripherals.watched[0] == 0
+
+
+# Timer_A en modo up (TACCR0 = 100) interrumpiendo un lazo
+TIMER_PROGRAM = [
+            0x4031, 0x0400,             # mov   #0x400, SP
+            0x40b2, 0x5a80, 0x0120,     # mov   #WDTPW+WDTHOLD, &WDTCTL
+            0x40b2, 0x0064, 0x0172,     # mov   #100, &TACCR0
+            0x40b2, 0x0010, 0x0162,     # mov   #CCIE, &TACCTL0
+            0x40b2, 0x0210, 0x0160,     # mov   #TASSEL_2+MC_1, &TACTL
+            0xd232,                     # eint
+            0x531e,                     # loop: inc R14
+            0x3ffe,                     # jmp   loop
+            0x531f,                     # isr:  inc R15
+            0x4f82, 0x0200,             # mov   R15, &0x0200
+            0x1300]                     # reti
+
+def timer_cpu():
+    c = cpu_with_devices(TIMER_PROGRAM)
+    c.ROM.store_word_at(0xfff2, 0xc222)
+    return c
+
+
+def test_timer_interrupt_rate():
+    """ En modo up el timer cuenta de 0 a TACCR0: una interrupcion cada
+        101 ciclos, con y sin el cache
+    """
+    for use_cache in (True, False):
+        c = timer_cpu()
+        c.run(max_cycles = 101 * 1000 + 50, use_cache = use_cache)
+        assert c.reg.get_registers()[15] == 1000
+        assert c.RAM.load_word_at(0x0200) == 1000
+
+
+def machine_state(c):
+    return (list(c.reg.get_registers()), c.cycles(), c.instructions(),
+            c.RAM.load_word_at(0x0200), c.bus.read_word(0x0170),
+            c.interrupts.pending)
+
+
+def test_snapshot_restores_devices():
+    """ Volver a una instantanea y seguir da lo mismo que no haber
+        vuelto: incluye el timer, sus eventos y las interrupciones
+    """
+    c = timer_cpu()
+    c.run(2000)
+    snap = c.snapshot()
+    c.run(3000)
+    expected = machine_state(c)
+    assert expected[0][15] > 10
+
+    c.run(1000)
+    c.restore(snap)
+    c.run(3000)
+    assert machine_state(c) == expected
+
+
+def test_profiler_interrupt_frames():
+    """ La rutina de interrupcion es un marco propio en el profiler, y
+        el RETI no desapila al codigo interrumpido
+    """
+    from profiler import Profiler
+
+    c = timer_cpu()
+    prof = Profiler()
+    prof.attach(c)
+    c.run(3000)
+    assert prof.stacks[(None, 0xc222)] > 0
+    assert prof.stack in ((None,), (None, 0xc222))
+    assert prof.cycles == c.cycles()
+
+
+def test_step_back_with_devices():
+    from history import History
+
+    c = timer_cpu()
+    hist = History(interval = 500)
+    hist.attach(c)
+    c.run(4000)
+    expected = machine_state(c)
+    c.run(1000)
+    assert c.step_back(1000) == 1000
+    assert machine_state(c) == expected
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_disasm.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de disasm.py. Se corren con pytest, o directamente (main).
+"""
+
+import sys
+
+from memory import Memory
+from disasm import Disassembler
+
+
+def test_uninitialized_extension_word():
+    """ Un tramo que termina en medio de una instruccion no aborta el
+        listado: la palabra que falta se muestra como '?'
+    """
+    m = Memory(1024, mem_start = 0xfc00)
+    m.store_words_at(0xfd00, [0x4303,       # nop
+                              0x4031])      # mov   #?, SP
+    m.store_word_at(0xfffe, 0xfd00)
+    dis = Disassembler(m)
+    lines = list(dis.disassemble_all())
+    assert lines[1] == (0xfd02, 0xfd06, "mov     #?, R1")
+
+    # Al escribir la palabra, la linea se vuelve a decodificar
+    m.store_word_at(0xfd04, 0x0400)
+    lines = list(dis.disassemble_all())
+    assert lines[1] == (0xfd02, 0xfd06, "mov     #1024, R1")
+
+
+def test_extension_word_past_end():
+    m = Memory(1024, mem_start = 0x0200)
+    m.store_word_at(0x05fe, 0x4031)
+    assert list(Disassembler(m).disassemble_all()) == [
+                (0x05fe, 0x0602, "mov     #?, R1")]
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_gdbstub.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de gdbstub.py: una sesion RSP minima sobre un socket local,
+    como la haria gdb. Se corren con pytest, o directamente (main).
+"""
+
+import sys
+import asyncio
+
+from cpu import CPU
+from gdbstub import Gdb_server, checksum, unescape
+
+
+def test_unescape():
+    assert unescape(b"a}\x5db") == b"a}b"
+    try:
+        unescape(b"ab}")
+        assert False, "unescape deberia fallar"
+    except ValueError:
+        pass
+
+
+class Client():
+    """ Lado de gdb de la conexion """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, data, cs = None):
+        if cs == None:
+            cs = checksum(data)
+        self.writer.write(b"$" + data + b"#%02x" % cs)
+        await self.writer.drain()
+        return await self.reader.readexactly(1)
+
+    async def reply(self):
+        data = await self.reader.readuntil(b"#")
+        cs = await self.reader.readexactly(2)
+        assert data[:1] == b"$" and int(cs, 16) == checksum(data[1:-1])
+        return data[1:-1]
+
+    async def packet(self, data):
+        assert await self.send(data) == b"+"
+        return await self.reply()
+
+
+async def session():
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,         # mov   #0x400, SP
+                0x5315,                 # inc   R5
+                0x5315,                 # inc   R5
+                0x3fff])                # jmp   $
+    c.ROM.store_word_at(0xfffe, 0xc200)
+    c.reset()
+
+    server = await asyncio.start_server(Gdb_server(c).handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    gdb = Client(*await asyncio.open_connection("127.0.0.1", port))
+
+    assert b"swbreak+" in await gdb.packet(b"qSupported:swbreak+")
+    assert await gdb.packet(b"?") == b"S05"
+    assert (await gdb.packet(b"g"))[:4] == b"00c2"
+
+    # Suma de control erronea: NAK, y el paquete se descarta
+    assert await gdb.send(b"g", cs = 0) == b"-"
+
+    # Memoria, con y sin escapes ('}' al final es un error)
+    assert await gdb.packet(b"M300,2:3412") == b"OK"
+    assert await gdb.packet(b"X302,2:}\x5d\x01") == b"OK"
+    assert await gdb.packet(b"m300,4") == b"34127d01"
+    assert await gdb.packet(b"X300,1:}") == b"E01"
+    assert await gdb.packet(b"m300,2") == b"3412"
+
+    # Breakpoint, continuar y paso
+    assert await gdb.packet(b"Z0,c206,2") == b"OK"
+    assert await gdb.packet(b"c") == b"T05swbreak:;"
+    assert await gdb.packet(b"p0") == b"06c2"
+    assert await gdb.packet(b"p5") == b"0100"
+    assert await gdb.packet(b"s") == b"S05"
+    assert await gdb.packet(b"p5") == b"0200"
+
+    assert await gdb.packet(b"k") == b"OK"
+    gdb.writer.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_session():
+    asyncio.run(asyncio.wait_for(session(), 10))
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
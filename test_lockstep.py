@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_lockstep.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de lockstep.py: cada carril termina igual que el CPU, con
+    y sin el cache de bloques. Se corren con pytest, o directamente
+    (main). Requiere NumPy.
+"""
+
+import sys
+import random
+
+from cpu import CPU
+from lockstep import Lockstep_simulator
+from test_block_cache import random_program
+
+LANES = 4
+
+
+def load_cpu(words, ram):
+    c = CPU()
+    c.RAM.store_bytes_at(c.RAM.mem_start, ram)
+    c.ROM.store_words_at(0xc200, words)
+    c.ROM.store_word_at(0xfffe, 0xc200)
+    c.reset()
+    return c
+
+
+def test_random_programs():
+    for seed in range(32):
+        rng = random.Random(seed)
+        words = random_program(rng, 0x0200, 0x40)
+        ram = bytes(rng.randrange(256) for i in range(0x400))
+        regs = [[rng.randrange(0x10000) for r in range(16)] for lane in range(LANES)]
+        srs = [rng.randrange(0x200) & 0x107 for lane in range(LANES)]
+
+        lanes = Lockstep_simulator(load_cpu(words, ram), LANES)
+        for r in range(4, 16):
+            lanes.set_register(r, [regs[lane][r] for lane in range(LANES)])
+        lanes.set_register(2, srs)
+        lanes.run(2000)
+        assert lanes.halted.all(), seed
+
+        end = 0xc200 + 2 * (len(words) - 1)             # jmp $
+        for lane in range(LANES):
+            expected = ([int(x) for x in lanes.regs[lane]], int(lanes.cycles[lane]),
+                        int(lanes.instructions[lane]), bytes(lanes.mem[lane, 0x0200:0x0600]))
+            for use_cache in (True, False):
+                c = load_cpu(words, ram)
+                for r in range(4, 16):
+                    c.reg.set(r, regs[lane][r])
+                c.reg.set(2, srs[lane])
+                c.run(2000, until = end, use_cache = use_cache)
+                assert (list(c.reg.get_registers()), c.cycles(), c.instructions(),
+                        bytes(c.RAM.mem)) == expected, (seed, lane, use_cache)
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_memory.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de memory.py. Se corren con pytest, o directamente (main).
+"""
+
+import os
+import sys
+import tempfile
+
+from memory import Memory, MemoryException, IntelHexException, MAX_WATCHERS
+
+
+def test_watcher_bits_are_reused():
+    m = Memory(1024, mem_start = 0xfc00)
+    written = []
+    bits = [m.add_watcher(lambda addr, size: written.append(addr))
+                    for i in range(MAX_WATCHERS)]
+    try:
+        m.add_watcher(print)
+        assert False, "add_watcher deberia fallar"
+    except MemoryException:
+        pass
+
+    # El bit liberado se desmarca de las paginas y se vuelve a usar
+    m.watch(0xfc00, 0x100, bits[3])
+    m.remove_watcher(bits[3])
+    m.store_word_at(0xfc00, 1)
+    assert written == []
+    assert m.add_watcher(print) == bits[3]
+
+
+def test_tracer_attach_detach():
+    """ Cada attach/detach de un registro de traza libera sus bits """
+    from cpu import CPU
+    from tracer import Trace_recorder
+
+    c = CPU()
+    for i in range(3 * MAX_WATCHERS):
+        rec = Trace_recorder(capacity = 64)
+        rec.attach(c)
+        rec.detach()
+    assert all(w == None for w in c.ROM.watchers)
+
+
+def test_snapshot_restore():
+    """ Las paginas no escritas se comparten entre instantaneas, y
+        restore vuelve al contenido y al mapa de inicializacion de
+        cualquiera de ellas
+    """
+    m = Memory(1024, mem_start = 0x0200)
+    m.store_words_at(0x0200, [1, 2, 3])
+    first = m.snapshot()
+    contents = (bytes(m.mem), bytes(m.init_map))
+
+    m.store_word_at(0x0500, 0x1234)             # Ultima pagina
+    second = m.snapshot()
+    assert all(a is b for a, b in zip(first[0][:3], second[0][:3]))
+    assert first[0][3] is not second[0][3]
+
+    m.store_word_at(0x0202, 0x5678)
+    m.restore(first)
+    assert (bytes(m.mem), bytes(m.init_map)) == contents
+    try:
+        m.load_word_at(0x0500)
+        assert False, "0x0500 no deberia estar inicializada"
+    except MemoryException:
+        pass
+
+    m.restore(second)
+    assert m.load_word_at(0x0500) == 0x1234 and m.load_word_at(0x0202) == 2
+
+
+def test_snapshot_restores_code():
+    """ Volver a una instantanea descarta los bloques traducidos del
+        codigo que cambio
+    """
+    from cpu import CPU
+
+    c = CPU()
+    c.RAM.store_words_at(0x0280, [0x5315,       # inc   R5
+                                  0x3ffe])      # jmp   $-2
+    c.ROM.store_word_at(0xfffe, 0x0280)
+    c.reset()
+    snap = c.snapshot()
+
+    c.RAM.store_word_at(0x0280, 0x5316)         # inc   R6
+    c.run(10)
+    c.restore(snap)
+    c.run(10)
+    assert list(c.reg.get_registers()[5:7]) == [5, 0]
+
+
+def intel_record(addr, typ, data):
+    """ Arma un registro Intel HEX, con su suma de control """
+    record = bytes([len(data), addr >> 8, addr & 0xff, typ]) + bytes(data)
+    return ":" + (record + bytes([-sum(record) & 0xff])).hex().upper() + "\n"
+
+
+def load_lines(lines):
+    """ Carga las lineas <lines> (un archivo temporal) en una memoria
+        de 1K en 0xfc00
+    """
+    m = Memory(1024, mem_start = 0xfc00)
+    fd, fname = tempfile.mkstemp(suffix = ".hex")
+    try:
+        with os.fdopen(fd, "w") as outf:
+            outf.writelines(lines)
+        m.load_from_intel(fname)
+    finally:
+        os.remove(fname)
+    return m
+
+
+def test_intel_round_trip():
+    m = Memory(1024, mem_start = 0xfc00)
+    m.store_words_at(0xfd00, list(range(0x4000, 0x4000 + 40)))
+    m.store_byte_at(0xfe11, 0x5a)
+    m.store_word_at(0xfffe, 0xfd00)
+
+    fd, fname = tempfile.mkstemp(suffix = ".hex")
+    os.close(fd)
+    try:
+        for record_len in (16, 255):
+            m.store_to_intel(fname, record_len = record_len)
+            copy = Memory(1024, mem_start = 0xfc00)
+            copy.load_from_intel(fname)
+            assert copy.mem == m.mem
+            assert copy.init_map == m.init_map
+    finally:
+        os.remove(fname)
+
+
+def test_intel_extended_address():
+    """ Un registro 04 con base 0 deja los datos donde estaban """
+    m = load_lines([intel_record(0, 4, [0, 0]),
+                    intel_record(0xfd00, 0, [0x34, 0x12]),
+                    intel_record(0, 1, [])])
+    assert m.load_word_at(0xfd00) == 0x1234
+
+
+def test_intel_rejects_bad_records():
+    good = intel_record(0xfd00, 0, [0x34, 0x12])
+    bad_checksum = good[:-3] + "{:02X}\n".format(int(good[-3:-1], 16) ^ 1)
+    for lines in ([good, bad_checksum],             # Suma de control
+                  [good, intel_record(0, 4, [0])],  # 04 con un solo byte
+                  [good, intel_record(0, 2, [])]):  # 02 sin datos
+        try:
+            load_lines(lines)
+            assert False, "load_from_intel deberia fallar"
+        except IntelHexException as ex:
+            assert str(ex).startswith("Linea 2:")
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_runner.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Pruebas de runner.py. Se corren con pytest, o directamente (main).
+"""
+
+import os
+import sys
+import tempfile
+
+import runner
+from cpu import CPU
+
+
+def with_program(words, test):
+    """ Graba <words> (en 0xc200) como archivo HEX y corre la prueba
+        <test> del manifiesto con ese programa
+    """
+    c = CPU()
+    c.ROM.store_words_at(0xc200, words)
+    c.ROM.store_word_at(0xfffe, 0xc200)
+    fd, fname = tempfile.mkstemp(suffix = ".hex")
+    os.close(fd)
+    try:
+        c.ROM.store_to_intel(fname)
+        test = dict(test, image = fname)
+        return runner.run_test(test)
+    finally:
+        os.remove(fname)
+
+
+# Lazo sin fin: inc R5; jmp $-2
+LOOP = [0x5315, 0x3ffe]
+
+
+def test_until_reached():
+    record = with_program(LOOP, {"until": "0xc202", "max_instructions": 100})
+    assert record["passed"] and not record["timeout"]
+
+
+def test_timeout():
+    record = with_program(LOOP, {"until": "0xc204", "max_instructions": 100})
+    assert not record["passed"] and record["timeout"]
+    assert record["failures"][0].startswith("Tiempo agotado")
+    assert record["instructions"] == 100
+
+
+def test_default_limit():
+    saved = runner.MAX_INSTRUCTIONS
+    runner.MAX_INSTRUCTIONS = 500
+    try:
+        record = with_program(LOOP, {})
+    finally:
+        runner.MAX_INSTRUCTIONS = saved
+    assert record["timeout"] and record["instructions"] == 500
+
+    # Terminar por el limite pedido no es un error
+    record = with_program(LOOP, {"max_cycles": 300,
+                                 "expect": {"reason": "limit"}})
+    assert record["passed"] and not record["timeout"]
+
+
+
+def main():
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  timing.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Ciclos de reloj (MCLK) de cada instruccion del MSP430, segun el modo
+    de direccionamiento (MSP430x2xx Family User's Guide, tablas 3-14 a
+    3-16). CYCLE_TABLE tiene una entrada por opcode, igual que
+    decode.DECODE_TABLE.
+"""
+
+from array import array
+
+from decode import (DECODE_TABLE, SINGLE1, SINGLE2, RETI, JUMP, DOUBLE,
+                    PUSH, CALL)
+
+# Clases de operando fuente
+REG, IND, INC, IMM, IDX = range(5)
+
+# Formato I (doble operando): ciclos segun el destino (Rm, PC, x(Rm))
+FORMAT_I = {REG: (1, 2, 4),
+            IND: (2, 2, 5),
+            INC: (2, 3, 5),
+            IMM: (2, 3, 5),
+            IDX: (3, 3, 6)}
+
+# Formato II (simple operando): ciclos de (RRA/RRC/SWPB/SXT, PUSH, CALL)
+FORMAT_II = {REG: (1, 3, 4),
+             IND: (3, 4, 4),
+             INC: (3, 5, 5),
+             IMM: (3, 4, 5),
+             IDX: (4, 5, 5)}
+
+JUMP_CYCLES      = 2            # Saltos, tomados o no
+RETI_CYCLES      = 5
+INTERRUPT_CYCLES = 6            # Aceptacion de una interrupcion
+NOP_CYCLES       = 1            # Opcodes invalidos
+
+
+def source_class(As, reg):
+    """ Clase del operando fuente. Las constantes de R2/R3 cuentan como
+        registro.
+    """
+    if reg == 3 or (reg == 2 and As >= 2):
+        return REG
+    if As == 0:
+        return REG
+    if As == 1:
+        return IDX
+    if As == 2:
+        return IND
+    return IMM if reg == 0 else INC
+
+
+def instruction_cycles(dec):
+    group, optype, As, Ad, rs, rd = dec[0], dec[1], dec[3], dec[4], dec[6], dec[7]
+
+    if group == DOUBLE:
+        if Ad == 1:
+            dst = 2
+        elif rd == 0:
+            dst = 1
+        else:
+            dst = 0
+        return FORMAT_I[source_class(As, rs)][dst]
+
+    if group in (SINGLE1, SINGLE2):
+        if optype == PUSH:
+            column = 1
+        elif optype == CALL:
+            column = 2
+        else:
+            column = 0
+        return FORMAT_II[source_class(As, rs)][column]
+
+    if group == JUMP:
+        return JUMP_CYCLES
+    if group == RETI:
+        return RETI_CYCLES
+    return NOP_CYCLES
+
+
+CYCLE_TABLE = array('B', (instruction_cycles(dec) for dec in DECODE_TABLE))
+
+
+def main():
+    for opcode, s in ((0x4f0e, "mov   R15, R14"),
+                      (0x403f, "mov   #N, R15"),
+                      (0x4130, "ret"),
+                      (0x40f2, "mov.b #N, &EDE"),
+                      (0x1205, "push  R5"),
+                      (0x12b0, "call  #N"),
+                      (0x23fd, "jnz"),
+                      (0x1300, "reti")):
+        print("{:04x}  {:16s} {:d} ciclos".format(opcode, s, CYCLE_TABLE[opcode]))
+
+    return 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+##  tracer.py
+#
+#  Copyright 2017 Unknown <root@hp425>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+""" Registro de la ejecucion (traza), instruccion por instruccion.
+
+    La traza es una secuencia de entradas de 8 bytes (ENTRY):
+        REG     registro, valor nuevo, valor anterior
+        MEM     tamaño (1 o 2), direccion, valor nuevo, valor anterior
+        STEP    pc, opcode, cantidad de entradas REG/MEM que la preceden
+                (la entrada a una interrupcion es un STEP marcado con
+                INTERRUPT, con el vector en lugar del opcode; el tiempo
+                con el CPU apagado, uno marcado con IDLE, con los ciclos
+                en lugar del opcode y de la cantidad: 16 bits bajos y
+                altos)
+
+    Cada instruccion son sus entradas REG y MEM seguidas de la STEP, de
+    modo que la traza tambien se puede recorrer hacia atras (ver
+    history.py).
+
+    Las entradas se empaquetan en un buffer fijo. Si hay archivo, el
+    buffer se graba entero cada vez que se llena (y en flush); si no, el
+    buffer es circular y guarda las ultimas entradas.
+
+    Las escrituras a memoria se detectan con los observadores de Memory
+    (add_watcher), que avisan antes de escribir: solo se paga mientras
+    haya una traza activa.
+
+    read_trace() recorre un archivo de traza de a bloques, como
+    generador, sin cargarlo entero en memoria.
+"""
+
+import sys
+import struct
+
+from registers import Registers
+
+ENTRY = struct.Struct("<BBHHH")
+STEP, REG, MEM = range(3)
+INTERRUPT, IDLE = 1, 2          # Marcas de un STEP
+
+
+class Trace_step():
+    """ Una instruccion de la traza:
+            pc          Direccion de la instruccion
+            opcode      Primera palabra de la instruccion (o el vector,
+                        o los ciclos con el CPU apagado, segun flags)
+            flags       0, INTERRUPT o IDLE
+            regs        Lista de (registro, nuevo, anterior), sin el PC
+            writes      Lista de (direccion, tamaño, nuevo, anterior)
+    """
+    FLAG_NAMES = {0: "", INTERRUPT: "irq ", IDLE: "idle "}
+
+    def __init__(self, pc, opcode, flags = 0):
+        self.pc = pc
+        self.opcode = opcode
+        self.flags = flags
+        self.regs = []
+        self.writes = []
+
+    def __str__(self):
+        s = "{:04x}: {:s}{:04x}".format(self.pc, self.FLAG_NAMES[self.flags], self.opcode)
+        for reg, new, old in self.regs:
+            s += "  R{:d}={:04x}".format(reg, new)
+        for addr, size, new, old in self.writes:
+            s += ("  [{:04x}]={:02x}" if size == 1 else "  [{:04x}]={:04x}").format(addr, new)
+        return s
+
+
+class Trace_recorder():
+    """ Registra la ejecucion de un CPU (ver attach). <capacity> es la
+        cantidad de entradas del buffer; <fname> el archivo de salida (o
+        None para un buffer circular en memoria).
+    """
+    def __init__(self, capacity = 1 << 16, fname = None):
+        self.capacity = capacity
+        self.buf = bytearray(capacity * ENTRY.size)
+        self.pos = 0                    # Proxima entrada del buffer
+        self.count = 0                  # Entradas validas en el buffer
+        self.outf = open(fname, "wb") if fname != None else None
+
+        self.cpu = None
+        self.watches = []
+        self.writes = []
+
+
+    def attach(self, cpu):
+        """ Empieza a registrar la ejecucion de <cpu> """
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.regs = cpu.reg.get_registers()
+        self.before = list(self.regs)
+        for region in cpu.bus.regions:
+            # Los perifericos no: leer el valor anterior de algunos
+            # registros tiene efectos (RXBUF, TAIV)
+            if hasattr(region, "add_watcher") and region is not cpu.peripherals:
+                bit = region.add_watcher(self.written)
+                region.watch(region.mem_start, region.mem_size, bit)
+                self.watches.append((region, bit))
+        cpu.tracer = self
+
+
+    def detach(self):
+        """ Deja de registrar, y graba lo pendiente """
+        for region, bit in self.watches:
+            region.remove_watcher(bit)
+        self.watches = []
+        self.flush()
+        if self.cpu != None:
+            self.cpu.tracer = None
+            self.cpu = None
+
+
+    def close(self):
+        self.detach()
+        if self.outf != None:
+            self.outf.close()
+            self.outf = None
+
+
+    def written(self, addr, size):
+        """ Observador de la memoria: se llama antes de cada escritura """
+        if size == 1:
+            self.writes.append((addr, 1, self.bus.read_byte(addr)))
+        elif size == 2:
+            self.writes.append((addr, 2, self.bus.read_word(addr)))
+
+
+    def begin(self, pc):
+        """ Llamado antes de ejecutar la instruccion en <pc> """
+        self.opcode = self.bus.read_word(pc)
+        self.before[:] = self.regs
+        self.writes = []
+
+
+    def end(self, pc, new_pc, vector = None):
+        """ Llamado luego de ejecutar la instruccion en <pc>, o de
+            entrar a la interrupcion <vector>
+        """
+        regs, before = self.regs, self.before
+        changed = [r for r in range(1, 16) if regs[r] != before[r]]
+
+        for r in changed:
+            self.emit(REG, r, 0, regs[r], before[r])
+        for addr, size, old in self.writes:
+            new = self.bus.read_byte(addr) if size == 1 else self.bus.read_word(addr)
+            self.emit(MEM, size, addr, new, old)
+        if vector != None:
+            self.emit(STEP, INTERRUPT, pc, vector, len(changed) + len(self.writes))
+        else:
+            self.emit(STEP, 0, pc, self.opcode, len(changed) + len(self.writes))
+
+
+    def idle(self, pc, cycles):
+        """ <cycles> ciclos con el CPU apagado (en <pc>) """
+        while cycles > 0:
+            n = min(cycles, 0xffffffff)
+            self.emit(STEP, IDLE, pc, n & 0xffff, n >> 16)
+            cycles -= n
+
+
+    def emit(self, kind, a, b, c, d):
+        if self.pos == self.capacity:
+            if self.outf != None:
+                self.outf.write(self.buf)
+                self.count = 0
+            self.pos = 0
+        ENTRY.pack_into(self.buf, self.pos * ENTRY.size, kind, a, b, c, d)
+        self.pos += 1
+        if self.count < self.capacity:
+            self.count += 1
+
+
+    def flush(self):
+        """ Graba en el archivo las entradas pendientes del buffer """
+        if self.outf != None and self.pos:
+            self.outf.write(memoryview(self.buf)[: self.pos * ENTRY.size])
+            self.pos = self.count = 0
+            self.outf.flush()
+
+
+    def discard(self):
+        """ Descarta las entradas del buffer """
+        self.pos = self.count = 0
+
+
+    def entries(self):
+        """ Entradas del buffer en memoria, de la mas vieja a la mas nueva """
+        end = self.pos * ENTRY.size
+        if self.count > self.pos:
+            start = len(self.buf) - (self.count - self.pos) * ENTRY.size
+            yield from ENTRY.iter_unpack(memoryview(self.buf)[start:])
+        yield from ENTRY.iter_unpack(memoryview(self.buf)[max(0, end - self.count * ENTRY.size) : end])
+
+
+    def steps(self):
+        """ Instrucciones del buffer en memoria (Trace_step) """
+        return parse_steps(self.entries())
+
+
+
+def iter_entries(fname, chunk = 1 << 16):
+    """ Generador de las entradas de un archivo de traza, leido de a
+        <chunk> entradas
+    """
+    with open(fname, "rb") as inf:
+        while True:
+            data = inf.read(chunk * ENTRY.size)
+            if not data:
+                break
+            yield from ENTRY.iter_unpack(data[: len(data) - len(data) % ENTRY.size])
+
+
+def parse_steps(entries):
+    """ Agrupa las entradas en Trace_steps. Si al principio falta parte
+        de una instruccion (un buffer circular cortado a mitad de
+        instruccion), esa instruccion se descarta.
+    """
+    pending = []
+    for entry in entries:
+        kind, a, b, c, d = entry
+        if kind != STEP:
+            pending.append(entry)
+            continue
+        if a == IDLE:
+            yield Trace_step(b, c | (d << 16), IDLE)
+        elif d <= len(pending):
+            step = Trace_step(b, c, a)
+            for kind, a, b, c, d in pending[len(pending) - d:]:
+                if kind == REG:
+                    step.regs.append((a, c, d))
+                else:
+                    step.writes.append((b, a, c, d))
+            yield step
+        pending = []
+
+
+def read_trace(fname):
+    """ Generador de los Trace_step de un archivo de traza """
+    return parse_steps(iter_entries(fname))
+
+
+
+def main():
+    from cpu import CPU
+
+    c = CPU()
+    c.ROM.store_words_at(0xc200, [
+                0x4031, 0x0400,             # mov   #0x400, SP
+                0x403f, 0x0003,             # mov   #3, R15
+                0x120f,                     # push  R15
+                0x831f,                     # dec   R15
+                0x23fd,                     # jnz   $-4
+                0x3fff])                    # jmp   $
+    c.reset()
+
+    # Con un archivo, se graba todo; sin archivo quedan las ultimas
+    # entradas en el buffer circular
+    fname = sys.argv[1] if len(sys.argv) > 1 else None
+    tracer = Trace_recorder(capacity = 4 if fname else 16, fname = fname)
+    tracer.attach(c)
+    print(c.run_until(0xc20e))
+    tracer.detach()
+
+    for step in (read_trace(fname) if fname else tracer.steps()):
+        print(step)
+    tracer.close()
+    return 0
+
+if __name__ == '__main__':
+    main()